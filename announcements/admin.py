@@ -1,8 +1,24 @@
 # -*- coding=utf-8 -*-
 
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
 
-from .models import Announcement, Category, ReadStatus
+from .analytics import read_curve
+from .models import Announcement, AnnouncementReadStats, Category, DeadLetter, ReadStatus
+from .pagination import approximate_count
+
+
+class CachedCountPaginator(Paginator):
+    """
+    大表的分页器：总数使用带缓存的 COUNT（见 pagination.approximate_count），同一筛选条件 60 秒内只统计一次
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        return approximate_count(queryset, ('admin', queryset.model._meta.label, str(queryset.query)))
 
 
 @admin.register(Category)
@@ -75,6 +91,68 @@ class ReadStatusAdmin(admin.ModelAdmin):
     """
 
     list_display = ('user', 'announcement', 'read_at')
-    list_filter = ('user', 'announcement', 'read_at')
+    # 不按用户/公告筛选：筛选栏会列出全部用户和公告；按某个用户或公告查看可使用搜索或阅读统计
+    list_filter = ('read_at',)
     search_fields = ('user__username', 'announcement__title')
     raw_id_fields = ('user', 'announcement')  # 对于ForeignKey字段，使用raw_id_fields
+    list_select_related = ('user', 'announcement')
+    paginator = CachedCountPaginator
+    show_full_result_count = False # 不再额外统计未筛选的总数
+
+
+@admin.register(AnnouncementReadStats)
+class AnnouncementReadStatsAdmin(admin.ModelAdmin):
+    """
+    公告阅读统计界面：只读取汇总表（见 announcements/analytics.py），不统计阅读记录原始表
+    """
+
+    list_display = ('announcement', 'audience', 'reads', 'read_rate_display', 'first_read_at', 'last_read_at')
+    list_select_related = ('announcement',)
+    search_fields = ('announcement__title',)
+    fields = ('announcement', 'audience', 'reads', 'read_rate_display', 'first_read_at', 'last_read_at', 'updated_at', 'curve')
+    readonly_fields = fields
+    ordering = ('-announcement',)
+
+    @admin.display(description='阅读率')
+    def read_rate_display(self, obj):
+        return '-' if obj.read_rate is None else f'{obj.read_rate:.1%}'
+
+    @admin.display(description='阅读率曲线')
+    def curve(self, obj):
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>',
+            (
+                (point['hour'].strftime('%Y-%m-%d %H:00'), point['reads'], point['cumulative'],
+                 '-' if point['read_rate'] is None else f"{point['read_rate']:.1%}")
+                for point in read_curve(obj)
+            ),
+        )
+        return format_html(
+            '<table><thead><tr><th>小时（UTC）</th><th>阅读数</th><th>累计</th><th>阅读率</th></tr></thead>'
+            '<tbody>{}</tbody></table>', rows,
+        )
+
+    def get_queryset(self, request):
+        # 与公告管理一致：超级用户可以看到所有公告的统计，其他用户只能看到自己发布的公告
+        qs = super().get_queryset(request)
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(announcement__author=request.user)
+
+    def has_add_permission(self, request):
+        return False # 汇总行由系统维护
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    """
+    发送失败的通知管理界面
+    """
+
+    list_display = ('channel', 'announcement', 'user', 'address', 'attempts', 'created_at')
+    list_filter = ('channel', 'created_at')
+    search_fields = ('address', 'error', 'announcement__title')
+    raw_id_fields = ('user', 'announcement')
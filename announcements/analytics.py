@@ -0,0 +1,254 @@
+# -*- coding=utf-8 -*-
+
+# announcements/analytics.py
+
+"""
+阅读统计汇总（增量维护），发布者查看“多少接收者已读”时不再统计 ReadStatus 原始表：
+
+- AnnouncementReadStats：每条公告的受众人数（生效时快照收件箱人数）、已读人数、首次/最近阅读时间
+- AnnouncementReadHourly：每条公告每小时（UTC 整点）的首次阅读数，累加后除以受众人数即阅读率曲线
+
+维护方式：
+- 公告生效时（见 announcements/publishing.py）快照受众人数；汇总行不存在时（迁移前生效的公告等）在首次累加时按收件箱人数创建
+- 写入/删除阅读记录的事务提交后只把增量记入进程内队列（不在请求内执行），由阅读回执缓冲区的后台线程在每次刷新时
+  按公告分组用 UPDATE ... SET reads = reads + n 累加（见 announcements/receipts.py）。
+  settings.ANNOUNCEMENTS_READ_ANALYTICS_MODE = 'sync' 时在写入阅读记录的同时累加
+- 标记未读时只减少已读人数，每小时首次阅读数不回退
+- rebuild_read_analytics 命令从原始表重新计算（历史数据、直接写库造成的偏差）
+"""
+
+import datetime
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Value
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+
+from .models import AnnouncementReadHourly, AnnouncementReadStats, InboxEntry, ReadStatus
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _hour(moment):
+    return moment.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _group(values):
+    """
+    {公告ID: 增量} -> {增量: [公告ID]}，相同增量的公告用一条 UPDATE
+    """
+    groups = defaultdict(list)
+    for announcement_id, value in values.items():
+        groups[value].append(announcement_id)
+    return groups.items()
+
+
+def _audiences(announcement_ids):
+    counts = dict.fromkeys(announcement_ids, 0)
+    counts.update(
+        InboxEntry.objects.filter(announcement_id__in=announcement_ids)
+        .values('announcement_id').annotate(n=Count('id')).values_list('announcement_id', 'n')
+    )
+    return counts
+
+
+def snapshot_audience(announcement_id):
+    """
+    公告生效时记录受众人数（收件箱条目数）
+    """
+    audience = InboxEntry.objects.filter(announcement_id=announcement_id).count()
+    AnnouncementReadStats.objects.bulk_create(
+        [AnnouncementReadStats(announcement_id=announcement_id, audience=audience)],
+        update_conflicts=True, unique_fields=['announcement'], update_fields=['audience', 'updated_at'],
+    )
+    return audience
+
+
+def _increment(queryset, ids, create, insert_first=False, **updates):
+    """
+    对 ids 对应的汇总行累加。create(缺失的公告ID列表) 返回计数为 0 的新行
+    （并发插入时 ignore_conflicts 跳过已存在的行），插入后再统一累加：
+    - insert_first=False：先 UPDATE，影响的行数不足时插入缺失的行再累加（行通常已存在时使用）
+    - insert_first=True：先插入再 UPDATE，固定两条语句（行通常不存在时使用）
+    """
+    if not insert_first:
+        updated = queryset.filter(announcement_id__in=ids).update(**updates)
+        if updated == len(ids):
+            return
+        if updated:
+            existing = set(queryset.filter(announcement_id__in=ids).values_list('announcement_id', flat=True))
+            ids = [announcement_id for announcement_id in ids if announcement_id not in existing]
+    queryset.model.objects.bulk_create(create(ids), ignore_conflicts=True)
+    queryset.filter(announcement_id__in=ids).update(**updates)
+
+
+def _new_stats(announcement_ids):
+    # 没有生效快照的公告：按当前收件箱人数作为受众人数
+    audiences = _audiences(announcement_ids)
+    return [AnnouncementReadStats(announcement_id=pk, audience=audiences[pk]) for pk in announcement_ids]
+
+
+def _apply_reads(pairs, read_at):
+    counts = Counter(announcement_id for _, announcement_id in pairs)
+    hour = _hour(read_at)
+    for n, ids in _group(counts):
+        _increment(
+            AnnouncementReadStats.objects.all(), ids, _new_stats,
+            reads=F('reads') + n, last_read_at=read_at, first_read_at=Coalesce(F('first_read_at'), Value(read_at)),
+        )
+        # 每条公告每小时的第一次阅读都要新建行，先插入
+        _increment(
+            AnnouncementReadHourly.objects.filter(hour=hour), ids,
+            lambda pks: [AnnouncementReadHourly(announcement_id=pk, hour=hour) for pk in pks], insert_first=True,
+            reads=F('reads') + n,
+        )
+
+
+def _apply_removed(announcement_ids):
+    for n, ids in _group(Counter(announcement_ids)):
+        AnnouncementReadStats.objects.filter(announcement_id__in=ids).update(reads=F('reads') - n)
+
+
+class RollupQueue:
+    """
+    进程内待累加的阅读统计增量，属于阅读回执缓冲区（ReadReceiptBuffer.rollups），由其后台线程调用 flush() 落库
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = [] # ('reads', pairs, read_at) / ('user_reads_at', user_id, read_at) / ('removed', ids)
+
+    def add(self, *item):
+        with self._lock:
+            self._items.append(item)
+
+    def flush(self):
+        """
+        按登记顺序累加，返回处理的条目数；失败的条目留在队列中下次重试
+        """
+        with self._lock:
+            items, self._items = self._items, []
+        for index, item in enumerate(items):
+            try:
+                _apply(item)
+            except Exception:
+                logger.exception('阅读统计累加失败，%d 条增量将在下次刷新时重试', len(items) - index)
+                with self._lock:
+                    self._items[:0] = items[index:]
+                return index
+        return len(items)
+
+
+def _apply(item):
+    kind = item[0]
+    if kind == 'reads':
+        _apply_reads(item[1], item[2])
+    elif kind == 'user_reads_at':
+        # mark_all_read 一条 INSERT ... SELECT 写入的记录 read_at 都相同，按 (user, -read_at) 索引取回公告ID
+        _, user_id, read_at = item
+        ids = ReadStatus.objects.filter(user_id=user_id, read_at=read_at).values_list('announcement_id', flat=True)
+        _apply_reads([(user_id, announcement_id) for announcement_id in ids], read_at)
+    else:
+        _apply_removed(item[1])
+
+
+def _enqueue(item):
+    from .receipts import get_receipt_buffer # 避免循环导入：receipts 依赖 read_state，read_state 依赖本模块
+
+    buffer = get_receipt_buffer()
+    buffer.rollups.add(*item)
+    buffer.ensure_worker()
+
+
+def _submit(*item):
+    if getattr(settings, 'ANNOUNCEMENTS_READ_ANALYTICS_MODE', 'deferred') == 'sync':
+        _apply(item)
+        return
+    # 阅读记录提交后才登记增量：回滚的写入不计入统计
+    transaction.on_commit(lambda: _enqueue(item))
+
+
+def on_reads_recorded(pairs, read_at=None):
+    """
+    新写入阅读记录 [(user_id, announcement_id)] 后登记累加
+    """
+    pairs = list(pairs)
+    if pairs:
+        _submit('reads', pairs, read_at or timezone.now())
+
+
+def on_user_reads_recorded(user_id, read_at):
+    """
+    mark_all_read 以 read_at 为用户写入了一批阅读记录后登记累加（公告ID在累加时取回）
+    """
+    _submit('user_reads_at', user_id, read_at)
+
+
+def on_reads_removed(announcement_ids):
+    """
+    删除阅读记录（标记未读）后登记减少已读人数；announcement_ids 中每出现一次表示删除了一条记录
+    """
+    announcement_ids = list(announcement_ids)
+    if announcement_ids:
+        _submit('removed', announcement_ids)
+
+
+def read_curve(stats):
+    """
+    阅读率曲线：[{hour, reads, cumulative, read_rate}]，只读取该公告的每小时汇总行
+    """
+    curve, cumulative = [], 0
+    for hour, reads in stats.announcement.read_hourly.values_list('hour', 'reads'):
+        cumulative += reads
+        curve.append({
+            'hour': hour,
+            'reads': reads,
+            'cumulative': cumulative,
+            'read_rate': cumulative / stats.audience if stats.audience else None,
+        })
+    return curve
+
+
+def rebuild_read_analytics(announcement_ids):
+    """
+    从收件箱和阅读记录原始表重新计算一批公告的汇总，返回处理的公告数
+    """
+    announcement_ids = list(announcement_ids)
+    for start in range(0, len(announcement_ids), BATCH_SIZE):
+        chunk = announcement_ids[start:start + BATCH_SIZE]
+        audience = _audiences(chunk)
+        reads = {
+            row['announcement_id']: row for row in
+            ReadStatus.objects.filter(announcement_id__in=chunk).values('announcement_id')
+            .annotate(n=Count('id'), first=Min('read_at'), last=Max('read_at'))
+        }
+        hourly = (
+            ReadStatus.objects.filter(announcement_id__in=chunk)
+            .annotate(hour=TruncHour('read_at', tzinfo=datetime.timezone.utc))
+            .values('announcement_id', 'hour').annotate(n=Count('id'))
+        )
+        AnnouncementReadStats.objects.bulk_create(
+            [
+                AnnouncementReadStats(
+                    announcement_id=announcement_id, audience=audience[announcement_id],
+                    reads=reads[announcement_id]['n'] if announcement_id in reads else 0,
+                    first_read_at=reads[announcement_id]['first'] if announcement_id in reads else None,
+                    last_read_at=reads[announcement_id]['last'] if announcement_id in reads else None,
+                )
+                for announcement_id in chunk
+            ],
+            update_conflicts=True, unique_fields=['announcement'],
+            update_fields=['audience', 'reads', 'first_read_at', 'last_read_at', 'updated_at'],
+        )
+        AnnouncementReadHourly.objects.filter(announcement_id__in=chunk).delete()
+        AnnouncementReadHourly.objects.bulk_create(
+            AnnouncementReadHourly(announcement_id=row['announcement_id'], hour=row['hour'], reads=row['n'])
+            for row in hourly
+        )
+    return len(announcement_ids)
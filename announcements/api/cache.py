@@ -0,0 +1,201 @@
+# -*- coding=utf-8 -*-
+
+# announcements/api/cache.py
+
+"""
+公告序列化结果缓存（两层）：
+
+1. 与用户无关的公告主体（序列化器默认字段中除 is_read 外的全部字段）按公告、按序列化器缓存，值为 (updated_at, 主体)，
+   读取时 updated_at 与当前行不一致视为过期；公告保存/删除、接收者变更时主动删除
+2. 构造响应时再叠加每个用户的 is_read（来自 with_read_state 注解）
+
+缓存按 settings.ANNOUNCEMENTS_SERIALIZER_CACHES 中的顺序分级查找（默认进程内 LRU 的 locmem，
+其后是多进程共享的文件缓存），下一级命中时回填上一级。分类、用户名、用户组名变化时递增代数（generation），
+使所有主体失效；代数在进程内缓存 GENERATION_TTL 秒，不必每个请求都读取共享缓存。命中率统计见 cache_stats()。
+"""
+
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+
+from ..metrics import SERIALIZER_CACHE
+from ..profiling import timed
+
+BODY_TIMEOUT = 3600
+GENERATION_KEY = 'announcements:body:generation'
+GENERATION_TTL = 1 # 进程内缓存代数的时间（秒），其他进程递增代数后最多在此时间后生效
+
+
+class CacheMetrics:
+    """
+    各级缓存的命中/未命中次数（进程内）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter() # 缓存别名 -> 命中次数
+        self.misses = 0 # 所有层级都未命中（需要重新序列化）的次数
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits.update(hits)
+            self.misses += misses
+
+    def snapshot(self):
+        with self._lock:
+            hits = dict(self.hits)
+            misses = self.misses
+        total = sum(hits.values()) + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': (sum(hits.values()) / total) if total else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses = 0
+
+
+metrics = CacheMetrics()
+
+
+def _aliases():
+    return getattr(settings, 'ANNOUNCEMENTS_SERIALIZER_CACHES', ['default'])
+
+
+def _tiers():
+    return [caches[alias] for alias in _aliases()]
+
+
+_generation = (None, 0) # (代数, 过期时间)
+
+
+def body_generation():
+    global _generation
+    generation, expires = _generation
+    if generation is not None and time.monotonic() < expires:
+        return generation
+    shared = _tiers()[-1]
+    generation = shared.get(GENERATION_KEY)
+    if generation is None:
+        # 代数键被淘汰：从本进程已知的代数继续递增，不回到可能仍有旧主体缓存的代数
+        known = (_generation[0] or 0) + 1
+        shared.add(GENERATION_KEY, known, None)
+        generation = shared.get(GENERATION_KEY, known)
+    _generation = (generation, time.monotonic() + GENERATION_TTL)
+    return generation
+
+
+def _body_key(serializer_class, announcement_id, generation):
+    return f'announcements:body:{serializer_class.__name__}:{generation}:{announcement_id}'
+
+
+def invalidate_announcements(announcement_ids):
+    """
+    删除公告的缓存主体（所有层级、所有序列化器）
+    """
+    from .serializers import CACHED_SERIALIZERS
+
+    generation = body_generation()
+    keys = [
+        _body_key(serializer_class, announcement_id, generation)
+        for serializer_class in CACHED_SERIALIZERS for announcement_id in announcement_ids
+    ]
+    for tier in _tiers():
+        tier.delete_many(keys)
+
+
+def reset_local_generation():
+    """
+    丢弃进程内缓存的代数，下次从共享缓存读取（清空共享缓存后调用，如测试）
+    """
+    global _generation
+    _generation = (None, 0)
+
+
+def bump_generation():
+    """
+    使所有缓存的主体失效（分类、用户、用户组变化时调用）
+    """
+    global _generation
+    shared = _tiers()[-1]
+    try:
+        shared.incr(GENERATION_KEY)
+    except ValueError: # 代数键已被淘汰：从本进程已知的代数继续递增，避免回到旧代数
+        shared.set(GENERATION_KEY, (_generation[0] or 1) + 1, None)
+    _generation = (None, 0)
+
+
+def serialize_announcements(instances, serializer_class, context, fields=None):
+    """
+    序列化公告列表：主体优先从缓存读取，未命中的批量序列化后写入缓存，最后叠加当前用户的 is_read。
+    fields 为选定的字段（?fields= / ?expand=）：都在默认字段内时从缓存的主体中截取，
+    否则不经过缓存，只预取这些字段需要的关联对象后直接序列化
+    """
+    with timed('serializer'): # 计入请求剖析的序列化耗时
+        return _serialize_announcements(instances, serializer_class, context, fields)
+
+
+def _serialize_announcements(instances, serializer_class, context, fields):
+    instances = list(instances)
+    if not instances:
+        return []
+    if fields is not None and not set(fields) <= set(serializer_class.default_fields):
+        prefetch_related_objects(instances, *serializer_class.prefetch_for(fields))
+        return serializer_class(instances, many=True, context=context, selected_fields=fields).data
+    generation = body_generation()
+    keys = {instance.pk: _body_key(serializer_class, instance.pk, generation) for instance in instances}
+    bodies, hits = {}, Counter()
+    aliases, tiers = _aliases(), _tiers()
+    for level, tier in enumerate(tiers):
+        wanted = [keys[instance.pk] for instance in instances if instance.pk not in bodies]
+        if not wanted:
+            break
+        found = tier.get_many(wanted)
+        backfill = {}
+        for instance in instances:
+            entry = found.get(keys[instance.pk])
+            if instance.pk not in bodies and entry is not None and entry[0] == instance.updated_at:
+                bodies[instance.pk] = entry[1]
+                hits[aliases[level]] += 1
+                backfill[keys[instance.pk]] = entry
+        for upper in tiers[:level]:
+            upper.set_many(backfill, BODY_TIMEOUT)
+
+    missing = [instance for instance in instances if instance.pk not in bodies]
+    if missing:
+        # 只为未命中的公告预取接收者等关联对象
+        prefetch_related_objects(missing, *serializer_class.prefetch_for(serializer_class.default_fields))
+        entries = {}
+        serializer = serializer_class(missing, many=True, context=context, selected_fields=serializer_class.default_fields)
+        for instance, data in zip(missing, serializer.data):
+            body = {key: value for key, value in data.items() if key != 'is_read'}
+            bodies[instance.pk] = body
+            entries[keys[instance.pk]] = (instance.updated_at, body)
+        for tier in tiers:
+            tier.set_many(entries, BODY_TIMEOUT)
+    metrics.record(hits, len(missing))
+    for alias, count in hits.items():
+        SERIALIZER_CACHE.inc(count, result=alias)
+    if missing:
+        SERIALIZER_CACHE.inc(len(missing), result='miss')
+
+    serializer = serializer_class(context=context)
+    results = []
+    for instance in instances:
+        data = dict(bodies[instance.pk])
+        data['is_read'] = serializer.get_is_read(instance)
+        if fields is not None:
+            data = {name: data[name] for name in fields}
+        results.append(data)
+    return results
+
+
+def cache_stats():
+    return metrics.snapshot()
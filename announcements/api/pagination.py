@@ -0,0 +1,68 @@
+# -*- coding=utf-8 -*-
+
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from announcements.pagination import KeysetPaginator, InvalidCursor, approximate_count
+
+class KeysetCursorPagination(BasePagination):
+    """
+    键集（游标）分页：
+    - ?cursor=<游标> 获取下一页，响应中的 next 为下一页的完整URL
+    - ?page_size=<数量> 每页数量（不超过 max_page_size）
+    - ?with_count=1 返回带缓存的近似总数
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value and value.isdigit() and int(value) > 0:
+            return min(int(value), self.max_page_size)
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.get_page_size(request))
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('无效的游标。')
+
+        self.count = None
+        if request.query_params.get('with_count') in ('1', 'true'):
+            params = sorted(
+                (key, value) for key, value in request.query_params.items()
+                if key not in (self.cursor_query_param, self.page_size_query_param)
+            )
+            self.count = approximate_count(queryset, (request.path, request.user.pk, params))
+        return self.page.items
+
+    def get_next_link(self):
+        if not self.page.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        body = OrderedDict([('next', self.get_next_link())])
+        if self.count is not None:
+            body['count'] = self.count
+        body['results'] = data
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
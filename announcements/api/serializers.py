@@ -1,7 +1,11 @@
 # -*- coding=utf-8 -*-
 
 from rest_framework import serializers
-from announcements.models import Announcement, Category, ReadStatus
+from django.db import transaction
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+from announcements.analytics import read_curve
+from announcements.models import Announcement, AnnouncementReadStats, Category, ReadStatus
 from django.contrib.auth.models import User, Group
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -28,7 +32,36 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         fields = ['id', 'name']
 
-class AnnouncementSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    按需选择字段：实例化时传入 selected_fields，只保留其中的字段（见 AnnouncementViewSet.selected_fields）
+    - default_fields: 不指定 fields/expand 时返回的字段
+    - expandable_fields: 默认不返回、可通过 expand 追加的字段
+    - field_prefetch / field_select_related: 各字段需要预取 / 连接的关联对象
+    """
+    expandable_fields = ()
+    field_prefetch = {'target_users': 'target_users', 'target_groups': 'target_groups'}
+    field_select_related = {'category': 'category', 'category_name': 'category', 'author': 'author'}
+
+    def __init__(self, *args, selected_fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if selected_fields is not None:
+            for name in set(self.fields) - set(selected_fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def readable_fields(cls):
+        return [*cls.default_fields, *cls.expandable_fields]
+
+    @classmethod
+    def prefetch_for(cls, fields):
+        return [cls.field_prefetch[name] for name in fields if name in cls.field_prefetch]
+
+    @classmethod
+    def select_related_for(cls, fields):
+        return sorted({cls.field_select_related[name] for name in fields if name in cls.field_select_related})
+
+class AnnouncementSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     公告序列化器
     """
@@ -60,15 +93,24 @@ class AnnouncementSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['author', 'created_at', 'updated_at', 'is_published']
 
+    default_fields = [
+        'id', 'title', 'content', 'category', 'author', 'publish_at', 'is_published',
+        'target_users', 'target_groups', 'emergency_level', 'created_at', 'updated_at', 'is_read',
+    ]
+
     def get_is_read(self, obj):
         """
         判断当前请求用户是否已阅读该公告
+        列表查询集已通过 with_read_state 注解 is_read，此时不再额外查询
         """
+        if hasattr(obj, 'is_read'):
+            return obj.is_read
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return ReadStatus.objects.filter(user=request.user, announcement=obj).exists()
         return False
 
+    @transaction.atomic
     def create(self, validated_data):
         target_users_ids = validated_data.pop('target_users_ids', [])
         target_groups_ids = validated_data.pop('target_groups_ids', [])
@@ -82,6 +124,7 @@ class AnnouncementSerializer(serializers.ModelSerializer):
         announcement.target_groups.set(target_groups_ids)
         return announcement
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         target_users_ids = validated_data.pop('target_users_ids', None)
         target_groups_ids = validated_data.pop('target_groups_ids', None)
@@ -100,14 +143,103 @@ class AnnouncementSerializer(serializers.ModelSerializer):
         
         return instance
 
+class AnnouncementListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    公告列表序列化器（精简）：默认只返回列表展示需要的字段，不包含正文和接收者，
+    其余字段可通过 ?expand= 追加
+    """
+    EXCERPT_LENGTH = 120
+
+    excerpt = serializers.SerializerMethodField()
+    category_name = serializers.CharField(source='category.name', read_only=True, default=None)
+    category = CategorySerializer(read_only=True)
+    author = UserSerializer(read_only=True)
+    target_users = UserSerializer(many=True, read_only=True)
+    target_groups = GroupSerializer(many=True, read_only=True)
+    is_read = serializers.SerializerMethodField()
+
+    default_fields = ['id', 'title', 'excerpt', 'category_name', 'emergency_level', 'publish_at', 'is_read']
+    expandable_fields = [
+        'content', 'category', 'author', 'target_users', 'target_groups', 'is_published', 'created_at', 'updated_at',
+    ]
+
+    class Meta:
+        model = Announcement
+        fields = [
+            'id', 'title', 'excerpt', 'category_name', 'emergency_level', 'publish_at', 'is_read',
+            'content', 'category', 'author', 'target_users', 'target_groups', 'is_published', 'created_at', 'updated_at',
+        ]
+
+    def get_excerpt(self, obj):
+        """
+        正文摘要：渲染后的 HTML 去掉标签后截断
+        """
+        text = ' '.join(strip_tags(obj.get_markdown_content()).split())
+        return Truncator(text).chars(self.EXCERPT_LENGTH)
+
+    get_is_read = AnnouncementSerializer.get_is_read
+
+# 主体会被缓存的序列化器，公告变化时逐个删除其缓存
+CACHED_SERIALIZERS = [AnnouncementSerializer, AnnouncementListSerializer]
+
 class ReadStatusSerializer(serializers.ModelSerializer):
     """
-    阅读状态序列化器
+    阅读状态序列化器（阅读历史）：公告摘要平铺在记录中，只依赖 select_related 取回的
+    announcement、announcement.category 和 announcement.author，不再逐行查询接收者和已读状态
     """
-    announcement = AnnouncementSerializer(read_only=True)
-    user = UserSerializer(read_only=True)
+    announcement = serializers.PrimaryKeyRelatedField(read_only=True)
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+    title = serializers.CharField(source='announcement.title', read_only=True)
+    category_name = serializers.CharField(source='announcement.category.name', read_only=True, default=None)
+    author_name = serializers.CharField(source='announcement.author.username', read_only=True, default=None)
+    emergency_level = serializers.CharField(source='announcement.emergency_level', read_only=True)
+    publish_at = serializers.DateTimeField(source='announcement.publish_at', read_only=True)
 
     class Meta:
         model = ReadStatus
-        fields = ['id', 'user', 'announcement', 'read_at']
+        fields = [
+            'id', 'user', 'announcement', 'title', 'category_name', 'author_name',
+            'emergency_level', 'publish_at', 'read_at',
+        ]
         read_only_fields = ['user', 'read_at']
+
+class ReadStatusBulkSerializer(serializers.Serializer):
+    """
+    批量标记已读/未读的请求参数
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+
+class MarkAllReadSerializer(serializers.Serializer):
+    """
+    全部标记已读的请求参数：只处理在 before 之前发布的公告（默认当前时间）
+    """
+    before = serializers.DateTimeField(required=False)
+
+class AnnouncementReadStatsSerializer(serializers.ModelSerializer):
+    """
+    公告阅读统计序列化器：只依赖汇总行和 select_related 取回的公告
+    """
+    title = serializers.CharField(source='announcement.title', read_only=True)
+    publish_at = serializers.DateTimeField(source='announcement.publish_at', read_only=True)
+    read_rate = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = AnnouncementReadStats
+        fields = ['announcement', 'title', 'publish_at', 'audience', 'reads', 'read_rate', 'first_read_at', 'last_read_at']
+        read_only_fields = fields
+
+class AnnouncementReadStatsDetailSerializer(AnnouncementReadStatsSerializer):
+    """
+    公告阅读统计详情：附带阅读率曲线（每小时汇总行）
+    """
+    curve = serializers.SerializerMethodField()
+
+    class Meta(AnnouncementReadStatsSerializer.Meta):
+        fields = AnnouncementReadStatsSerializer.Meta.fields + ['curve']
+        read_only_fields = fields
+
+    def get_curve(self, obj):
+        return [
+            {**point, 'hour': serializers.DateTimeField().to_representation(point['hour'])}
+            for point in read_curve(obj)
+        ]
@@ -8,6 +8,7 @@ from .views import (
     ReadStatusViewSet,
     UserReadOnlyViewSet,
     GroupReadOnlyViewSet,
+    ReadAnalyticsViewSet,
 )
 
 router = DefaultRouter()
@@ -16,6 +17,7 @@ router.register(r'categories', CategoryViewSet)
 router.register(r'read-status', ReadStatusViewSet)
 router.register(r'users', UserReadOnlyViewSet)  # 提供用户列表，用于公告指定接收者
 router.register(r'groups', GroupReadOnlyViewSet)  # 提供用户组列表，用于公告指定接收组
+router.register(r'read-analytics', ReadAnalyticsViewSet)  # 公告阅读统计（汇总表）
 
 urlpatterns = [
     path('', include(router.urls)),
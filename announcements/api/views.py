@@ -1,15 +1,32 @@
 # -*- coding=utf-8 -*-
 
-from rest_framework import viewsets, status
+import json
+
+from rest_framework import serializers, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAdminUser, DjangoModelPermissions
+from rest_framework.permissions import BasePermission, IsAuthenticated, IsAdminUser, DjangoModelPermissions
 from django.utils import timezone
 from django.db.models import Q
 from django.contrib.auth.models import User, Group
+from django.http import StreamingHttpResponse
 
-from announcements.models import Announcement, Category, ReadStatus
-from .serializers import AnnouncementSerializer, CategorySerializer, ReadStatusSerializer, UserSerializer, GroupSerializer
+from announcements.models import Announcement, AnnouncementReadStats, Category, ReadStatus
+from announcements.conditional import detail_validators, list_validators, not_modified, set_validators
+from announcements.counters import get_unread_count
+from announcements.directory import filter_prefix, iter_name_chunks
+from announcements import read_state
+from announcements.read_state import with_read_state
+from announcements.receipts import mark_read
+from announcements.search import search_announcements
+from .cache import cache_stats, serialize_announcements
+from .pagination import KeysetCursorPagination
+from .serializers import (
+    AnnouncementSerializer, AnnouncementListSerializer, CategorySerializer, ReadStatusSerializer,
+    UserSerializer, GroupSerializer, ReadStatusBulkSerializer, MarkAllReadSerializer,
+    AnnouncementReadStatsSerializer, AnnouncementReadStatsDetailSerializer,
+)
 from announcements.views import ANNOUNCER_PERMISSIONS # 导入权限定义
 
 class IsAnnouncerOrAdmin(DjangoModelPermissions):
@@ -45,7 +62,8 @@ class AnnouncementViewSet(viewsets.ModelViewSet):
     """
     公告API视图集：
     - 提供公告的CRUD操作
-    - 列表支持过滤、搜索、分页
+    - 列表支持过滤、搜索、分页，默认返回精简字段
+    - ?fields=id,title 只返回指定字段，?expand=content,target_users 追加默认不返回的字段
     - 详情自动标记已读
     - 权限控制
     """
@@ -53,6 +71,19 @@ class AnnouncementViewSet(viewsets.ModelViewSet):
     serializer_class = AnnouncementSerializer
     permission_classes = [IsAuthenticated, IsAnnouncerOrAdmin] # 默认需要认证和发布者/管理员权限
 
+    @property
+    def paginator(self):
+        """
+        ?pagination=cursor 或携带 cursor 参数时使用键集分页（小程序无限滚动），否则沿用默认分页设置
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = KeysetCursorPagination()
+            else:
+                return super().paginator
+        return self._paginator
+
     def get_queryset(self):
         """
         根据用户权限和可见性过滤公告
@@ -60,27 +91,28 @@ class AnnouncementViewSet(viewsets.ModelViewSet):
         - 其他请求 (create, update, delete): 权限由 IsAnnouncerOrAdmin 控制
         """
         user = self.request.user
-        if self.action in ['list', 'retrieve']:
-            # 获取所有已发布的公告
-            queryset = Announcement.objects.filter(publish_at__lte=timezone.now()).distinct()
-
-            # 过滤用户可见的公告：
-            # 1. 发布给所有用户 (target_users为空且target_groups为空)
-            # 2. 发布给当前用户 (target_users包含当前用户)
-            # 3. 发布给当前用户所属的用户组 (target_groups包含当前用户所属的任何组)
-            queryset = queryset.filter(
-                Q(target_users__isnull=True, target_groups__isnull=True) | # 发布给所有用户
-                Q(target_users=user) | # 发布给当前用户
-                Q(target_groups__in=user.groups.all()) # 发布给当前用户所属的组
-            ).distinct()
-
-            # 搜索功能
+        if self.action in ['list', 'retrieve', 'my_announcements']:
+            # 获取用户可见且已发布的公告（可见性由收件箱物化表维护，见 announcements/inbox.py）；
+            # 详情按主键取出后由 Announcement.is_visible_to 判断，与HTML详情页一致
+            queryset = Announcement.objects.published()
+            if self.action != 'retrieve':
+                queryset = queryset.visible_to(user)
+            # 随主查询取回已读标记，避免逐行查询
+            # 接收者只在选定字段需要、且序列化缓存未命中时预取（见 announcements/api/cache.py）
+            # 只连接选定字段需要的关联对象
+            serializer_class = self.get_serializer_class()
+            queryset = queryset.select_related(
+                *serializer_class.select_related_for(self.selected_fields() or serializer_class.default_fields)
+            )
+            queryset = with_read_state(queryset, user)
+
+            # 搜索功能：有关键词时按相关度排序
             query = self.request.query_params.get('q', None)
             if query:
-                queryset = queryset.filter(Q(title__icontains=query) | Q(content__icontains=query))
+                return search_announcements(queryset, query, user=user if self.action != 'retrieve' else None)
 
-            # 排序：紧急程度优先，然后发布时间倒序
-            return queryset.order_by('-emergency_level_order', '-publish_at')
+            # 排序：紧急程度优先，然后发布时间倒序（id 保证顺序唯一，供游标分页使用）
+            return queryset.order_by('-emergency_level_numeric', '-publish_at', '-id')
         
         # 对于非 GET 请求，如果用户是超级管理员，显示所有公告
         # 否则，只显示用户自己发布的公告 (如果需要)
@@ -95,41 +127,102 @@ class AnnouncementViewSet(viewsets.ModelViewSet):
         """
         serializer.save(author=self.request.user)
 
+    def get_serializer_class(self):
+        """
+        列表使用精简的序列化器，详情和写操作使用完整的序列化器
+        """
+        if self.action in ['list', 'my_announcements']:
+            return AnnouncementListSerializer
+        return AnnouncementSerializer
+
+    def selected_fields(self):
+        """
+        解析 ?fields= 和 ?expand=，返回按序列化器字段顺序排列的字段列表；都未指定时返回 None（默认字段）
+        """
+        if not hasattr(self, '_selected_fields'):
+            serializer_class = self.get_serializer_class()
+            params = self.request.query_params
+            fields, expand = (
+                [name.strip() for name in params.get(key, '').split(',') if name.strip()] for key in ('fields', 'expand')
+            )
+            unknown = set(fields + expand) - set(serializer_class.readable_fields())
+            if unknown:
+                raise ValidationError({'fields': f"未知字段：{', '.join(sorted(unknown))}"})
+            if fields or expand:
+                wanted = set(fields or serializer_class.default_fields) | set(expand)
+                self._selected_fields = [name for name in serializer_class.readable_fields() if name in wanted]
+            else:
+                self._selected_fields = None
+        return self._selected_fields
+
+    def serialize(self, instances):
+        """
+        序列化公告：与用户无关的主体从缓存读取，再叠加当前用户的 is_read
+        """
+        return serialize_announcements(
+            instances, self.get_serializer_class(), self.get_serializer_context(), self.selected_fields()
+        )
+
+    def paginated_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.serialize(page))
+        return Response(self.serialize(queryset))
+
+    def list(self, request, *args, **kwargs):
+        """
+        公告列表；内容未变化时按 If-None-Match 返回 304（见 announcements/conditional.py）
+        """
+        etag = list_validators(request, request.user)
+        response = not_modified(request, etag)
+        if response is None:
+            response = self.paginated_response(self.filter_queryset(self.get_queryset()))
+        return set_validators(response, etag)
+
     def retrieve(self, request, *args, **kwargs):
         """
-        获取公告详情时，自动标记为已读
+        获取公告详情时，自动标记为已读（写入阅读回执缓冲区，由后台线程批量落库）
         """
         instance = self.get_object()
+        if not instance.is_visible_to(request.user):
+            raise NotFound()
         if request.user.is_authenticated:
-            ReadStatus.objects.get_or_create(user=request.user, announcement=instance)
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+            mark_read(request.user, instance)
+            instance.is_read = True # 注解在标记之前计算，这里同步为已读
+        etag = detail_validators(request, instance)
+        response = not_modified(request, etag)
+        if response is None:
+            response = Response(self.serialize([instance])[0])
+        return set_validators(response, etag)
 
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my_announcements(self, request):
         """
-        获取当前用户已读/未读的公告列表
+        获取当前用户已读/未读的公告列表（同样支持条件请求）
         """
-        user = request.user
+        etag = list_validators(request, request.user)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
         read_status_filter = request.query_params.get('read_status', None) # 'read' 或 'unread'
 
-        # 获取用户可见的公告
+        # 获取用户可见的公告（已带 is_read 注解）
         queryset = self.get_queryset() # 使用get_queryset来获取用户可见的公告
 
         if read_status_filter == 'read':
-            read_announcement_ids = ReadStatus.objects.filter(user=user).values_list('announcement__id', flat=True)
-            queryset = queryset.filter(id__in=read_announcement_ids)
+            queryset = queryset.filter(is_read=True)
         elif read_status_filter == 'unread':
-            read_announcement_ids = ReadStatus.objects.filter(user=user).values_list('announcement__id', flat=True)
-            queryset = queryset.exclude(id__in=read_announcement_ids)
-        
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            queryset = queryset.filter(is_read=False)
+
+        return set_validators(self.paginated_response(queryset), etag)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdminUser])
+    def cache_stats(self, request):
+        """
+        序列化缓存的命中率统计（当前进程）
+        """
+        return Response(cache_stats())
 
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
@@ -145,16 +238,23 @@ class ReadStatusViewSet(viewsets.ModelViewSet):
     """
     阅读状态API视图集：
     - 提供阅读状态的CRUD操作 (主要用于查看和创建/删除自己的阅读状态)
+    - 列表即阅读历史：按阅读时间倒序，使用游标分页
     """
     queryset = ReadStatus.objects.all()
     serializer_class = ReadStatusSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination
 
     def get_queryset(self):
         """
-        用户只能查看和管理自己的阅读状态
+        用户只能查看和管理自己的阅读状态；公告摘要需要的分类和发布者随主查询连接取回
+        （按 (user, -read_at) 索引范围扫描）
         """
-        return ReadStatus.objects.filter(user=self.request.user)
+        return (
+            ReadStatus.objects.filter(user=self.request.user)
+            .select_related('announcement__category', 'announcement__author')
+            .order_by('-read_at', '-id')
+        )
 
     def perform_create(self, serializer):
         """
@@ -162,13 +262,14 @@ class ReadStatusViewSet(viewsets.ModelViewSet):
         """
         # 确保不会重复创建
         announcement_id = self.request.data.get('announcement')
-        if not announcement_id:
+        if not announcement_id or not str(announcement_id).isdigit():
             raise serializers.ValidationError({"announcement": "公告ID是必填项。"})
-        
-        announcement = Announcement.objects.get(id=announcement_id)
-        ReadStatus.objects.get_or_create(user=self.request.user, announcement=announcement)
+        if not Announcement.objects.published().visible_to(self.request.user).filter(pk=announcement_id).exists():
+            raise serializers.ValidationError({"announcement": "公告不存在或无权查看。"})
+
+        read_state.record_reads([(self.request.user.pk, int(announcement_id))])
         # 返回已存在的或新创建的实例
-        serializer.instance = ReadStatus.objects.get(user=self.request.user, announcement=announcement)
+        serializer.instance = self.get_queryset().get(announcement_id=announcement_id)
 
     def destroy(self, request, *args, **kwargs):
         """
@@ -177,16 +278,136 @@ class ReadStatusViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         if instance.user != request.user:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        self.perform_destroy(instance)
+        read_state.mark_unread(request.user, [instance.announcement_id])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-# 用户和用户组的只读视图集，方便前端获取选项
-class UserReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = User.objects.all().order_by('username')
-    serializer_class = UserSerializer
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """
+        批量标记已读：{"ids": [1, 2, 3]}，只处理当前用户可见的公告
+        """
+        serializer = ReadStatusBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        visible_ids = Announcement.objects.published().visible_to(request.user).filter(
+            pk__in=serializer.validated_data['ids']
+        ).values_list('pk', flat=True)
+        marked = read_state.record_reads((request.user.pk, announcement_id) for announcement_id in visible_ids)
+        return Response({'marked': len(marked)})
+
+    @action(detail=False, methods=['post'])
+    def mark_unread(self, request):
+        """
+        批量标记未读：{"ids": [1, 2, 3]}
+        """
+        serializer = ReadStatusBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        unmarked = read_state.mark_unread(request.user, serializer.validated_data['ids'])
+        return Response({'unmarked': unmarked})
+
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        """
+        全部标记已读：{"before": "2025-07-18T12:00:00+08:00"}（可选，默认当前时间）
+        """
+        serializer = MarkAllReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        marked = read_state.mark_all_read(request.user, serializer.validated_data.get('before'))
+        return Response({'marked': marked})
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """
+        当前用户的未读数量（读取缓存的计数，不执行可见性连接查询）
+        """
+        return Response({'unread_count': get_unread_count(request.user)})
+
+class DirectoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    用户 / 用户组目录的只读视图集（方便前端获取接收者选项）：
+    - ?prefix= 按名称前缀过滤（区分大小写的范围查询 name >= 'abc' AND name < 'abd'，可使用名称上的唯一索引）
+    - 按名称排序的游标分页，?page_size= 每页数量
+    - ?compact=1 结果为 [id, 名称] 数组
+    - ?stream=1 不分页，按块查询并以流式 JSON 数组返回全部结果，不在内存中构造完整列表
+    只查询 id 和名称两列
+    """
+    name_field = None
     permission_classes = [IsAuthenticated, IsAdminUser] # 仅管理员可见
+    pagination_class = KeysetCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset().only('pk', self.name_field)
+        if self.action == 'list':
+            prefix = self.request.query_params.get('prefix', '').strip()
+            queryset = filter_prefix(queryset, self.name_field, prefix)
+        return queryset.order_by(self.name_field)
+
+    def _flag(self, name):
+        return self.request.query_params.get(name) in ('1', 'true')
+
+    def _item(self, pk, name, compact):
+        return [pk, name] if compact else {'id': pk, self.name_field: name}
+
+    def stream(self, compact):
+        # 每块查询一次、输出一次；流式响应不经过 DRF 渲染器，直接输出 JSON
+        queryset = super().get_queryset()
+        prefix = self.request.query_params.get('prefix', '').strip()
+        yield '['
+        separator = ''
+        for rows in iter_name_chunks(queryset, self.name_field, prefix):
+            yield separator + ','.join(json.dumps(self._item(pk, name, compact), ensure_ascii=False) for pk, name in rows)
+            separator = ','
+        yield ']'
+
+    def list(self, request, *args, **kwargs):
+        compact = self._flag('compact')
+        if self._flag('stream'):
+            return StreamingHttpResponse(self.stream(compact), content_type='application/json')
+        if not compact:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response([
+            self._item(obj.pk, getattr(obj, self.name_field), compact) for obj in page
+        ])
 
-class GroupReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Group.objects.all().order_by('name')
+class UserReadOnlyViewSet(DirectoryViewSet):
+    queryset = User.objects.all()
+    serializer_class = UserSerializer
+    name_field = 'username'
+
+class GroupReadOnlyViewSet(DirectoryViewSet):
+    queryset = Group.objects.all()
     serializer_class = GroupSerializer
-    permission_classes = [IsAuthenticated, IsAdminUser] # 仅管理员可见
+    name_field = 'name'
+
+
+class CanPublishAnnouncements(BasePermission):
+    """
+    有编辑公告权限的用户（公告发布者、超级管理员）
+    """
+
+    def has_permission(self, request, view):
+        return request.user.has_perm('announcements.change_announcement')
+
+
+class ReadAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    公告阅读统计API（只读取汇总表，见 announcements/analytics.py）：
+    - 列表按公告ID倒序，使用游标分页
+    - 详情 /api/read-analytics/<公告ID>/ 附带阅读率曲线
+    - 超级管理员可以查看全部公告，其他发布者只能查看自己发布的公告
+    """
+    queryset = AnnouncementReadStats.objects.all()
+    serializer_class = AnnouncementReadStatsSerializer
+    permission_classes = [IsAuthenticated, CanPublishAnnouncements]
+    pagination_class = KeysetCursorPagination
+
+    def get_queryset(self):
+        queryset = AnnouncementReadStats.objects.select_related('announcement').order_by('-pk')
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(announcement__author=self.request.user)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return AnnouncementReadStatsDetailSerializer
+        return super().get_serializer_class()
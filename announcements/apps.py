@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AnnouncementsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "announcements"
+
+    def ready(self):
+        # 注册信号处理（收件箱维护等）
+        from . import signals  # noqa: F401
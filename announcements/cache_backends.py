@@ -0,0 +1,29 @@
+# -*- coding=utf-8 -*-
+
+# announcements/cache_backends.py
+
+"""
+缓存后端：
+
+- FileBasedCache：Django 文件缓存每次写入前都会列出整个缓存目录判断是否需要淘汰（_cull），
+  条目多时每次 set 都是一次全目录扫描。这里改为平均每 OPTIONS['CULL_EVERY'] 次写入检查一次
+  （随机抽样，各线程、各进程无需共享计数），目录中的条目数可能短暂超过 MAX_ENTRIES
+
+    'BACKEND': 'announcements.cache_backends.FileBasedCache',
+    'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_EVERY': 1000},
+"""
+
+import random
+
+from django.core.cache.backends import filebased
+
+
+class FileBasedCache(filebased.FileBasedCache):
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_every = max(int(params.get('OPTIONS', {}).get('CULL_EVERY', 1000)), 1)
+
+    def _cull(self):
+        if random.random() * self._cull_every < 1:
+            super()._cull()
@@ -0,0 +1,212 @@
+# -*- coding=utf-8 -*-
+
+# announcements/channels.py
+
+"""
+外部通知渠道（邮件、Webhook、微信模板消息）：
+
+每个渠道实现 NotificationChannel 接口，由 announcements/dispatch.py 按批调用。
+渠道在 settings.ANNOUNCEMENTS_NOTIFICATION_CHANNELS 中配置，格式与 CACHES 类似：
+
+    ANNOUNCEMENTS_NOTIFICATION_CHANNELS = {
+        'email': {'BACKEND': 'announcements.channels.EmailChannel'},
+        'webhook': {'BACKEND': 'announcements.channels.WebhookChannel', 'OPTIONS': {'url': 'https://...'}},
+    }
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils.module_loading import import_string
+
+Recipient = namedtuple('Recipient', ['user_id', 'address'])
+
+
+class ChannelError(Exception):
+    """
+    渠道发送失败；retryable 为 False 时不再重试（如地址无效）
+    """
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class NotificationChannel:
+    """
+    通知渠道接口
+    """
+
+    batch_size = 100 # 每次 send_batch 的最大接收者数量
+    rate_limit = None # 每秒最多发送的接收者数量，None 表示不限制
+    max_attempts = 5 # 包括首次发送在内的最大尝试次数
+
+    def __init__(self, name, **options):
+        self.name = name
+        for key in ('batch_size', 'rate_limit', 'max_attempts'):
+            if key in options:
+                setattr(self, key, options.pop(key))
+        self.options = options
+
+    def address_for(self, user):
+        """
+        返回用户在该渠道的接收地址，None 表示该用户无法通过此渠道接收
+        """
+        raise NotImplementedError
+
+    def send_batch(self, payload, recipients):
+        """
+        发送一批通知，返回发送失败的 [(Recipient, ChannelError)]；整批失败时直接抛出 ChannelError
+        """
+        raise NotImplementedError
+
+
+def _post_json(url, data, timeout):
+    """
+    POST JSON 并返回解析后的响应；429 和 5xx 视为可重试的错误
+    """
+    request = urllib.request.Request(
+        url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'),
+        headers={'Content-Type': 'application/json; charset=utf-8'},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+    except urllib.error.HTTPError as exc:
+        raise ChannelError(f'HTTP {exc.code}', retryable=exc.code == 429 or exc.code >= 500) from exc
+    except (urllib.error.URLError, OSError) as exc:
+        raise ChannelError(str(exc)) from exc
+    return json.loads(body) if body else {}
+
+
+class EmailChannel(NotificationChannel):
+    """
+    邮件：使用 Django 的邮件后端，一批邮件复用同一个连接
+    """
+
+    batch_size = 50
+
+    def address_for(self, user):
+        return user.email or None
+
+    def send_batch(self, payload, recipients):
+        subject = f"[{payload['emergency_level_display']}] {payload['title']}"
+        body = f"{payload['summary']}\n\n{payload['url']}"
+        failed = []
+        try:
+            with get_connection(fail_silently=False) as connection:
+                for recipient in recipients:
+                    message = EmailMessage(subject, body, to=[recipient.address], connection=connection)
+                    try:
+                        message.send()
+                    except Exception as exc:
+                        failed.append((recipient, ChannelError(str(exc))))
+        except OSError as exc:
+            raise ChannelError(f'邮件服务器连接失败: {exc}') from exc
+        return failed
+
+
+class WebhookChannel(NotificationChannel):
+    """
+    Webhook：每批接收者一次 POST，请求体为 {"announcement": {...}, "recipients": [...]}
+    """
+
+    batch_size = 500
+
+    def address_for(self, user):
+        return str(user.pk)
+
+    def send_batch(self, payload, recipients):
+        _post_json(self.options['url'], {
+            'announcement': payload,
+            'recipients': [{'user_id': r.user_id, 'address': r.address} for r in recipients],
+        }, self.options.get('timeout', 10))
+        return []
+
+
+class WeChatTemplateChannel(NotificationChannel):
+    """
+    微信模板消息：接口每次只能发给一个 openid，一批内逐个发送；access_token 缓存到过期前
+
+    OPTIONS：app_id、app_secret、template_id、openid_resolver（用户 -> openid 的函数路径），
+    api_base（默认 https://api.weixin.qq.com，测试时指向本地的模拟服务器）
+    """
+
+    batch_size = 100
+    rate_limit = 1000
+
+    def __init__(self, name, **options):
+        super().__init__(name, **options)
+        self.api_base = self.options.get('api_base', 'https://api.weixin.qq.com').rstrip('/')
+        self._resolve_openid = import_string(self.options['openid_resolver'])
+        self._token_lock = threading.Lock()
+        self._token = None
+        self._token_expires = 0
+
+    def address_for(self, user):
+        return self._resolve_openid(user)
+
+    def _access_token(self, refresh=False):
+        with self._token_lock:
+            if refresh or self._token is None or time.monotonic() >= self._token_expires:
+                url = (
+                    f'{self.api_base}/cgi-bin/token?grant_type=client_credential'
+                    f"&appid={self.options['app_id']}&secret={self.options['app_secret']}"
+                )
+                try:
+                    with urllib.request.urlopen(url, timeout=10) as response:
+                        result = json.loads(response.read())
+                except (urllib.error.URLError, OSError, ValueError) as exc:
+                    raise ChannelError(f'获取 access_token 失败: {exc}') from exc
+                if 'access_token' not in result:
+                    raise ChannelError(f"获取 access_token 失败: {result.get('errmsg')}")
+                self._token = result['access_token']
+                self._token_expires = time.monotonic() + result.get('expires_in', 7200) - 300
+            return self._token
+
+    def send_batch(self, payload, recipients):
+        failed = []
+        for recipient in recipients:
+            message = {
+                'touser': recipient.address,
+                'template_id': self.options['template_id'],
+                'url': payload['absolute_url'],
+                'data': {
+                    'title': {'value': payload['title']},
+                    'level': {'value': payload['emergency_level_display']},
+                    'time': {'value': payload['publish_at']},
+                },
+            }
+            try:
+                result = _post_json(f'{self.api_base}/cgi-bin/message/template/send?access_token={self._access_token()}', message, 10)
+                if result.get('errcode') in (40001, 42001): # access_token 失效，刷新后重试一次
+                    result = _post_json(
+                        f'{self.api_base}/cgi-bin/message/template/send?access_token={self._access_token(refresh=True)}',
+                        message, 10,
+                    )
+            except ChannelError as exc:
+                failed.append((recipient, exc))
+                continue
+            errcode = result.get('errcode', 0)
+            if errcode:
+                # -1 为系统繁忙，45009 为调用频率超限，其余（如用户拒收 43004）不再重试
+                failed.append((recipient, ChannelError(
+                    f"errcode {errcode}: {result.get('errmsg')}", retryable=errcode in (-1, 45009)
+                )))
+        return failed
+
+
+def get_channels():
+    """
+    按配置创建通知渠道，返回 {名称: 渠道}
+    """
+    channels = {}
+    for name, config in getattr(settings, 'ANNOUNCEMENTS_NOTIFICATION_CHANNELS', {}).items():
+        channels[name] = import_string(config['BACKEND'])(name, **config.get('OPTIONS', {}))
+    return channels
@@ -0,0 +1,142 @@
+# -*- coding=utf-8 -*-
+
+# announcements/conditional.py
+
+"""
+条件请求（ETag）：轮询的客户端携带 If-None-Match，内容未变化时直接返回 304，不执行分页查询、不序列化。
+
+验证器不聚合用户的可见集合，而是由写入时更新的版本令牌构成（保存在多进程共享的缓存中，
+settings.ANNOUNCEMENTS_VERSION_CACHE），读取只需一次 get_many：
+- 公告版本（全局）：公告保存/删除、接收者变更、收件箱同步发生变化时更新
+- 用户收件箱版本：用户的收件箱变化（用户组成员变更、新用户投递）时更新
+- 用户阅读版本：写入/删除阅读记录、回执缓冲区登记尚未落库的已读标记时更新
+- 已到发布时间的最新 publish_at（按 publish_at 索引取一行）：定时公告到期时列表内容随之变化
+- 序列化缓存的代数（分类、用户名、用户组名变化时递增，见 announcements/api/cache.py）
+- 影响响应内容的请求参数（页码、游标、搜索词等）和 Accept 头
+
+版本令牌是随机值而不是计数，缓存条目被淘汰后读取时重新生成，只会导致一次多余的 200，不会产生过期的 304。
+不设置 Last-Modified：接收者变更、删除公告、标记未读都不会推进任何时间戳。
+绕过 save()/信号的直接更新（queryset.update 等）需要调用 bump_announcements_version()。
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+from .api.cache import body_generation
+from .metrics import VISIBILITY_QUERY
+from .models import Announcement
+
+ANNOUNCEMENTS_VERSION_KEY = 'announcements:version:announcements'
+
+
+def _store():
+    return caches[getattr(settings, 'ANNOUNCEMENTS_VERSION_CACHE', 'announcements_shared')]
+
+
+def _inbox_key(user_id):
+    return f'announcements:version:inbox:{user_id}'
+
+
+def _reads_key(user_id):
+    return f'announcements:version:reads:{user_id}'
+
+
+def _token():
+    return uuid.uuid4().hex
+
+
+def _versions(keys):
+    """
+    读取版本令牌，缺失的（从未更新或已被淘汰）生成新令牌
+    """
+    store = _store()
+    found = store.get_many(keys)
+    for key in keys:
+        if key not in found:
+            store.add(key, _token(), None)
+            found[key] = store.get(key)
+    return [found[key] for key in keys]
+
+
+def _bump(keys):
+    keys = list(keys)
+    if keys:
+        _store().set_many({key: _token() for key in keys}, None)
+
+
+def bump_announcements_version():
+    """
+    公告内容或接收者变化后调用（应在收件箱同步之后，否则轮询可能把旧内容记在新版本下）
+    """
+    _bump([ANNOUNCEMENTS_VERSION_KEY])
+
+
+def bump_inbox_versions(user_ids):
+    _bump(_inbox_key(user_id) for user_id in set(user_ids))
+
+
+def bump_read_versions(user_ids):
+    _bump(_reads_key(user_id) for user_id in set(user_ids))
+
+
+def _etag(parts):
+    return quote_etag(hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+
+
+def _latest_published():
+    with VISIBILITY_QUERY.time(query='latest_published'):
+        return Announcement.objects.published().order_by('-publish_at').values_list('publish_at', flat=True).first()
+
+
+def list_validators(request, user, extra=()):
+    """
+    公告列表的 ETag：一次缓存读取 + 一条按 publish_at 索引取一行的查询，不聚合用户的可见集合
+    """
+    versions = _versions([ANNOUNCEMENTS_VERSION_KEY, _inbox_key(user.pk), _reads_key(user.pk)])
+    params = sorted((key, request.GET.getlist(key)) for key in request.GET)
+    return _etag((
+        user.pk, body_generation(), versions, _latest_published(),
+        params, request.META.get('HTTP_ACCEPT', ''), tuple(extra),
+    ))
+
+
+def detail_validators(request, announcement, extra=()):
+    """
+    公告详情的 ETag：查看详情会标记已读，响应中的 is_read 恒为 True，因此不包含阅读版本；
+    包含公告版本和用户收件箱版本，接收者或用户组变更导致可见性变化时不会返回过期的 304
+    """
+    user_id = request.user.pk if request.user.is_authenticated else None
+    versions = _versions([ANNOUNCEMENTS_VERSION_KEY, _inbox_key(user_id)])
+    return _etag((
+        announcement.pk, announcement.updated_at, body_generation(), versions,
+        request.META.get('HTTP_ACCEPT', ''), tuple(extra),
+    ))
+
+
+def not_modified(request, etag):
+    """
+    客户端缓存仍然有效时返回 304 响应，否则返回 None（没有 If-None-Match 时不做比较）
+    """
+    if 'HTTP_IF_NONE_MATCH' not in request.META:
+        return None
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_validators(response, etag)
+    return response
+
+
+def set_validators(response, etag):
+    """
+    为响应设置验证器；内容因用户而异，只允许私有缓存，且每次使用前须重新验证
+    """
+    if response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie', 'Authorization', 'Accept'))
+    return response
@@ -0,0 +1,173 @@
+# -*- coding=utf-8 -*-
+
+# announcements/counters.py
+
+"""
+未读数量计数（反规范化，增量维护）：
+
+计数的定义：用户收件箱中已生效（activated_at 不为空）且未读的公告数量。
+- 公告生效时（见 announcements/publishing.py）对收件箱中未读的用户加一，取消生效时减一
+- 已生效公告的接收者变化时，对新增/移除的未读用户加一/减一
+- 写入阅读记录时减一；单用户的批量操作（全部已读、标记未读）直接重新计算该用户
+- 读取时先查缓存（多进程共享，见 settings.ANNOUNCEMENTS_COUNTER_CACHE），再查 UnreadCounter 行，
+  都不存在时按数据库计算并写入；返回前减去阅读回执缓冲区中尚未落库的已读公告
+- reconcile_unread_counters 命令定期校正漂移
+"""
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Exists, F, OuterRef, Q
+
+from .models import InboxEntry, ReadStatus, UnreadCounter
+
+UNREAD_COUNT_TIMEOUT = 300 # 缓存有效期（秒），计数变化时会主动失效
+BATCH_SIZE = 1000
+
+
+def _cache():
+    return caches[getattr(settings, 'ANNOUNCEMENTS_COUNTER_CACHE', 'announcements_shared')]
+
+
+def _unread_key(user_id):
+    return f'announcements:unread-count:{user_id}'
+
+
+def _chunks(values, size=BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def unread_entries():
+    """
+    已生效且未读的收件箱条目
+    """
+    read = ReadStatus.objects.filter(user=OuterRef('user_id'), announcement=OuterRef('announcement_id'))
+    return InboxEntry.objects.filter(announcement__activated_at__isnull=False).exclude(Exists(read))
+
+
+def count_unread(user_ids):
+    """
+    直接从数据库计算一批用户的未读数量，返回 {user_id: count}
+    """
+    counts = dict.fromkeys(user_ids, 0)
+    rows = unread_entries().filter(user_id__in=user_ids).values('user_id').annotate(n=Count('id'))
+    counts.update({row['user_id']: row['n'] for row in rows})
+    return counts
+
+
+def invalidate_unread_counts(user_ids):
+    """
+    使相关用户的缓存失效
+    """
+    for chunk in _chunks(set(user_ids)):
+        _cache().delete_many([_unread_key(user_id) for user_id in chunk])
+
+
+def get_unread_count(user):
+    """
+    读取用户的未读数量：缓存 -> 计数行 -> 数据库计算，再减去尚未落库的已读公告
+    """
+    from .read_state import pending_read_ids # 避免循环导入：read_state 依赖本模块
+
+    store = _cache()
+    key = _unread_key(user.pk)
+    count = store.get(key)
+    if count is None:
+        count = UnreadCounter.objects.filter(user=user).values_list('count', flat=True).first()
+        if count is None:
+            count = count_unread([user.pk])[user.pk]
+            UnreadCounter.objects.bulk_create([UnreadCounter(user=user, count=count)], ignore_conflicts=True)
+        count = max(count, 0)
+        store.set(key, count, UNREAD_COUNT_TIMEOUT)
+    pending = pending_read_ids(user.pk)
+    if pending and count:
+        # 覆盖层中的操作落库后最多保留 PENDING_READS_TIMEOUT 秒，只减去仍未读的条目
+        count = max(count - unread_entries().filter(user=user, announcement_id__in=pending).count(), 0)
+    return count
+
+
+def adjust_unread_counts(deltas):
+    """
+    按 {user_id: 增量} 增量更新计数（没有计数行的用户在首次读取时计算，这里跳过）
+    """
+    by_delta = defaultdict(list)
+    for user_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(user_id)
+    for delta, user_ids in by_delta.items():
+        for chunk in _chunks(user_ids):
+            UnreadCounter.objects.filter(user_id__in=chunk).update(count=F('count') + delta)
+    invalidate_unread_counts(deltas)
+
+
+def adjust_for_announcement(announcement_id, delta, user_ids=None):
+    """
+    对收件箱中未读该公告的用户（可限定在 user_ids 内）的计数加上 delta，公告生效/取消生效时使用
+    """
+    entries = InboxEntry.objects.filter(announcement_id=announcement_id).exclude(
+        Exists(ReadStatus.objects.filter(user=OuterRef('user_id'), announcement_id=announcement_id))
+    )
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    unread_user_ids = list(entries.values_list('user_id', flat=True))
+    adjust_unread_counts(dict.fromkeys(unread_user_ids, delta))
+    return len(unread_user_ids)
+
+
+def on_recipients_changed(announcement, added_user_ids, removed_user_ids):
+    """
+    已生效公告的接收者变化后调整计数
+    """
+    if announcement.activated_at is None or not (added_user_ids or removed_user_ids):
+        return
+    changed = set(added_user_ids) | set(removed_user_ids)
+    read_user_ids = set()
+    for chunk in _chunks(changed):
+        read_user_ids.update(
+            ReadStatus.objects.filter(announcement=announcement, user_id__in=chunk).values_list('user_id', flat=True)
+        )
+    deltas = {user_id: 1 for user_id in set(added_user_ids) - read_user_ids}
+    deltas.update({user_id: -1 for user_id in set(removed_user_ids) - read_user_ids})
+    adjust_unread_counts(deltas)
+
+
+def on_reads_recorded(pairs):
+    """
+    写入阅读记录后，对已生效且在收件箱中的公告减一
+    """
+    by_user = defaultdict(set)
+    for user_id, announcement_id in pairs:
+        by_user[user_id].add(announcement_id)
+    if not by_user:
+        return
+
+    condition = Q()
+    for user_id, announcement_ids in by_user.items():
+        condition |= Q(user_id=user_id, announcement_id__in=announcement_ids)
+    counted = Counter(
+        InboxEntry.objects.filter(condition, announcement__activated_at__isnull=False).values_list('user_id', flat=True)
+    )
+    adjust_unread_counts({user_id: -n for user_id, n in counted.items()})
+
+
+def refresh_unread_counters(user_ids):
+    """
+    重新计算并保存一批用户的计数，返回计数发生漂移（与保存值不一致）的用户数
+    """
+    drifted = 0
+    for chunk in _chunks(user_ids):
+        actual = count_unread(chunk)
+        stored = dict(UnreadCounter.objects.filter(user_id__in=chunk).values_list('user_id', 'count'))
+        changed = [
+            UnreadCounter(user_id=user_id, count=count)
+            for user_id, count in actual.items() if stored.get(user_id) != count
+        ]
+        drifted += sum(1 for counter in changed if counter.user_id in stored)
+        UnreadCounter.objects.bulk_create(
+            changed, update_conflicts=True, unique_fields=['user'], update_fields=['count', 'updated_at'],
+        )
+        invalidate_unread_counts(chunk)
+    return drifted
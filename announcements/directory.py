@@ -0,0 +1,83 @@
+# -*- coding=utf-8 -*-
+
+# announcements/directory.py
+
+"""
+用户和用户组目录：按名称前缀搜索 + 键集分页，供接收者选择器（见 announcements/widgets.py）
+和 /api/users/、/api/groups/ 使用。
+
+- 前缀匹配改写为范围条件 name >= 'abc' AND name < 'abd'，在 username / name 的唯一索引上做范围查找。
+  不使用 startswith：SQLite 下 LIKE 不区分大小写且带 ESCAPE 子句，无法使用索引，只能扫描整个索引；
+  范围条件在两种数据库上都按列的排序规则比较（SQLite 默认 BINARY，区分大小写）
+- 名称唯一，翻页直接以上一页最后一个名称为游标（WHERE name > 游标），不使用 OFFSET
+- 只取回 (id, 名称) 两列
+"""
+
+from django.contrib.auth.models import Group, User
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# 目录类型 -> (查询集工厂, 名称字段)
+DIRECTORIES = {
+    'users': (lambda: User.objects.filter(is_active=True), 'username'),
+    'groups': (lambda: Group.objects.all(), 'name'),
+}
+
+
+def prefix_successor(prefix):
+    """
+    大于所有以 prefix 开头的字符串的最小字符串（末尾字符加一），不存在时返回 None
+    """
+    while prefix and ord(prefix[-1]) == 0x10FFFF:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def filter_prefix(queryset, field, prefix):
+    """
+    按 field 前缀过滤：field >= prefix AND field < 后继字符串（区分大小写，可使用 field 上的索引做范围查找）
+    """
+    if not prefix:
+        return queryset
+    queryset = queryset.filter(**{f'{field}__gte': prefix})
+    successor = prefix_successor(prefix)
+    if successor is not None:
+        queryset = queryset.filter(**{f'{field}__lt': successor})
+    return queryset
+
+
+def prefix_page(queryset, field, prefix='', after=None, limit=PAGE_SIZE):
+    """
+    按 field 前缀过滤、按 field 升序的一页，返回 ([(id, 名称)], 下一页游标或 None)
+    """
+    queryset = filter_prefix(queryset, field, prefix)
+    if after:
+        queryset = queryset.filter(**{f'{field}__gt': after})
+    rows = list(queryset.order_by(field).values_list('pk', field)[:limit + 1])
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1][1]
+    return rows, None
+
+
+def iter_name_chunks(queryset, field, prefix='', chunk_size=1000):
+    """
+    按 field 升序逐块产生 [(id, 名称)]（键集分页），用于流式输出整个目录
+    """
+    after = None
+    while True:
+        rows, after = prefix_page(queryset, field, prefix, after, chunk_size)
+        if rows:
+            yield rows
+        if after is None:
+            return
+
+
+def search_directory(kind, prefix='', after=None, limit=PAGE_SIZE):
+    """
+    在用户（'users'）或用户组（'groups'）目录中按前缀搜索，kind 未知时抛出 KeyError
+    """
+    queryset_factory, field = DIRECTORIES[kind]
+    return prefix_page(queryset_factory(), field, prefix.strip(), after, max(1, min(limit, MAX_PAGE_SIZE)))
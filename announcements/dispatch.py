@@ -0,0 +1,247 @@
+# -*- coding=utf-8 -*-
+
+# announcements/dispatch.py
+
+"""
+外部通知分发：公告生效（announcement_published 信号）后，通过已配置的渠道（见 announcements/channels.py）
+通知所有接收者。
+
+- 接收者按用户ID分块流式展开（见 announcements/recipients.py），内存占用与接收者总数无关
+- 每个渠道按 batch_size 分批，提交到线程池并发发送；排队的批次数量有上限，展开速度受发送速度约束
+- 每个渠道可设置速率限制（令牌桶）
+- 失败的接收者按指数退避（带随机抖动）重试，重试次数用尽或不可重试的错误写入 DeadLetter 表
+- 数据库读写都在调用 dispatch() 的线程中进行，工作线程只负责网络发送
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.urls import reverse
+
+from .channels import ChannelError, Recipient, get_channels
+from .models import DeadLetter
+from .recipients import iter_recipient_id_chunks
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    令牌桶速率限制（线程安全）
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        n = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                delay = (n - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class DispatchResult:
+    """
+    一次分发的统计：sent / failed / skipped 均为 {渠道名: 接收者数量}
+    """
+
+    def __init__(self):
+        self.sent = Counter()
+        self.failed = Counter()
+        self.skipped = Counter() # 在该渠道没有接收地址的用户
+
+    def __repr__(self):
+        return f'<DispatchResult sent={dict(self.sent)} failed={dict(self.failed)} skipped={dict(self.skipped)}>'
+
+
+def notification_payload(announcement):
+    """
+    发送给各渠道的公告内容
+    """
+    url = reverse('announcement_detail', args=[announcement.pk])
+    return {
+        'id': announcement.pk,
+        'title': announcement.title,
+        'summary': announcement.content[:200],
+        'emergency_level': announcement.emergency_level,
+        'emergency_level_display': announcement.get_emergency_level_display(),
+        'publish_at': announcement.publish_at.isoformat(),
+        'url': url,
+        'absolute_url': getattr(settings, 'ANNOUNCEMENTS_SITE_URL', '').rstrip('/') + url,
+    }
+
+
+def iter_recipient_chunks(announcement, chunk_size=1000):
+    """
+    按用户ID顺序分块返回公告的接收用户（接收者ID流式展开，每块只查询该块的用户）
+    """
+    for user_ids in iter_recipient_id_chunks(announcement, chunk_size):
+        users = list(User.objects.filter(pk__in=user_ids, is_active=True).order_by('pk'))
+        if users:
+            yield users
+
+
+class NotificationDispatcher:
+    """
+    通知分发器
+    """
+
+    def __init__(self, channels, max_workers=8, chunk_size=1000, backoff_base=0.5, backoff_max=30):
+        self.channels = channels
+        self.chunk_size = chunk_size
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='notification-sender')
+        self._slots = threading.BoundedSemaphore(max_workers * 2) # 排队批次的上限（背压）
+        self._limiters = {
+            name: TokenBucket(channel.rate_limit, max(channel.rate_limit, channel.batch_size))
+            for name, channel in channels.items() if channel.rate_limit
+        }
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _send(self, channel, payload, batch):
+        """
+        在工作线程中发送一批通知（含重试），返回 (成功数量, [(Recipient, 错误信息, 尝试次数)])
+        """
+        limiter = self._limiters.get(channel.name)
+        pending, sent, dead, attempt = batch, 0, [], 0
+        while pending:
+            attempt += 1
+            if limiter is not None:
+                limiter.acquire(len(pending))
+            try:
+                failures = channel.send_batch(payload, pending)
+            except ChannelError as exc:
+                failures = [(recipient, exc) for recipient in pending]
+            except Exception as exc:
+                logger.exception('渠道 %s 发送异常', channel.name)
+                failures = [(recipient, ChannelError(repr(exc))) for recipient in pending]
+            sent += len(pending) - len(failures)
+
+            pending = []
+            for recipient, error in failures:
+                if error.retryable and attempt < channel.max_attempts:
+                    pending.append(recipient)
+                else:
+                    dead.append((recipient, str(error), attempt))
+            if pending:
+                time.sleep(self._backoff(attempt))
+        return sent, dead
+
+    def _submit(self, channel, payload, batch):
+        self._slots.acquire()
+        future = self._executor.submit(self._send, channel, payload, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def dispatch(self, announcement):
+        """
+        把公告通知给所有接收者，阻塞直到发送完成，返回 DispatchResult
+        """
+        result = DispatchResult()
+        if not self.channels:
+            return result
+        payload = notification_payload(announcement)
+        futures = []
+        for users in iter_recipient_chunks(announcement, self.chunk_size):
+            for name, channel in self.channels.items():
+                recipients = []
+                for user in users:
+                    address = channel.address_for(user)
+                    if address:
+                        recipients.append(Recipient(user.pk, address))
+                    else:
+                        result.skipped[name] += 1
+                for start in range(0, len(recipients), channel.batch_size):
+                    futures.append((name, self._submit(channel, payload, recipients[start:start + channel.batch_size])))
+
+        wait([future for _, future in futures])
+        dead_letters = []
+        for name, future in futures:
+            sent, dead = future.result()
+            result.sent[name] += sent
+            result.failed[name] += len(dead)
+            dead_letters.extend(
+                DeadLetter(
+                    channel=name, announcement=announcement, user_id=recipient.user_id,
+                    address=recipient.address, error=error, attempts=attempts,
+                )
+                for recipient, error, attempts in dead
+            )
+        DeadLetter.objects.bulk_create(dead_letters, batch_size=1000)
+        if dead_letters:
+            logger.warning('公告 %s 有 %d 条通知发送失败，已写入 DeadLetter', announcement.pk, len(dead_letters))
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_dispatcher = None
+_background = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    返回当前进程的通知分发器（按配置创建一次）
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = NotificationDispatcher(
+                    get_channels(),
+                    max_workers=getattr(settings, 'ANNOUNCEMENTS_NOTIFICATION_WORKERS', 8),
+                    chunk_size=getattr(settings, 'ANNOUNCEMENTS_NOTIFICATION_CHUNK_SIZE', 1000),
+                )
+    return _dispatcher
+
+
+def _dispatch_in_background(announcement):
+    try:
+        get_dispatcher().dispatch(announcement)
+    except Exception:
+        logger.exception('公告 %s 通知分发失败', announcement.pk)
+    finally:
+        close_old_connections()
+
+
+def dispatch_announcement(announcement):
+    """
+    公告生效后分发外部通知：
+    settings.ANNOUNCEMENTS_NOTIFICATION_MODE = 'background'（默认）时交给后台线程，'sync' 时在当前线程完成
+    """
+    global _background
+    dispatcher = get_dispatcher()
+    if not dispatcher.channels:
+        return None
+    if getattr(settings, 'ANNOUNCEMENTS_NOTIFICATION_MODE', 'background') == 'sync':
+        return dispatcher.dispatch(announcement)
+    with _dispatcher_lock:
+        if _background is None:
+            # 单线程依次处理公告，每条公告内部由分发器的线程池并发发送
+            _background = ThreadPoolExecutor(1, thread_name_prefix='notification-dispatcher')
+    _background.submit(_dispatch_in_background, announcement)
+    return None
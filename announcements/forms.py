@@ -1,32 +1,34 @@
 # announcements/forms.py
 
 from django import forms
+from django.urls import reverse_lazy
 from .models import Announcement, Category
+from .widgets import RecipientChoiceField, RecipientPicker
 from django.contrib.auth.models import User, Group
 
 class AnnouncementForm(forms.ModelForm):
     """
     公告创建和编辑表单
     """
-    # 使用ModelMultipleChoiceField来选择用户和用户组
-    target_users = forms.ModelMultipleChoiceField(
+    # 用户和用户组使用自动补全选择器：只渲染已选中的项，候选项按前缀从搜索接口加载（见 announcements/widgets.py）
+    target_users = RecipientChoiceField(
         queryset=User.objects.all(),
         required=False,
-        widget=forms.CheckboxSelectMultiple, # 可以选择多个用户
+        widget=RecipientPicker(reverse_lazy('recipient_search', args=['users']), 'username'),
         label="指定接收用户"
     )
-    target_groups = forms.ModelMultipleChoiceField(
+    target_groups = RecipientChoiceField(
         queryset=Group.objects.all(),
         required=False,
-        widget=forms.CheckboxSelectMultiple, # 可以选择多个用户组
+        widget=RecipientPicker(reverse_lazy('recipient_search', args=['groups']), 'name'),
         label="指定接收用户组"
     )
 
     class Meta:
         model = Announcement
+        # target_users / target_groups 不在此列出：避免 ModelForm 初始化时加载全部已选中的对象，由 _save_m2m 保存
         fields = [
-            'title', 'content', 'category', 'publish_at',
-            'target_users', 'target_groups', 'emergency_level'
+            'title', 'content', 'category', 'publish_at', 'emergency_level'
         ]
         widgets = {
             'publish_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}), # HTML5 datetime-local 输入框
@@ -44,6 +46,8 @@ class AnnouncementForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         # 为所有字段添加Bootstrap样式类
         for field_name, field in self.fields.items():
+            if isinstance(field.widget, RecipientPicker):
+                continue
             if isinstance(field.widget, (forms.TextInput, forms.Textarea, forms.Select, forms.DateTimeInput)):
                 field.widget.attrs['class'] = 'form-control rounded-md shadow-sm'
             elif isinstance(field.widget, forms.CheckboxSelectMultiple):
@@ -51,6 +55,12 @@ class AnnouncementForm(forms.ModelForm):
             elif isinstance(field.widget, forms.SelectMultiple):
                 field.widget.attrs['class'] = 'form-control rounded-md shadow-sm'
 
-        # 将target_users和target_groups的选项显示为更友好的名称
-        self.fields['target_users'].queryset = User.objects.all().order_by('username')
-        self.fields['target_groups'].queryset = Group.objects.all().order_by('name')
+        # 编辑时只取已选中的ID，不加载完整的 User / Group 对象
+        if self.instance.pk is not None and not self.is_bound:
+            self.initial['target_users'] = list(self.instance.target_users.values_list('pk', flat=True))
+            self.initial['target_groups'] = list(self.instance.target_groups.values_list('pk', flat=True))
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        self.instance.target_users.set(self.cleaned_data['target_users'])
+        self.instance.target_groups.set(self.cleaned_data['target_groups'])
@@ -0,0 +1,174 @@
+# -*- coding=utf-8 -*-
+
+# announcements/inbox.py
+
+"""
+收件箱（可见性物化表）维护：
+
+可见性规则与原先在视图中每次请求计算的规则一致：
+1. 发布给所有用户 (target_users为空且target_groups为空)
+2. 发布给当前用户 (target_users包含当前用户)
+3. 发布给当前用户所属的用户组 (target_groups包含当前用户所属的任何组)
+
+这里在写入时把规则展开成 InboxEntry 行，读取时只需按 user 做索引范围扫描。
+"""
+
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from .conditional import bump_announcements_version, bump_inbox_versions
+from .counters import on_recipients_changed, refresh_unread_counters
+from .models import Announcement, InboxEntry
+from .recipients import keyset_values, sorted_diff
+
+BATCH_SIZE = 1000 # bulk_create / 删除时的批量大小
+
+InboxDiscrepancy = namedtuple('InboxDiscrepancy', ['announcement_id', 'missing_user_ids', 'extra_user_ids'])
+
+
+def legacy_visibility_q(user):
+    """
+    原始的可见性条件（多对多连接 + DISTINCT），仅用于写路径和一致性检查
+    """
+    return (
+        Q(target_users__isnull=True, target_groups__isnull=True) | # 发布给所有用户
+        Q(target_users=user) | # 发布给当前用户
+        Q(target_groups__in=user.groups.all()) # 发布给当前用户所属的组
+    )
+
+
+def _chunks(values, size=BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def iter_inbox_diff(announcement):
+    """
+    按用户ID顺序比较可见性规则（有序流式展开，见 announcements/recipients.py）与收件箱现有的行，
+    产生 ('missing', user_id) 和 ('extra', user_id)
+    """
+    existing = keyset_values(InboxEntry.objects.filter(announcement=announcement), 'user_id', BATCH_SIZE)
+    return sorted_diff(announcement.iter_recipient_ids(BATCH_SIZE), existing)
+
+
+def _apply_inbox_changes(announcement, missing, extra):
+    if extra:
+        InboxEntry.objects.filter(announcement=announcement, user_id__in=extra).delete()
+    InboxEntry.objects.bulk_create(
+        (InboxEntry(user_id=user_id, announcement=announcement) for user_id in missing),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    on_recipients_changed(announcement, missing, extra)
+
+
+def sync_announcement_inbox(announcement_id):
+    """
+    按公告同步收件箱：补齐缺失的行、删除多余的行（每 BATCH_SIZE 个差异写入一次，不在内存中保存全部接收者）
+    返回 (新增数量, 删除数量)
+    """
+    announcement = Announcement.objects.filter(pk=announcement_id).first()
+    if announcement is None:
+        return 0, 0 # 公告已被删除，收件箱行会被级联删除
+
+    added = removed = 0
+    missing, extra = [], []
+    # 写入的行都位于两个流已读取的位置之前，不影响后续的键集分页
+    for kind, user_id in iter_inbox_diff(announcement):
+        (missing if kind == 'missing' else extra).append(user_id)
+        if len(missing) + len(extra) >= BATCH_SIZE:
+            _apply_inbox_changes(announcement, missing, extra)
+            added, removed = added + len(missing), removed + len(extra)
+            missing, extra = [], []
+    _apply_inbox_changes(announcement, missing, extra)
+    added, removed = added + len(missing), removed + len(extra)
+    if added or removed:
+        bump_announcements_version() # 条件请求的验证器（见 announcements/conditional.py）
+    return added, removed
+
+
+def sync_user_inbox(user_id):
+    """
+    按用户同步收件箱（新用户注册、用户组成员变更时使用）
+    返回 (新增数量, 删除数量)
+    """
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return 0, 0
+
+    expected = set(Announcement.objects.filter(legacy_visibility_q(user)).values_list('id', flat=True).distinct())
+    existing = set(InboxEntry.objects.filter(user_id=user_id).values_list('announcement_id', flat=True))
+    missing = expected - existing
+    extra = existing - expected
+
+    for chunk in _chunks(extra):
+        InboxEntry.objects.filter(user_id=user_id, announcement_id__in=chunk).delete()
+    InboxEntry.objects.bulk_create(
+        (InboxEntry(user_id=user_id, announcement_id=announcement_id) for announcement_id in missing),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    if missing or extra:
+        refresh_unread_counters([user_id])
+        bump_inbox_versions([user_id])
+    return len(missing), len(extra)
+
+
+def schedule_announcement_sync(announcement_id):
+    """
+    在事务提交后同步公告的收件箱。
+    表单/序列化器会先保存公告再设置多对多字段，延迟到提交后可以只按最终状态同步一次，
+    避免先按“所有用户可见”展开再删除。
+    """
+    transaction.on_commit(lambda: sync_announcement_inbox(announcement_id))
+
+
+def schedule_user_sync(user_id):
+    """
+    在事务提交后同步用户的收件箱
+    """
+    transaction.on_commit(lambda: sync_user_inbox(user_id))
+
+
+def rebuild_inbox(announcement_ids=None):
+    """
+    重建收件箱，announcement_ids 为空时重建全部公告
+    返回 (新增数量, 删除数量)
+    """
+    queryset = Announcement.objects.order_by('pk')
+    if announcement_ids:
+        queryset = queryset.filter(pk__in=announcement_ids)
+    else:
+        # 清理孤立的行（正常情况下由级联删除保证不存在）
+        InboxEntry.objects.exclude(announcement__in=Announcement.objects.all()).delete()
+
+    added = removed = 0
+    for announcement_id in queryset.values_list('pk', flat=True).iterator():
+        with transaction.atomic():
+            a, r = sync_announcement_inbox(announcement_id)
+        added += a
+        removed += r
+    return added, removed
+
+
+def check_inbox_consistency(announcement_ids=None):
+    """
+    一致性检查：把收件箱与可见性规则重新计算的结果比较
+    返回 InboxDiscrepancy 列表（只包含不一致的公告）
+    """
+    queryset = Announcement.objects.order_by('pk')
+    if announcement_ids:
+        queryset = queryset.filter(pk__in=announcement_ids)
+
+    discrepancies = []
+    for announcement in queryset.iterator():
+        diff = {'missing': [], 'extra': []}
+        for kind, user_id in iter_inbox_diff(announcement):
+            diff[kind].append(user_id)
+        if diff['missing'] or diff['extra']:
+            discrepancies.append(InboxDiscrepancy(announcement.pk, diff['missing'], diff['extra']))
+    return discrepancies
@@ -0,0 +1,167 @@
+# -*- coding=utf-8 -*-
+
+# announcements/loadtest.py
+
+"""
+进程内压测：用线程池并发重放列表、详情、搜索和标记已读请求，直接调用本进程的 WSGI 应用（django.test.Client），
+不经过网络，输出每个接口的吞吐量和延迟分位数。
+
+    result = run_load_test(users, requests=2000, threads=8, seed=42)
+    result.report()   # {接口: {'count', 'errors', 'rps', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'}}
+
+测试数据可以用 seed_announcements 命令生成。
+"""
+
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.utils import timezone
+
+from .models import InboxEntry
+
+# 请求类型及默认权重
+DEFAULT_MIX = {'list': 50, 'detail': 25, 'search': 15, 'mark_read': 10}
+SEARCH_TERMS = ['系统维护', '放假', '培训', '会议', '升级', '招聘', '演练', '发布']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class LoadTestResult:
+    """
+    各接口的延迟样本（秒）和错误数
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.elapsed = 0
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.samples[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def report(self):
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            report[endpoint] = {
+                'count': len(samples),
+                'errors': self.errors[endpoint],
+                'rps': round(len(samples) / self.elapsed, 1) if self.elapsed else None,
+                'p50_ms': round(percentile(samples, 0.5) * 1000, 2),
+                'p90_ms': round(percentile(samples, 0.9) * 1000, 2),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2),
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        report['total'] = {
+            'count': total,
+            'errors': sum(self.errors.values()),
+            'rps': round(total / self.elapsed, 1) if self.elapsed else None,
+            'elapsed_s': round(self.elapsed, 2),
+        }
+        return report
+
+
+def _host():
+    """
+    请求使用的 Host：ALLOWED_HOSTS 中第一个具体的主机名（为空时 DEBUG 模式允许 localhost）
+    """
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*' and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+class _Session:
+    """
+    一个虚拟用户：已登录的测试客户端 + 该用户可见的公告ID样本
+    """
+
+    def __init__(self, user, announcement_ids):
+        self.client = Client(HTTP_HOST=_host())
+        self.client.force_login(user)
+        self.announcement_ids = announcement_ids
+
+
+def build_plan(sessions, requests, mix, seed):
+    """
+    生成确定的请求序列 [(虚拟用户, 接口, 路径, POST 数据或 None)]
+    """
+    rng = random.Random(seed)
+    endpoints, weights = zip(*mix.items())
+    plan = []
+    for _ in range(requests):
+        session = rng.choice(sessions)
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint == 'list':
+            plan.append((session, endpoint, '/api/announcements/?pagination=cursor', None))
+        elif endpoint == 'search':
+            plan.append((session, endpoint, f'/api/announcements/?q={rng.choice(SEARCH_TERMS)}', None))
+        elif not session.announcement_ids:
+            continue
+        elif endpoint == 'detail':
+            plan.append((session, endpoint, f'/api/announcements/{rng.choice(session.announcement_ids)}/', None))
+        else:
+            ids = rng.sample(session.announcement_ids, min(3, len(session.announcement_ids)))
+            plan.append((session, endpoint, '/api/read-status/mark_read/', {'ids': ids}))
+    return plan
+
+
+def run_load_test(users, requests=2000, threads=8, mix=None, seed=42, warmup=0):
+    """
+    对 users（User 对象列表）重放 requests 个请求，返回 LoadTestResult。
+    warmup 个请求先单线程执行且不计入结果（填充缓存）
+    """
+    sessions = []
+    for user in users:
+        visible = InboxEntry.objects.filter(user=user, announcement__publish_at__lte=timezone.now())
+        ids = list(visible.order_by('-announcement_id').values_list('announcement_id', flat=True)[:200])
+        sessions.append(_Session(user, ids))
+    plan = build_plan(sessions, requests + warmup, mix or DEFAULT_MIX, seed)
+
+    def send(item):
+        session, endpoint, path, data = item
+        started = time.perf_counter()
+        try:
+            if data is None:
+                response = session.client.get(path)
+            else:
+                response = session.client.post(path, data, content_type='application/json')
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        return endpoint, time.perf_counter() - started, ok
+
+    for item in plan[:warmup]:
+        send(item)
+
+    result = LoadTestResult()
+
+    def worker(items):
+        # 每个线程依次发送分到的请求，使用自己的数据库连接，结束时关闭
+        try:
+            for item in items:
+                result.record(*send(item))
+        finally:
+            connections.close_all()
+
+    measured = plan[warmup:]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads, thread_name_prefix='loadtest') as executor:
+        list(executor.map(worker, [measured[i::threads] for i in range(threads)]))
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,33 @@
+# -*- coding=utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+
+from announcements.inbox import check_inbox_consistency, rebuild_inbox
+
+class Command(BaseCommand):
+    help = 'Checks the materialized inbox against the announcement visibility rules.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--announcement', type=int, nargs='+', dest='announcement_ids',
+            help='只检查指定ID的公告（默认检查全部）',
+        )
+        parser.add_argument('--fix', action='store_true', help='发现不一致时重建对应公告的收件箱')
+
+    def handle(self, *args, **options):
+        discrepancies = check_inbox_consistency(options['announcement_ids'])
+        if not discrepancies:
+            self.stdout.write(self.style.SUCCESS('收件箱与可见性规则一致。'))
+            return
+
+        for item in discrepancies:
+            self.stdout.write(self.style.WARNING(
+                f'公告 {item.announcement_id}: 缺失 {len(item.missing_user_ids)} 行, '
+                f'多余 {len(item.extra_user_ids)} 行'
+            ))
+
+        if options['fix']:
+            added, removed = rebuild_inbox([item.announcement_id for item in discrepancies])
+            self.stdout.write(self.style.SUCCESS(f'已修复：新增 {added} 行，删除 {removed} 行。'))
+        else:
+            raise CommandError(f'发现 {len(discrepancies)} 条公告的收件箱不一致，可使用 --fix 修复。')
@@ -0,0 +1,69 @@
+# -*- coding=utf-8 -*-
+
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from announcements.loadtest import percentile
+
+class Command(BaseCommand):
+    help = 'Aggregates the request profiling log into per-view and per-SQL-fingerprint hot-spot reports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', nargs='?', help='剖析日志路径（默认 settings.ANNOUNCEMENTS_PROFILING_LOG）')
+        parser.add_argument('--top', type=int, default=20, help='显示的 SQL 指纹数量')
+        parser.add_argument('--view', help='只统计指定视图（URL 名称或视图函数路径）的请求')
+        parser.add_argument('--sort', choices=['total', 'count', 'max'], default='total', help='SQL 指纹的排序方式')
+
+    def handle(self, *args, **options):
+        path = options['log'] or getattr(settings, 'ANNOUNCEMENTS_PROFILING_LOG', None)
+        if not path:
+            raise CommandError('请指定剖析日志路径。')
+        views = defaultdict(list) # 视图 -> [请求记录]
+        statements = {} # 指纹ID -> 汇总
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if options['view'] and record['view'] != options['view']:
+                        continue
+                    views[record['view']].append(record)
+                    for query in record['slow_queries']:
+                        stats = statements.setdefault(query['id'], {
+                            'fingerprint': query['fingerprint'], 'requests': 0, 'count': 0,
+                            'total_ms': 0.0, 'max_ms': 0.0, 'views': set(),
+                        })
+                        stats['requests'] += 1
+                        stats['count'] += query['count']
+                        stats['total_ms'] += query['total_ms']
+                        stats['max_ms'] = max(stats['max_ms'], query['max_ms'])
+                        stats['views'].add(record['view'])
+        except FileNotFoundError:
+            raise CommandError(f'剖析日志不存在：{path}（使用 profiling on 开启剖析）')
+
+        self.stdout.write(f"{'视图':<36}{'请求数':>8}{'平均SQL条数':>12}{'平均SQL(ms)':>12}{'p50(ms)':>10}{'p95(ms)':>10}")
+        for view, records in sorted(views.items(), key=lambda item: -sum(r['total_ms'] for r in item[1])):
+            totals = sorted(record['total_ms'] for record in records)
+            self.stdout.write(
+                f"{str(view):<38}{len(records):>8}"
+                f"{sum(r['queries'] for r in records) / len(records):>12.1f}"
+                f"{sum(r['sql_ms'] for r in records) / len(records):>12.2f}"
+                f"{percentile(totals, 0.5):>10.2f}{percentile(totals, 0.95):>10.2f}"
+            )
+
+        key = {'total': 'total_ms', 'count': 'count', 'max': 'max_ms'}[options['sort']]
+        ranked = sorted(statements.items(), key=lambda item: item[1][key], reverse=True)[:options['top']]
+        self.stdout.write('')
+        for fingerprint_id, stats in ranked:
+            self.stdout.write(self.style.WARNING(
+                f"[{fingerprint_id}] 总耗时 {stats['total_ms']:.2f}ms，执行 {stats['count']} 次"
+                f"（{stats['requests']} 个请求），最长 {stats['max_ms']:.2f}ms，视图：{', '.join(sorted(map(str, stats['views'])))}"
+            ))
+            self.stdout.write(f"    {stats['fingerprint']}")
+        if not ranked:
+            self.stdout.write('日志中没有 SQL 记录。')
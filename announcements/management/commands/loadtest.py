@@ -0,0 +1,56 @@
+# -*- coding=utf-8 -*-
+
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from announcements.loadtest import DEFAULT_MIX, run_load_test
+
+class Command(BaseCommand):
+    help = 'Replays a mix of list/detail/search/mark-read API traffic in-process and reports latency percentiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='请求总数')
+        parser.add_argument('--threads', type=int, default=8, help='并发线程数')
+        parser.add_argument('--users', type=int, default=50, help='参与压测的用户数（从 --prefix 用户中按ID取前 N 个）')
+        parser.add_argument('--prefix', default='load', help='压测用户的用户名前缀（见 seed_announcements）')
+        parser.add_argument('--warmup', type=int, default=100, help='预热请求数（不计入结果）')
+        parser.add_argument(
+            '--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+            help='请求类型权重，如 list=50,detail=25,search=15,mark_read=10',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='随机数种子（决定请求序列）')
+        parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+
+    def handle(self, *args, **options):
+        try:
+            mix = {name: int(weight) for name, weight in (item.split('=') for item in options['mix'].split(','))}
+        except ValueError:
+            raise CommandError('--mix 格式应为 name=weight,...')
+        unknown = set(mix) - set(DEFAULT_MIX)
+        if unknown:
+            raise CommandError(f"未知的请求类型：{', '.join(sorted(unknown))}")
+        users = list(User.objects.filter(username__startswith=f"{options['prefix']}_").order_by('pk')[:options['users']])
+        if not users:
+            raise CommandError('没有可用的压测用户，请先运行 seed_announcements。')
+
+        result = run_load_test(
+            users, requests=options['requests'], threads=options['threads'], mix=mix,
+            seed=options['seed'], warmup=options['warmup'],
+        )
+        report = result.report()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        total = report.pop('total')
+        self.stdout.write(f"{'接口':<10}{'请求数':>8}{'错误':>6}{'req/s':>9}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+        for endpoint, row in report.items():
+            self.stdout.write(
+                f"{endpoint:<12}{row['count']:>8}{row['errors']:>6}{row['rps']:>9}"
+                f"{row['p50_ms']:>10}{row['p90_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}"
+            )
+        style = self.style.WARNING if total['errors'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"共 {total['count']} 个请求，{total['errors']} 个错误，用时 {total['elapsed_s']}s，吞吐量 {total['rps']} req/s"
+        ))
@@ -0,0 +1,30 @@
+# -*- coding=utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+
+from announcements import profiling
+
+class Command(BaseCommand):
+    help = 'Turns per-request profiling on or off at runtime (all processes pick it up within the refresh interval).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['on', 'off', 'reset', 'status'], help='on: 开启；off: 关闭；reset: 恢复 settings 中的配置；status: 查看当前配置')
+        parser.add_argument('--sample-rate', type=float, default=None, help='被剖析的请求比例（0-1），on 时默认为 1')
+        parser.add_argument('--top', type=int, default=None, help='每个请求记录总耗时最高的前 N 个 SQL 指纹')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'on':
+            sample_rate = 1.0 if options['sample_rate'] is None else options['sample_rate']
+            if not 0 < sample_rate <= 1:
+                raise CommandError('--sample-rate 必须在 (0, 1] 范围内。')
+            overrides = {'sample_rate': sample_rate}
+            if options['top'] is not None:
+                overrides['top'] = options['top']
+            profiling.set_config(**overrides)
+        elif action == 'off':
+            profiling.set_config(sample_rate=0.0)
+        elif action == 'reset':
+            profiling.set_config()
+        config = profiling.current_config()
+        self.stdout.write(f"采样率 {config['sample_rate']}，每个请求记录前 {config['top']} 个 SQL 指纹。")
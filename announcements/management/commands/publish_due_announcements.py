@@ -0,0 +1,15 @@
+# -*- coding=utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from announcements.publishing import publish_due_announcements
+
+class Command(BaseCommand):
+    help = 'Activates scheduled announcements whose publish time has passed (run periodically, e.g. from cron).'
+
+    def handle(self, *args, **options):
+        activated = publish_due_announcements()
+        if activated:
+            self.stdout.write(self.style.SUCCESS(f'已生效 {len(activated)} 条公告: {activated}'))
+        else:
+            self.stdout.write('没有需要生效的公告。')
@@ -0,0 +1,19 @@
+# -*- coding=utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from announcements.inbox import rebuild_inbox
+
+class Command(BaseCommand):
+    help = 'Rebuilds the materialized per-user inbox (announcement visibility table).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--announcement', type=int, nargs='+', dest='announcement_ids',
+            help='只重建指定ID的公告（默认重建全部）',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('开始重建收件箱...'))
+        added, removed = rebuild_inbox(options['announcement_ids'])
+        self.stdout.write(self.style.SUCCESS(f'收件箱重建完成：新增 {added} 行，删除 {removed} 行。'))
@@ -0,0 +1,19 @@
+# -*- coding=utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from announcements.analytics import rebuild_read_analytics
+from announcements.models import Announcement
+
+class Command(BaseCommand):
+    help = 'Recomputes per-announcement read rollups (audience, reads, hourly reads) from the raw tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--announcement', type=int, nargs='+', dest='announcement_ids', help='只重建指定ID的公告（默认全部公告）')
+
+    def handle(self, *args, **options):
+        announcement_ids = options['announcement_ids']
+        if not announcement_ids:
+            announcement_ids = Announcement.objects.order_by('pk').values_list('pk', flat=True).iterator()
+        rebuilt = rebuild_read_analytics(announcement_ids)
+        self.stdout.write(self.style.SUCCESS(f'已重建 {rebuilt} 条公告的阅读统计。'))
@@ -0,0 +1,15 @@
+# -*- coding=utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from announcements.models import Announcement
+from announcements.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuilds the announcement full-text search index.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(self.style.SUCCESS(f'开始重建搜索索引（{type(backend).__name__}）...'))
+        count = backend.rebuild(Announcement.objects.only('pk', 'title', 'content').iterator())
+        self.stdout.write(self.style.SUCCESS(f'搜索索引重建完成，共 {count} 条公告。'))
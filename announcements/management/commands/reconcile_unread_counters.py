@@ -0,0 +1,32 @@
+# -*- coding=utf-8 -*-
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from announcements.counters import refresh_unread_counters
+
+class Command(BaseCommand):
+    help = 'Recomputes per-user unread counters from the inbox and read status tables to fix drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='+', dest='user_ids', help='只校正指定ID的用户（默认全部用户）')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批校正的用户数量')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            user_ids = User.objects.order_by('pk').values_list('pk', flat=True).iterator()
+
+        batch, checked, drifted = [], 0, 0
+        for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) >= options['batch_size']:
+                drifted += refresh_unread_counters(batch)
+                checked += len(batch)
+                batch = []
+        if batch:
+            drifted += refresh_unread_counters(batch)
+            checked += len(batch)
+
+        style = self.style.WARNING if drifted else self.style.SUCCESS
+        self.stdout.write(style(f'已校正 {checked} 个用户的未读计数，其中 {drifted} 个存在漂移。'))
@@ -0,0 +1,54 @@
+# -*- coding=utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from django.core.management.base import BaseCommand
+
+from announcements.api.cache import bump_generation
+from announcements.models import Announcement
+from announcements.rendering import render_markdown, content_digest
+
+class Command(BaseCommand):
+    help = 'Re-renders stored announcement HTML in bulk (e.g. after upgrading Markdown extensions).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='重新渲染所有公告（默认只渲染摘要已过期的公告）')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='渲染进程数')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批读取和写回的公告数量')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        force = options['force']
+        rendered = 0
+
+        self.stdout.write(self.style.SUCCESS('开始渲染公告内容...'))
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            last_id = 0
+            while True:
+                # 按主键分批读取，避免一次载入全部公告
+                batch = list(
+                    Announcement.objects.filter(pk__gt=last_id).order_by('pk')
+                    .only('pk', 'content', 'content_hash')[:batch_size]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1].pk
+
+                stale = [a for a in batch if force or a.content_hash != content_digest(a.content)]
+                if not stale:
+                    continue
+                htmls = executor.map(render_markdown, [a.content for a in stale], chunksize=16)
+                for announcement, html in zip(stale, htmls):
+                    announcement.content_html = html
+                    announcement.content_hash = content_digest(announcement.content)
+                # bulk_update 不触发 save()/信号，也不会修改 updated_at
+                Announcement.objects.bulk_update(stale, ['content_html', 'content_hash'])
+                rendered += len(stale)
+                self.stdout.write(f'已渲染 {rendered} 条公告...')
+
+        if rendered:
+            # updated_at 未变：递增代数，使缓存的序列化主体和 ETag 失效
+            bump_generation()
+
+        self.stdout.write(self.style.SUCCESS(f'渲染完成，共 {rendered} 条公告。'))
@@ -0,0 +1,33 @@
+# -*- coding=utf-8 -*-
+
+import json
+import threading
+
+from django.core.management.base import BaseCommand
+
+from announcements.scheduler import PublishScheduler
+
+class Command(BaseCommand):
+    help = 'Runs the scheduled-publish daemon that activates announcements exactly when publish_at is reached.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh-interval', type=float, default=30, help='从数据库重新加载未生效公告的间隔（秒）')
+        parser.add_argument('--stats-interval', type=float, default=60, help='输出调度统计的间隔（秒），0 表示不输出')
+
+    def handle(self, *args, **options):
+        scheduler = PublishScheduler(refresh_interval=options['refresh_interval'])
+        thread = threading.Thread(target=scheduler.serve_forever, name='publish-scheduler', daemon=True)
+        thread.start()
+        self.stdout.write(self.style.SUCCESS('调度器已启动，按 Ctrl+C 退出。'))
+
+        stats_interval = options['stats_interval'] or None
+        try:
+            while thread.is_alive():
+                thread.join(stats_interval)
+                if stats_interval and thread.is_alive():
+                    self.stdout.write(json.dumps(scheduler.metrics.snapshot(), default=str))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scheduler.stop()
+            thread.join(5)
@@ -0,0 +1,180 @@
+# -*- coding=utf-8 -*-
+
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from announcements.analytics import rebuild_read_analytics
+from announcements.counters import refresh_unread_counters
+from announcements.models import Announcement, Category, InboxEntry, ReadStatus
+from announcements.recipients import keyset_values
+
+# 标题和正文使用的词汇，便于搜索压测命中
+WORDS = [
+    '系统维护', '网络升级', '放假安排', '安全培训', '年度总结', '招聘启事', '会议通知', '停电检修',
+    '报销流程', '新人入职', '消防演练', '体检安排', '版本发布', '值班表', '团建活动', '绩效考核',
+]
+LEVELS = [('low', 1), ('medium', 2), ('high', 3), ('urgent', 4)]
+
+class Command(BaseCommand):
+    help = 'Bulk-creates synthetic users, groups, announcements and read receipts for local load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000, help='用户数量')
+        parser.add_argument('--groups', type=int, default=40, help='用户组数量（每个用户加入 1-3 个组）')
+        parser.add_argument('--announcements', type=int, default=5000, help='公告数量')
+        parser.add_argument('--broadcast-ratio', type=float, default=0.02, help='所有用户可见的公告比例')
+        parser.add_argument('--direct-ratio', type=float, default=0.3, help='指定接收用户的公告比例（其余指定用户组）')
+        parser.add_argument('--scheduled-ratio', type=float, default=0.02, help='定时发布（尚未到时间）的公告比例')
+        parser.add_argument('--read-ratio', type=float, default=0.3, help='已生效收件箱条目中已读的比例')
+        parser.add_argument('--batch-size', type=int, default=2000, help='bulk_create 每批写入的行数')
+        parser.add_argument('--prefix', default='load', help='用户名和用户组名前缀')
+        parser.add_argument('--seed', type=int, default=42, help='随机数种子（相同参数和种子生成相同的数据）')
+
+    def log(self, message):
+        self.stdout.write(f'[{time.perf_counter() - self.started:7.1f}s] {message}')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f'已存在前缀为 {prefix}_ 的用户，请更换 --prefix 或先清理数据。')
+        self.started = time.perf_counter()
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        user_ids, members = self.create_users_and_groups(options)
+        announcement_ids = self.create_announcements(options, user_ids, members)
+        reads = self.create_reads(options, announcement_ids)
+        self.log(f'阅读记录写入 {reads} 行，重新计算未读计数和阅读统计...')
+        for start in range(0, len(user_ids), 1000):
+            refresh_unread_counters(user_ids[start:start + 1000])
+        rebuild_read_analytics(announcement_ids) # 阅读记录直接写入，阅读统计需要从原始表重建
+        call_command('rebuild_search_index', stdout=self.stdout)
+        self.log(self.style.SUCCESS('测试数据生成完成。'))
+
+    def create_users_and_groups(self, options):
+        prefix, rng = options['prefix'], self.rng
+        password = make_password(None) # 不可用的密码，压测通过 force_login 登录
+        now = timezone.now()
+        User.objects.bulk_create(
+            (User(username=f'{prefix}_{i:06d}', password=password, date_joined=now) for i in range(options['users'])),
+            batch_size=self.batch_size,
+        )
+        user_ids = list(User.objects.filter(username__startswith=f'{prefix}_').order_by('pk').values_list('pk', flat=True))
+
+        Group.objects.bulk_create(Group(name=f'{prefix}_group_{i:03d}') for i in range(options['groups']))
+        group_ids = list(Group.objects.filter(name__startswith=f'{prefix}_group_').order_by('pk').values_list('pk', flat=True))
+        # 压测用户通过 API 查看公告需要 view_announcement 权限
+        view_permission = Permission.objects.get(content_type__app_label='announcements', codename='view_announcement')
+        Group.permissions.through.objects.bulk_create(
+            Group.permissions.through(group_id=group_id, permission_id=view_permission.pk) for group_id in group_ids
+        )
+        members = {group_id: [] for group_id in group_ids} # 用户组 -> 成员ID，写入收件箱时使用
+        memberships = []
+        for user_id in user_ids:
+            for group_id in rng.sample(group_ids, min(len(group_ids), rng.randint(1, 3))):
+                members[group_id].append(user_id)
+                memberships.append(User.groups.through(user_id=user_id, group_id=group_id))
+        User.groups.through.objects.bulk_create(memberships, batch_size=self.batch_size)
+        self.log(f'创建 {len(user_ids)} 个用户、{len(group_ids)} 个用户组')
+        return user_ids, members
+
+    def create_announcements(self, options, user_ids, members):
+        """
+        批量写入公告及其接收者；收件箱直接按生成的接收者写入（与可见性规则一致），不逐条同步
+        """
+        rng, now = self.rng, timezone.now()
+        group_ids = list(members)
+        all_user_ids = list(User.objects.values_list('pk', flat=True)) # 不指定接收者的公告对所有用户可见
+        author_id = User.objects.filter(is_superuser=True).values_list('pk', flat=True).first() or user_ids[0]
+        category_ids = list(Category.objects.values_list('pk', flat=True)) or [None]
+        first_id = (Announcement.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+
+        announcement_ids = []
+        for start in range(0, options['announcements'], self.batch_size):
+            count = min(self.batch_size, options['announcements'] - start)
+            announcements, user_targets, group_targets, inbox = [], [], [], []
+            for offset in range(count):
+                announcement_id = first_id + start + offset
+                level, numeric = rng.choices(LEVELS, weights=[70, 20, 8, 2])[0]
+                if rng.random() < options['scheduled_ratio']:
+                    publish_at, activated_at = now + timedelta(minutes=rng.randint(10, 10_000)), None
+                else:
+                    publish_at = now - timedelta(minutes=rng.randint(1, 525_600))
+                    activated_at = publish_at
+                words = rng.sample(WORDS, 3)
+                announcement = Announcement(
+                    pk=announcement_id, title=f'{words[0]}：{words[1]}', author_id=author_id,
+                    content=f'# {words[0]}\n\n关于{words[1]}和{words[2]}的说明，请相关同事知悉。',
+                    category_id=rng.choice(category_ids), emergency_level=level, emergency_level_numeric=numeric,
+                    publish_at=publish_at, activated_at=activated_at,
+                )
+                announcement.render_content()
+                announcements.append(announcement)
+
+                kind = rng.random()
+                if kind < options['broadcast_ratio']:
+                    recipients = all_user_ids # 不指定接收者：所有用户可见
+                elif kind < options['broadcast_ratio'] + options['direct_ratio']:
+                    recipients = rng.sample(user_ids, min(len(user_ids), rng.randint(1, 50)))
+                    user_targets.extend(
+                        Announcement.target_users.through(announcement_id=announcement_id, user_id=user_id)
+                        for user_id in recipients
+                    )
+                else:
+                    targets = rng.sample(group_ids, min(len(group_ids), rng.randint(1, 3)))
+                    recipients = {user_id for group_id in targets for user_id in members[group_id]}
+                    group_targets.extend(
+                        Announcement.target_groups.through(announcement_id=announcement_id, group_id=group_id)
+                        for group_id in targets
+                    )
+                inbox.extend(InboxEntry(user_id=user_id, announcement_id=announcement_id) for user_id in recipients)
+            with transaction.atomic():
+                Announcement.objects.bulk_create(announcements)
+                Announcement.target_users.through.objects.bulk_create(user_targets, batch_size=self.batch_size)
+                Announcement.target_groups.through.objects.bulk_create(group_targets, batch_size=self.batch_size)
+                InboxEntry.objects.bulk_create(inbox, batch_size=self.batch_size)
+            announcement_ids.extend(announcement.pk for announcement in announcements)
+            self.log(f'公告 {start + count} / {options["announcements"]}，收件箱 {len(inbox)} 行')
+        return announcement_ids
+
+    def create_reads(self, options, announcement_ids):
+        """
+        按收件箱条目抽样写入阅读记录（只针对已生效的公告）
+        """
+        rng, ratio, now = self.rng, options['read_ratio'], timezone.now()
+        published = Announcement.objects.filter(pk__in=announcement_ids, activated_at__isnull=False)
+        entries = InboxEntry.objects.filter(
+            announcement__in=published, announcement_id__gte=min(announcement_ids), announcement_id__lte=max(announcement_ids),
+        )
+        total, batch = 0, []
+        for entry_id in keyset_values(entries, 'pk', self.batch_size):
+            if rng.random() < ratio:
+                batch.append(entry_id)
+            if len(batch) >= self.batch_size:
+                total += self._write_reads(batch)
+                batch = []
+        if batch:
+            total += self._write_reads(batch)
+
+        # read_at 为 auto_now_add，写入后统一回填为公告的发布时间，使阅读历史的时间分布与发布时间一致
+        ReadStatus.objects.filter(
+            read_at__gte=now, announcement_id__gte=min(announcement_ids), announcement_id__lte=max(announcement_ids),
+        ).update(read_at=Subquery(Announcement.objects.filter(pk=OuterRef('announcement_id')).values('publish_at')[:1]))
+        return total
+
+    def _write_reads(self, entry_ids):
+        rows = InboxEntry.objects.filter(pk__in=entry_ids).values_list('user_id', 'announcement_id')
+        ReadStatus.objects.bulk_create(
+            (ReadStatus(user_id=user_id, announcement_id=announcement_id) for user_id, announcement_id in rows),
+            ignore_conflicts=True,
+        )
+        return len(entry_ids)
@@ -0,0 +1,316 @@
+# -*- coding=utf-8 -*-
+
+# announcements/metrics.py
+
+"""
+系统内部指标（Prometheus 文本格式，由 /metrics 输出，见 announcements/views.metrics_view）：
+
+- 计数器和直方图按线程分片聚合：每个线程只写自己的分片，记录时不加锁；
+  导出时汇总所有分片，线程结束后其分片并入“已退出线程”分片，计数不会回退
+- 单进程时 /metrics 直接汇总本进程的分片；设置 settings.ANNOUNCEMENTS_METRICS_DIR 后为多进程模式：
+  每个进程由后台线程每隔 ANNOUNCEMENTS_METRICS_SYNC_INTERVAL 秒把快照写入 <目录>/<pid>-<启动时间>.json（先写临时文件再替换；
+  文件名带启动时间，pid 被新进程复用时不会覆盖已退出进程的快照），
+  /metrics 汇总目录下所有进程的快照（已退出进程的快照保留，计数同样不会回退）。
+  gunicorn 等预派生（fork）服务器下，子进程会清空从父进程继承的分片；部署时应在启动前清空该目录
+
+    REQUEST_LATENCY.observe(0.012, view='announcement_list')
+    with MARKDOWN_RENDER.time():
+        ...
+"""
+
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Shard:
+    """
+    一个线程的指标值：计数器 {(指标名, 标签值): 数值}，直方图 {(指标名, 标签值): [各桶计数..., 总和, 次数]}
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}')
+        return self.name, tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry.shard().counters[self._key(labels)] += amount
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        histograms = self.registry.shard().histograms
+        key = self._key(labels)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(self.buckets) + 3) # 各桶 + (+Inf) + 总和 + 次数
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class Registry:
+    """
+    指标注册表：按线程分片记录，导出时汇总
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock() # 只在创建/退出分片和汇总时使用
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard() # 已退出线程的累计值
+        self._sync_thread = None
+        self._snapshot_name = _snapshot_name()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'指标 {metric.name} 已注册')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self):
+        """
+        当前线程的分片（第一次使用时创建并登记）
+        """
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+            self._start_sync()
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            if shard in self._shards:
+                self._shards.remove(shard)
+                _merge(self._retired, _copy(shard))
+
+    def _reset(self):
+        # fork 后的子进程：丢弃从父进程继承的值和同步线程
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._sync_thread = None
+        self._snapshot_name = _snapshot_name()
+
+    def snapshot(self):
+        """
+        汇总本进程所有分片
+        """
+        with self._lock:
+            shards = [self._retired, *self._shards]
+        total = _Shard()
+        for shard in shards:
+            _merge(total, _copy(shard))
+        return total
+
+    def collect(self):
+        """
+        导出用的汇总值：多进程模式下先写出本进程的快照，再汇总目录下所有进程的快照
+        """
+        directory = metrics_dir()
+        if not directory:
+            return self.snapshot()
+        self.sync()
+        total = _Shard()
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    _merge(total, _load(json.load(f)))
+            except (OSError, ValueError):
+                continue # 正在被替换或已损坏的快照
+        return total
+
+    def sync(self):
+        """
+        多进程模式下把本进程的快照写入 <目录>/<pid>-<启动时间>.json
+        """
+        directory = metrics_dir()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(_dump(self.snapshot()), f)
+        os.replace(temp_path, os.path.join(directory, self._snapshot_name))
+
+    def _start_sync(self):
+        if self._sync_thread is not None or not metrics_dir():
+            return
+        with self._lock:
+            if self._sync_thread is not None:
+                return
+            self._sync_thread = threading.Thread(target=self._sync_loop, name='metrics-sync', daemon=True)
+        self._sync_thread.start()
+
+    def _sync_loop(self):
+        interval = getattr(settings, 'ANNOUNCEMENTS_METRICS_SYNC_INTERVAL', 5)
+        while True:
+            time.sleep(interval)
+            try:
+                self.sync()
+            except OSError:
+                pass
+
+    def render(self):
+        """
+        Prometheus 文本格式（version 0.0.4）
+        """
+        values = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            if metric.kind == 'counter':
+                for (metric_name, labels), value in sorted(values.counters.items()):
+                    if metric_name == name:
+                        lines.append(f'{name}{_labels(metric.labelnames, labels)} {_number(value)}')
+                continue
+            for (metric_name, labels), counts in sorted(values.histograms.items()):
+                if metric_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*metric.buckets, '+Inf'), counts):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f'{name}_bucket{_labels((*metric.labelnames, "le"), (*labels, le))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(metric.labelnames, labels)} {_number(counts[-2])}')
+                lines.append(f'{name}_count{_labels(metric.labelnames, labels)} {counts[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _snapshot_name():
+    return f'{os.getpid()}-{time.time_ns()}.json'
+
+
+def metrics_dir():
+    return getattr(settings, 'ANNOUNCEMENTS_METRICS_DIR', None)
+
+
+def _copy(shard):
+    # 分片的拥有者线程可能同时在写入：dict() 和 list() 在持有 GIL 时完成，不会看到半更新的字典
+    copy = _Shard()
+    copy.counters.update(dict(shard.counters))
+    copy.histograms = {key: list(values) for key, values in dict(shard.histograms).items()}
+    return copy
+
+
+def _merge(target, source):
+    for key, value in source.counters.items():
+        target.counters[key] += value
+    for key, values in source.histograms.items():
+        existing = target.histograms.get(key)
+        if existing is None or len(existing) != len(values):
+            target.histograms[key] = list(values)
+        else:
+            target.histograms[key] = [a + b for a, b in zip(existing, values)]
+
+
+def _dump(shard):
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in shard.counters.items()],
+        'histograms': [[name, list(labels), values] for (name, labels), values in shard.histograms.items()],
+    }
+
+
+def _load(data):
+    shard = _Shard()
+    for name, labels, value in data['counters']:
+        shard.counters[name, tuple(labels)] += value
+    for name, labels, values in data['histograms']:
+        shard.histograms[name, tuple(labels)] = values
+    return shard
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'announcements_request_duration_seconds', 'Request latency by view.', ['view'],
+)
+VISIBILITY_QUERY = registry.histogram(
+    'announcements_visibility_query_seconds', 'Time spent in visibility queries.', ['query'],
+)
+READ_RECEIPTS = registry.counter(
+    'announcements_read_receipts_written_total', 'Read receipts written to the database.', ['source'],
+)
+SERIALIZER_CACHE = registry.counter(
+    'announcements_serializer_cache_lookups_total', 'Serializer body cache lookups by tier (miss when no tier had it).',
+    ['result'],
+)
+MARKDOWN_RENDER = registry.histogram(
+    'announcements_markdown_render_seconds', 'Markdown to HTML render time.',
+)
+PUBLISH_LAG = registry.histogram(
+    'announcements_publish_lag_seconds', 'Delay between an announcement\'s publish_at and its activation.',
+    buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_inbox(apps, schema_editor):
+    """
+    为已有公告生成收件箱行（与 announcements.recipients.iter_recipient_ids 的规则一致）
+    """
+    Announcement = apps.get_model('announcements', 'Announcement')
+    InboxEntry = apps.get_model('announcements', 'InboxEntry')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Membership = User.groups.through
+
+    for announcement in Announcement.objects.iterator():
+        user_ids = set(announcement.target_users.values_list('id', flat=True))
+        group_ids = list(announcement.target_groups.values_list('id', flat=True))
+        if not user_ids and not group_ids:
+            user_ids = set(User.objects.values_list('id', flat=True))
+        elif group_ids:
+            user_ids.update(Membership.objects.filter(group_id__in=group_ids).values_list('user_id', flat=True))
+        InboxEntry.objects.bulk_create(
+            (InboxEntry(user_id=user_id, announcement_id=announcement.pk) for user_id in user_ids),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='投递时间')),
+                ('announcement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='announcements.announcement', verbose_name='公告')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '收件箱条目',
+                'verbose_name_plural': '收件箱条目',
+                'unique_together': {('user', 'announcement')},
+            },
+        ),
+        migrations.RunPython(populate_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0002_inboxentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='内容摘要'),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='渲染后的内容'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# 全文搜索索引表：SQLite 使用 FTS5 虚拟表，PostgreSQL 使用 tsvector + GIN 索引，其他数据库不创建（使用内存倒排索引）
+
+from django.db import migrations
+
+SQLITE_FTS_TABLE = 'announcements_search_fts'
+POSTGRES_SEARCH_TABLE = 'announcements_search_document'
+
+
+def create_search_tables(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                return # 未编译 FTS5 时退回内存倒排索引
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} "
+            f"USING fts5(title, content, tokenize='unicode61')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE IF NOT EXISTS {POSTGRES_SEARCH_TABLE} ('
+            'announcement_id bigint PRIMARY KEY REFERENCES announcements_announcement (id) ON DELETE CASCADE, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {POSTGRES_SEARCH_TABLE}_gin ON {POSTGRES_SEARCH_TABLE} USING GIN (document)'
+        )
+    else:
+        return
+
+    # 为已有公告建立索引
+    from announcements.search import SQLiteFTSBackend, PostgresSearchBackend
+
+    backend = SQLiteFTSBackend() if vendor == 'sqlite' else PostgresSearchBackend()
+    Announcement = apps.get_model('announcements', 'Announcement')
+    backend.rebuild(Announcement.objects.only('pk', 'title', 'content').iterator())
+
+
+def drop_search_tables(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {POSTGRES_SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0003_announcement_content_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0004_search_index'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['-emergency_level_numeric', '-publish_at', '-id'], name='announcement_list_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['publish_at'], name='announcement_publish_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readstatus',
+            index=models.Index(fields=['user', '-read_at'], name='readstatus_user_recent_idx'),
+        ),
+    ]
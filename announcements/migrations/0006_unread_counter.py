@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def activate_published(apps, schema_editor):
+    """
+    已到达发布时间的公告视为已生效；未读计数在首次读取时按数据库计算
+    """
+    Announcement = apps.get_model('announcements', 'Announcement')
+    Announcement.objects.filter(publish_at__lte=django.utils.timezone.now()).update(activated_at=models.F('publish_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0005_list_indexes'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+                ('count', models.IntegerField(default=0, verbose_name='未读数量')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '未读计数',
+                'verbose_name_plural': '未读计数',
+            },
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='activated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='生效时间'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('activated_at__isnull', True)), fields=['publish_at'], name='announcement_pending_idx'),
+        ),
+        migrations.RunPython(activate_published, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0007_dead_letter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnouncementReadStats',
+            fields=[
+                ('announcement', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='read_stats', serialize=False, to='announcements.announcement', verbose_name='公告')),
+                ('audience', models.IntegerField(default=0, verbose_name='受众人数')),
+                ('reads', models.IntegerField(default=0, verbose_name='已读人数')),
+                ('first_read_at', models.DateTimeField(blank=True, null=True, verbose_name='首次阅读时间')),
+                ('last_read_at', models.DateTimeField(blank=True, null=True, verbose_name='最近阅读时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '公告阅读统计',
+                'verbose_name_plural': '公告阅读统计',
+            },
+        ),
+        migrations.CreateModel(
+            name='AnnouncementReadHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='小时')),
+                ('reads', models.IntegerField(default=0, verbose_name='阅读数')),
+                ('announcement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_hourly', to='announcements.announcement', verbose_name='公告')),
+            ],
+            options={
+                'verbose_name': '公告每小时阅读数',
+                'verbose_name_plural': '公告每小时阅读数',
+                'ordering': ['hour'],
+                'unique_together': {('announcement', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+import datetime
+
+from django.db import migrations
+from django.db.models import Count, Max, Min
+from django.db.models.functions import TruncHour
+
+BATCH_SIZE = 500
+
+
+def backfill_read_analytics(apps, schema_editor):
+    """
+    为已生效的公告按收件箱和阅读记录计算阅读统计（与 rebuild_read_analytics 命令相同）
+    """
+    Announcement = apps.get_model('announcements', 'Announcement')
+    InboxEntry = apps.get_model('announcements', 'InboxEntry')
+    ReadStatus = apps.get_model('announcements', 'ReadStatus')
+    AnnouncementReadStats = apps.get_model('announcements', 'AnnouncementReadStats')
+    AnnouncementReadHourly = apps.get_model('announcements', 'AnnouncementReadHourly')
+
+    announcement_ids = list(
+        Announcement.objects.filter(activated_at__isnull=False).order_by('pk').values_list('pk', flat=True)
+    )
+    for start in range(0, len(announcement_ids), BATCH_SIZE):
+        chunk = announcement_ids[start:start + BATCH_SIZE]
+        audience = dict(
+            InboxEntry.objects.filter(announcement_id__in=chunk)
+            .values('announcement_id').annotate(n=Count('id')).values_list('announcement_id', 'n')
+        )
+        reads = {
+            row['announcement_id']: row for row in
+            ReadStatus.objects.filter(announcement_id__in=chunk).values('announcement_id')
+            .annotate(n=Count('id'), first=Min('read_at'), last=Max('read_at'))
+        }
+        AnnouncementReadStats.objects.bulk_create(
+            [
+                AnnouncementReadStats(
+                    announcement_id=announcement_id, audience=audience.get(announcement_id, 0),
+                    reads=reads[announcement_id]['n'] if announcement_id in reads else 0,
+                    first_read_at=reads[announcement_id]['first'] if announcement_id in reads else None,
+                    last_read_at=reads[announcement_id]['last'] if announcement_id in reads else None,
+                )
+                for announcement_id in chunk
+            ],
+            update_conflicts=True, unique_fields=['announcement'],
+            update_fields=['audience', 'reads', 'first_read_at', 'last_read_at', 'updated_at'],
+        )
+        AnnouncementReadHourly.objects.filter(announcement_id__in=chunk).delete()
+        AnnouncementReadHourly.objects.bulk_create(
+            AnnouncementReadHourly(announcement_id=row['announcement_id'], hour=row['hour'], reads=row['n'])
+            for row in ReadStatus.objects.filter(announcement_id__in=chunk)
+            .annotate(hour=TruncHour('read_at', tzinfo=datetime.timezone.utc))
+            .values('announcement_id', 'hour').annotate(n=Count('id'))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0008_read_analytics'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_read_analytics, migrations.RunPython.noop),
+    ]
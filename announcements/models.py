@@ -5,7 +5,11 @@
 from django.db import models
 from django.contrib.auth.models import User, Group
 from django.utils import timezone
-import markdown
+
+from .metrics import MARKDOWN_RENDER, VISIBILITY_QUERY
+from .profiling import timed
+from .recipients import iter_recipient_ids
+from .rendering import render_markdown, content_digest
 
 class Category(models.Model):
     """
@@ -22,6 +26,32 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def user_group_ids(user):
+    """
+    用户所属用户组的ID，缓存在用户对象上（request.user 每个请求一个实例，相当于按请求缓存）
+    """
+    if not hasattr(user, '_announcement_group_ids'):
+        user._announcement_group_ids = list(user.groups.values_list('id', flat=True))
+    return user._announcement_group_ids
+
+class AnnouncementQuerySet(models.QuerySet):
+    """
+    公告查询集：封装“已发布”和“对用户可见”两个常用过滤条件
+    """
+
+    def published(self):
+        """
+        已到达计划发布时间的公告
+        """
+        return self.filter(publish_at__lte=timezone.now())
+
+    def visible_to(self, user):
+        """
+        对指定用户可见的公告：通过收件箱物化表按 user 做一次索引范围扫描，
+        每个 (user, announcement) 只有一行，因此不需要 distinct()
+        """
+        return self.filter(inbox_entries__user=user)
+
 class Announcement(models.Model):
     """
     公告模型
@@ -35,6 +65,9 @@ class Announcement(models.Model):
 
     title = models.CharField(max_length=200, verbose_name="标题")
     content = models.TextField(verbose_name="内容 (支持Markdown)")
+    # 渲染后的HTML及其对应的内容摘要，仅在内容变化时重新渲染
+    content_html = models.TextField(blank=True, editable=False, verbose_name="渲染后的内容")
+    content_hash = models.CharField(max_length=64, blank=True, editable=False, verbose_name="内容摘要")
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="分类")
     author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="发布者")
     publish_at = models.DateTimeField(default=timezone.now, verbose_name="计划发布时间")
@@ -47,12 +80,26 @@ class Announcement(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    # 公告到达发布时间后“生效”的时间：生效时更新未读计数等（见 announcements/publishing.py），为空表示尚未生效
+    activated_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="生效时间")
+
+    objects = AnnouncementQuerySet.as_manager()
 
     class Meta:
         verbose_name = "公告"
         verbose_name_plural = "公告"
         # 优先排序：根据新的 numeric 字段进行倒序排序，然后是发布时间倒序
         ordering = ['-emergency_level_numeric', '-publish_at']
+        indexes = [
+            # 列表排序 (紧急程度, 发布时间, id)，同时服务于键集分页的范围条件
+            models.Index(fields=['-emergency_level_numeric', '-publish_at', '-id'], name='announcement_list_order_idx'),
+            # publish_at__lte=now() 过滤、按日期归档以及定时发布扫描
+            models.Index(fields=['publish_at'], name='announcement_publish_at_idx'),
+            # 部分索引：只包含尚未生效的公告，定时发布扫描“已到时间但未生效”的公告时使用
+            models.Index(
+                fields=['publish_at'], name='announcement_pending_idx', condition=models.Q(activated_at__isnull=True)
+            ),
+        ]
 
     @property
     def is_published(self):
@@ -68,18 +115,70 @@ class Announcement(models.Model):
         level_map = {'urgent': 4, 'high': 3, 'medium': 2, 'low': 1}
         return level_map.get(self.emergency_level, 1) # 默认值为1 (low)
 
+    def render_content(self):
+        """
+        内容摘要变化时重新渲染 content_html，返回是否进行了渲染
+        """
+        with timed('markdown'):
+            digest = content_digest(self.content)
+            if self.content_hash == digest:
+                return False
+            with MARKDOWN_RENDER.time():
+                self.content_html = render_markdown(self.content)
+        self.content_hash = digest
+        return True
+
     def save(self, *args, **kwargs):
         """
-        保存公告时自动设置 emergency_level_numeric 字段
+        保存公告时自动设置 emergency_level_numeric 字段，并在内容变化时重新渲染HTML
         """
         self.emergency_level_numeric = self._get_emergency_level_numeric_value()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            if self.render_content() and update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'content_html', 'content_hash'}
+        if update_fields is None and not self._state.adding:
+            # activated_at 只由 publishing 模块通过条件 UPDATE 维护，不能用内存中的旧值覆盖
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'activated_at'
+            ]
         super().save(*args, **kwargs)
 
+    def is_visible_to(self, user):
+        """
+        按可见性规则判断公告对用户是否可见（一次 EXISTS 查询，不依赖收件箱是否已同步）：
+        1. 未指定接收用户和用户组 2. 接收用户包含该用户 3. 接收用户组包含该用户所属的组
+        """
+        if not user.is_authenticated:
+            return False
+        users_through = Announcement.target_users.through.objects.filter(announcement=models.OuterRef('pk'))
+        groups_through = Announcement.target_groups.through.objects.filter(announcement=models.OuterRef('pk'))
+        condition = (
+            (~models.Exists(users_through) & ~models.Exists(groups_through))
+            | models.Exists(users_through.filter(user=user))
+        )
+        group_ids = user_group_ids(user)
+        if group_ids:
+            condition |= models.Exists(groups_through.filter(group_id__in=group_ids))
+        with VISIBILITY_QUERY.time(query='is_visible_to'):
+            return Announcement.objects.filter(condition, pk=self.pk).exists()
+
+    def iter_recipient_ids(self, chunk_size=1000):
+        """
+        按用户ID升序流式产生接收者ID（已去重，不载入 User 对象，见 announcements/recipients.py）
+        """
+        return iter_recipient_ids(self, chunk_size)
+
     def get_markdown_content(self):
         """
-        将Markdown内容渲染为HTML
+        返回渲染后的HTML：优先使用已保存的结果，过期时（如尚未回填）临时渲染
         """
-        return markdown.markdown(self.content, extensions=['extra', 'codehilite'])
+        with timed('markdown'):
+            if self.content_hash == content_digest(self.content):
+                return self.content_html
+            with MARKDOWN_RENDER.time():
+                return render_markdown(self.content)
 
     def __str__(self):
         return self.title
@@ -97,6 +196,109 @@ class ReadStatus(models.Model):
         verbose_name_plural = "阅读状态"
         unique_together = ('user', 'announcement') # 确保每个用户对每个公告只有一条阅读记录
         ordering = ['-read_at']
+        indexes = [
+            # “某用户的阅读记录，按时间倒序”（阅读历史）
+            models.Index(fields=['user', '-read_at'], name='readstatus_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.announcement.title} (已读)"
+
+class InboxEntry(models.Model):
+    """
+    用户收件箱模型（可见性物化表）：
+    - 每行表示某条公告对某个用户可见
+    - 在公告保存、接收用户/用户组变更以及用户组成员变更时维护（见 announcements/inbox.py）
+    - 列表、详情和 my_announcements 通过 user 索引做范围扫描，避免三路多对多连接和 DISTINCT
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_entries', verbose_name="用户")
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='inbox_entries', verbose_name="公告")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="投递时间")
+
+    class Meta:
+        verbose_name = "收件箱条目"
+        verbose_name_plural = "收件箱条目"
+        unique_together = ('user', 'announcement') # 每个用户对每条公告只有一条收件记录
+
+    def __str__(self):
+        return f"{self.user_id} <- {self.announcement_id}"
+
+
+class UnreadCounter(models.Model):
+    """
+    用户未读数量计数（反规范化）：
+    - 公告生效时对收件箱中未读的用户加一，写入阅读记录时减一（见 announcements/counters.py）
+    - 由 reconcile_unread_counters 命令定期校正
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter', verbose_name="用户")
+    count = models.IntegerField(default=0, verbose_name="未读数量")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    class Meta:
+        verbose_name = "未读计数"
+        verbose_name_plural = "未读计数"
+
+    def __str__(self):
+        return f"{self.user_id}: {self.count}"
+
+class AnnouncementReadStats(models.Model):
+    """
+    公告阅读汇总（增量维护，见 announcements/analytics.py）：
+    - audience 为公告生效时收件箱人数的快照，之后接收者变化不再修改
+    - reads 为当前已读人数，写入阅读记录时加一，标记未读时减一
+    - 由 rebuild_read_analytics 命令从原始表重新计算
+    """
+    announcement = models.OneToOneField(Announcement, on_delete=models.CASCADE, primary_key=True, related_name='read_stats', verbose_name="公告")
+    audience = models.IntegerField(default=0, verbose_name="受众人数")
+    reads = models.IntegerField(default=0, verbose_name="已读人数")
+    first_read_at = models.DateTimeField(null=True, blank=True, verbose_name="首次阅读时间")
+    last_read_at = models.DateTimeField(null=True, blank=True, verbose_name="最近阅读时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    class Meta:
+        verbose_name = "公告阅读统计"
+        verbose_name_plural = "公告阅读统计"
+
+    @property
+    def read_rate(self):
+        return self.reads / self.audience if self.audience else None
+
+    def __str__(self):
+        return f"{self.announcement_id}: {self.reads}/{self.audience}"
+
+class AnnouncementReadHourly(models.Model):
+    """
+    公告每小时（UTC 整点）的首次阅读数，用于绘制阅读率曲线（标记未读不回退）
+    """
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='read_hourly', verbose_name="公告")
+    hour = models.DateTimeField(verbose_name="小时")
+    reads = models.IntegerField(default=0, verbose_name="阅读数")
+
+    class Meta:
+        verbose_name = "公告每小时阅读数"
+        verbose_name_plural = "公告每小时阅读数"
+        unique_together = ('announcement', 'hour')
+        ordering = ['hour']
+
+    def __str__(self):
+        return f"{self.announcement_id} @ {self.hour:%Y-%m-%d %H}:00: {self.reads}"
+
+class DeadLetter(models.Model):
+    """
+    发送失败的通知（重试次数用尽或不可重试的错误），见 announcements/dispatch.py
+    """
+    channel = models.CharField(max_length=50, verbose_name="通知渠道")
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='dead_letters', verbose_name="公告")
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="接收用户")
+    address = models.CharField(max_length=255, blank=True, verbose_name="接收地址")
+    error = models.TextField(blank=True, verbose_name="错误信息")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="尝试次数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        verbose_name = "发送失败的通知"
+        verbose_name_plural = "发送失败的通知"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.channel}: {self.address} ({self.announcement_id})"
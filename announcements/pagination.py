@@ -0,0 +1,142 @@
+# -*- coding=utf-8 -*-
+
+# announcements/pagination.py
+
+"""
+键集（游标）分页：
+- 按排序字段的值定位下一页，而不是 OFFSET，翻到第几页的代价都相同
+- 不执行 COUNT(*)，需要总数时使用带缓存的近似总数
+HTML 列表页和 API 共用。
+"""
+
+import base64
+import hashlib
+import json
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'has_next'])
+
+COUNT_CACHE_TIMEOUT = 60 # 近似总数的缓存时间（秒）
+
+
+class InvalidCursor(ValueError):
+    """
+    游标无法解析（被篡改或排序方式已改变）
+    """
+
+
+def _ordering_of(queryset):
+    """
+    取查询集的排序字段，并保证以主键结尾（键集分页要求排序唯一）
+    """
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    last = ordering[-1].lstrip('-') if ordering else None
+    if last not in ('pk', 'id', queryset.model._meta.pk.name):
+        ordering.append('-pk' if ordering and ordering[-1].startswith('-') else 'pk')
+    return ordering
+
+
+class KeysetPaginator:
+    """
+    键集分页器：page() 返回从游标之后开始的一页
+    """
+
+    def __init__(self, queryset, page_size):
+        self.ordering = _ordering_of(queryset)
+        self.queryset = queryset.order_by(*self.ordering)
+        self.page_size = page_size
+
+    def _field_names(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def _value_of(self, obj, name):
+        return getattr(obj, 'pk' if name == 'pk' else name)
+
+    def encode_cursor(self, obj):
+        values = []
+        for name in self._field_names():
+            value = self._value_of(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw)
+        except (ValueError, TypeError) as exc:
+            raise InvalidCursor(str(exc)) from exc
+        names = self._field_names()
+        if not isinstance(values, list) or len(values) != len(names):
+            raise InvalidCursor('cursor does not match ordering')
+
+        decoded = []
+        for name, value in zip(names, values):
+            field = self._field_of(name)
+            # 游标中只应出现 JSON 标量（encode_cursor 的输出），其余类型视为被篡改
+            if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+                raise InvalidCursor(f'invalid value for {name}')
+            if value is None and not field.null:
+                raise InvalidCursor(f'invalid value for {name}')
+            try:
+                decoded.append(field.to_python(value))
+            except (ValidationError, TypeError, ValueError) as exc:
+                raise InvalidCursor(str(exc)) from exc
+        return decoded
+
+    def _field_of(self, name):
+        """
+        排序字段对应的模型字段；注解（如搜索排名）使用其输出字段
+        """
+        meta = self.queryset.model._meta
+        if name == 'pk':
+            return meta.pk
+        try:
+            return meta.get_field(name)
+        except FieldDoesNotExist:
+            pass
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is None:
+            raise InvalidCursor(f'unknown ordering field {name}')
+        return annotation.output_field
+
+    def _after(self, values):
+        """
+        构造“排在游标之后”的条件：(a, b, c) 之后 = a 更靠后，或 a 相等且 b 更靠后，依此类推
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def page(self, cursor=None):
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+        # 多取一条用于判断是否还有下一页
+        items = list(queryset[:self.page_size + 1])
+        has_next = len(items) > self.page_size
+        items = items[:self.page_size]
+        next_cursor = self.encode_cursor(items[-1]) if has_next else None
+        return KeysetPage(items, next_cursor, has_next)
+
+
+def approximate_count(queryset, key_parts, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    带缓存的总数：同一查询条件在 timeout 秒内只执行一次 COUNT
+    """
+    digest = hashlib.md5(repr(key_parts).encode('utf-8')).hexdigest()
+    key = f'announcements:count:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.order_by().count()
+        cache.set(key, count, timeout)
+    return count
@@ -0,0 +1,226 @@
+# -*- coding=utf-8 -*-
+
+# announcements/profiling.py
+
+"""
+按请求采样的性能剖析（由 notification_system.middleware.RequestProfilingMiddleware 启用）：
+
+- 每个数据库连接建立时注册一个 execute_wrapper，只在当前上下文有剖析中的请求时记录每条 SQL 的耗时
+  （剖析对象保存在 contextvar 中，ASGI 下经 sync_to_async 在其他线程执行的查询同样会被记录），按指纹（参数、数字常量、IN 列表归一化后的语句）汇总，
+  保留总耗时最高的前 N 个指纹
+- 代码中用 timed('serializer') / timed('markdown') 标记的区段累计耗时；未采样的请求中 timed 不做任何事
+- 结果以一行 JSON 写入 announcements.profiling 日志（hot_queries 命令汇总该日志），并写入 Server-Timing 响应头
+
+采样率和 N 默认取 settings.ANNOUNCEMENTS_PROFILING_SAMPLE_RATE / ANNOUNCEMENTS_PROFILING_TOP_QUERIES，
+profiling 命令可以在运行时写入共享缓存覆盖它们，各进程每隔 ANNOUNCEMENTS_PROFILING_REFRESH_INTERVAL 秒重新读取，无需重启。
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+CONFIG_KEY = 'announcements:profiling'
+
+_current = contextvars.ContextVar('announcements_profile', default=None)
+
+_FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'), # 字符串常量
+    (re.compile(r'%s|\b\d+(?:\.\d+)?\b'), '?'), # 参数占位符和数字常量
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'), # IN (?, ?, ...)
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """
+    归一化 SQL：参数和常量替换为 ?，IN 列表合并为 (...)，使同一条语句的不同参数得到相同的指纹
+    """
+    for pattern, replacement in _FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint_id(normalized):
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+class _ConfigCache:
+    """
+    进程内缓存的剖析配置，每隔 refresh 秒从共享缓存重新读取
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._config = None
+        self._loaded_at = 0
+
+    def get(self):
+        interval = getattr(settings, 'ANNOUNCEMENTS_PROFILING_REFRESH_INTERVAL', 5)
+        now = time.monotonic()
+        with self._lock:
+            if self._config is None or now - self._loaded_at >= interval:
+                self._config = {**default_config(), **(_shared_cache().get(CONFIG_KEY) or {})}
+                self._loaded_at = now
+            return self._config
+
+    def clear(self):
+        with self._lock:
+            self._config = None
+
+
+_config_cache = _ConfigCache()
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'ANNOUNCEMENTS_PROFILING_CACHE', 'announcements_shared')]
+
+
+def default_config():
+    return {
+        'sample_rate': getattr(settings, 'ANNOUNCEMENTS_PROFILING_SAMPLE_RATE', 0.0),
+        'top': getattr(settings, 'ANNOUNCEMENTS_PROFILING_TOP_QUERIES', 5),
+    }
+
+
+def current_config():
+    return _config_cache.get()
+
+
+def set_config(**overrides):
+    """
+    在共享缓存中写入运行时配置（所有进程在下次刷新时生效）；不传参数时恢复为 settings 中的默认值
+    """
+    if overrides:
+        config = {**(_shared_cache().get(CONFIG_KEY) or {}), **overrides}
+        _shared_cache().set(CONFIG_KEY, config, None)
+    else:
+        _shared_cache().delete(CONFIG_KEY)
+    _config_cache.clear()
+
+
+@contextmanager
+def timed(name):
+    """
+    累计区段耗时到当前请求的剖析结果中（当前请求未被采样时不计时）
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.timings[name] += (time.perf_counter() - started) * 1000
+
+
+def _dispatch(execute, sql, params, many, context):
+    # 常驻的 execute_wrapper：没有剖析中的请求时直接执行
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install(connection, **kwargs):
+    """
+    为数据库连接注册常驻的 execute_wrapper（每个线程各自的连接在建立时注册）
+    """
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_dispatch)
+
+
+class RequestProfile:
+    """
+    一次请求的剖析结果
+    """
+
+    def __init__(self, top=5):
+        self.top = top
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.statements = defaultdict(lambda: [0, 0.0, 0.0]) # 指纹 -> [次数, 总耗时, 最大耗时]
+        self.timings = defaultdict(float) # 区段 -> 耗时（毫秒）
+        self.started = None
+        self.total_ms = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper 的回调
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.queries += 1
+            self.sql_ms += elapsed
+            stats = self.statements[fingerprint(sql)]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    @contextmanager
+    def activate(self):
+        for connection in connections.all():
+            _install(connection=connection)
+        token = _current.set(self)
+        self.started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total_ms = (time.perf_counter() - self.started) * 1000
+            _current.reset(token)
+
+    def slowest(self):
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:self.top]
+        return [
+            {
+                'id': fingerprint_id(sql), 'fingerprint': sql,
+                'count': count, 'total_ms': round(total, 3), 'max_ms': round(longest, 3),
+            }
+            for sql, (count, total, longest) in ranked
+        ]
+
+    def server_timing(self):
+        """
+        Server-Timing 响应头的值
+        """
+        parts = [f'db;dur={self.sql_ms:.2f};desc="{self.queries} queries"']
+        parts += [f'{name};dur={ms:.2f}' for name, ms in sorted(self.timings.items())]
+        parts.append(f'total;dur={self.total_ms:.2f}')
+        return ', '.join(parts)
+
+    def as_record(self, request, response):
+        match = getattr(request, 'resolver_match', None)
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': (match.view_name or match._func_path) if match else None,
+            'status': response.status_code,
+            'total_ms': round(self.total_ms, 3),
+            'queries': self.queries,
+            'sql_ms': round(self.sql_ms, 3),
+            'timings': {name: round(ms, 3) for name, ms in self.timings.items()},
+            'slow_queries': self.slowest(),
+        }
+
+    def report(self, request, response):
+        """
+        写入结构化日志和 Server-Timing 响应头
+        """
+        response['Server-Timing'] = self.server_timing()
+        logger.info(json.dumps(self.as_record(request, response), ensure_ascii=False))
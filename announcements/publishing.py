@@ -0,0 +1,108 @@
+# -*- coding=utf-8 -*-
+
+# announcements/publishing.py
+
+"""
+公告生效（发布）处理：
+
+公告到达 publish_at 时需要执行一次“生效”：更新未读计数、快照阅读统计的受众人数，并发送 announcement_published 信号
+（推送、通知等功能连接该信号）。生效状态记录在 Announcement.activated_at 中，
+通过条件 UPDATE 保证每条公告只生效一次。已生效的公告被修改时发送 announcement_updated 信号。
+
+- 保存公告时（事务提交后）立即处理已到时间的公告，或撤销被改为未来时间的公告
+- 定时发布的公告由调度器（announcements/scheduler.py）在到达时间时处理，
+  或由 publish_due_announcements 命令（定时任务）补充处理
+"""
+
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .analytics import snapshot_audience
+from .counters import adjust_for_announcement
+from .metrics import PUBLISH_LAG
+from .models import Announcement
+
+# 公告生效时发送，参数：announcement
+announcement_published = Signal()
+# 已生效的公告被修改后发送，参数：announcement
+announcement_updated = Signal()
+# 保存了尚未到发布时间的公告后发送（调度器据此安排生效时间），参数：announcement
+announcement_scheduled = Signal()
+
+
+def activate_announcement(announcement_id, now=None):
+    """
+    使已到达发布时间的公告生效，返回是否由本次调用完成生效
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        activated = Announcement.objects.filter(
+            pk=announcement_id, activated_at__isnull=True, publish_at__lte=now
+        ).update(activated_at=now)
+        if activated:
+            adjust_for_announcement(announcement_id, +1)
+            snapshot_audience(announcement_id)
+    if not activated:
+        return False
+    announcement = Announcement.objects.get(pk=announcement_id)
+    PUBLISH_LAG.observe(max(0.0, (now - announcement.publish_at).total_seconds()))
+    announcement_published.send(sender=Announcement, announcement=announcement)
+    return True
+
+
+def deactivate_announcement(announcement_id, now=None):
+    """
+    发布时间被改到未来的已生效公告恢复为未生效，返回是否发生了变化
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        deactivated = Announcement.objects.filter(
+            pk=announcement_id, activated_at__isnull=False, publish_at__gt=now
+        ).update(activated_at=None)
+        if deactivated:
+            adjust_for_announcement(announcement_id, -1)
+    return bool(deactivated)
+
+
+def sync_activation(announcement_id):
+    """
+    公告保存后按当前的 publish_at 处理生效状态：
+    尚未到时间的公告发送 announcement_scheduled，生效状态未变化的已生效公告发送 announcement_updated
+    """
+    if activate_announcement(announcement_id):
+        return
+    deactivate_announcement(announcement_id)
+    announcement = Announcement.objects.filter(pk=announcement_id).first()
+    if announcement is None:
+        return
+    if announcement.activated_at is None:
+        announcement_scheduled.send(sender=Announcement, announcement=announcement)
+    else:
+        announcement_updated.send(sender=Announcement, announcement=announcement)
+
+
+def schedule_activation_sync(announcement_id):
+    """
+    在事务提交后处理生效状态（在收件箱同步之后执行，见 signals.announcement_saved）
+    """
+    transaction.on_commit(lambda: sync_activation(announcement_id))
+
+
+def due_announcement_ids(now=None):
+    """
+    已到发布时间但尚未生效的公告ID（使用 announcement_pending_idx 部分索引）
+    """
+    now = now or timezone.now()
+    return list(
+        Announcement.objects.filter(activated_at__isnull=True, publish_at__lte=now)
+        .order_by('publish_at').values_list('pk', flat=True)
+    )
+
+
+def publish_due_announcements(now=None):
+    """
+    使所有已到时间的公告生效，返回本次生效的公告ID
+    """
+    now = now or timezone.now()
+    return [pk for pk in due_announcement_ids(now) if activate_announcement(pk, now)]
@@ -0,0 +1,210 @@
+# -*- coding=utf-8 -*-
+
+# announcements/push.py
+
+"""
+实时推送：公告生效/更新时把事件推送给在线（SSE / WebSocket，见 announcements/stream.py）且可见该公告的用户。
+
+- 代理（broker）负责按用户扇出事件。默认使用进程内的 InMemoryBroker，
+  可通过 settings.ANNOUNCEMENTS_PUSH_BROKER 替换为其他实现（例如基于 Redis 发布/订阅的多进程代理）
+- 事件ID单调递增，代理在环形缓冲区中保留最近的事件，客户端重连时携带 Last-Event-ID 补发错过的事件；
+  缓冲区已不包含所需的事件时发送 reset 事件，客户端应重新拉取列表
+- 每个连接使用有界队列，客户端消费过慢导致队列已满时清空积压并发送 resync 事件（背压），
+  避免慢连接无限占用内存
+"""
+
+import asyncio
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .models import InboxEntry
+
+BATCH_SIZE = 1000
+
+PushEvent = namedtuple('PushEvent', ['id', 'event', 'announcement_id', 'data'])
+
+
+class Subscription:
+    """
+    一个连接的订阅：事件在连接所属的事件循环中写入有界队列
+    """
+
+    def __init__(self, broker, user_id, queue_size):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.closed = False
+
+    def deliver(self, event):
+        """
+        写入事件（在 self.loop 中执行）；队列已满时丢弃积压的事件，改为通知客户端重新同步
+        """
+        if self.closed:
+            return
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = PushEvent(event.id, 'resync', None, {})
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+
+def _deliver_all(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.deliver(event)
+
+
+class InMemoryBroker:
+    """
+    进程内代理：只能推送给连接到当前进程的客户端
+    """
+
+    local = True # 发布方只需为当前进程的在线用户计算接收者
+
+    def __init__(self, buffer_size=1000, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set) # user_id -> {Subscription}
+        self._history = deque(maxlen=buffer_size)
+        # 以毫秒时间戳作为起始ID，进程重启后新事件的ID仍大于重启前的ID
+        self._next_id = int(time.time() * 1000)
+
+    def subscribe(self, user_id):
+        """
+        订阅用户的事件（需要在事件循环中调用）
+        """
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def connected_user_ids(self):
+        with self._lock:
+            return set(self._subscriptions)
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    @property
+    def last_event_id(self):
+        return self._next_id - 1
+
+    def publish(self, event, announcement_id, data, user_ids):
+        """
+        发布事件并推送给 user_ids 中的在线用户（可在任意线程调用），返回 PushEvent
+        """
+        by_loop = defaultdict(list)
+        with self._lock:
+            push_event = PushEvent(self._next_id, event, announcement_id, data)
+            self._next_id += 1
+            self._history.append(push_event)
+            for user_id in user_ids:
+                for subscription in self._subscriptions.get(user_id, ()):
+                    by_loop[subscription.loop].append(subscription)
+        # 每个事件循环只唤醒一次
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver_all, subscriptions, push_event)
+            except RuntimeError:
+                pass # 事件循环已关闭，连接随之结束
+        return push_event
+
+    def events_since(self, last_event_id):
+        """
+        返回 last_event_id 之后的事件；缓冲区已不包含其后的全部事件（或ID无效）时返回 None
+        """
+        with self._lock:
+            history = list(self._history)
+            next_id = self._next_id
+        oldest = history[0].id if history else next_id
+        if last_event_id >= next_id or last_event_id + 1 < oldest:
+            return None
+        return [event for event in history if event.id > last_event_id]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_push_broker():
+    """
+    返回当前进程使用的推送代理（按配置创建一次）
+    """
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(
+                    getattr(settings, 'ANNOUNCEMENTS_PUSH_BROKER', 'announcements.push.InMemoryBroker')
+                )
+                _broker = broker_class(
+                    buffer_size=getattr(settings, 'ANNOUNCEMENTS_PUSH_BUFFER_SIZE', 1000),
+                    queue_size=getattr(settings, 'ANNOUNCEMENTS_PUSH_QUEUE_SIZE', 100),
+                )
+    return _broker
+
+
+def announcement_payload(announcement):
+    """
+    推送给客户端的公告摘要（客户端需要完整内容时再请求详情接口）
+    """
+    return {
+        'id': announcement.pk,
+        'title': announcement.title,
+        'emergency_level': announcement.emergency_level,
+        'publish_at': announcement.publish_at.isoformat(),
+        'url': reverse('announcement_detail', args=[announcement.pk]),
+    }
+
+
+def _chunks(values, size=BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def push_announcement(announcement, event):
+    """
+    把公告事件推送给可见该公告的在线用户
+    """
+    broker = get_push_broker()
+    entries = InboxEntry.objects.filter(announcement=announcement)
+    if getattr(broker, 'local', False):
+        user_ids = []
+        for chunk in _chunks(broker.connected_user_ids()):
+            user_ids.extend(entries.filter(user_id__in=chunk).values_list('user_id', flat=True))
+    else:
+        user_ids = entries.values_list('user_id', flat=True).iterator()
+    return broker.publish(event, announcement.pk, announcement_payload(announcement), user_ids)
+
+
+def visible_announcement_ids(user_id, announcement_ids):
+    """
+    补发事件前过滤出用户可见的公告
+    """
+    return set(
+        InboxEntry.objects.filter(user_id=user_id, announcement_id__in=announcement_ids)
+        .values_list('announcement_id', flat=True)
+    )
@@ -0,0 +1,225 @@
+# -*- coding=utf-8 -*-
+
+# announcements/read_state.py
+
+"""
+阅读状态：
+- 解析：为一整页公告一次性计算当前用户的已读标记，HTML 列表页和 API 序列化器共用，避免逐条查询 ReadStatus
+- 写入：record_reads / mark_all_read / mark_unread 以集合方式批量修改阅读记录
+  （同步路径、批量接口与阅读回执缓冲区共用，见 announcements/receipts.py）
+- 待写入覆盖层：阅读回执缓冲区尚未落库的已读/未读操作记录在多进程共享的缓存中，
+  保证“写后读”一致（下一个请求可能由其他进程处理）
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import BooleanField, Case, Exists, OuterRef, Q, When
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from . import analytics
+from .conditional import bump_read_versions
+from .counters import on_reads_recorded, refresh_unread_counters
+from .metrics import READ_RECEIPTS
+from .models import InboxEntry, ReadStatus
+
+PENDING_READS_TIMEOUT = 30 # 待写入操作在缓存中的保留时间（秒），应远大于回执缓冲区的刷新间隔
+PENDING_READS_WINDOW = 100 # 读取覆盖层时最多回放的最近操作数量
+PENDING_READS_CHUNK = 10 # 读取覆盖层时每次取回的操作数量（从最新的操作往前）
+INSERT_BATCH_SIZE = 300 # 每条 INSERT 写入的阅读记录数（SQLite 单条语句最多 999 个参数）
+
+
+def _pending_cache():
+    return caches[getattr(settings, 'ANNOUNCEMENTS_READ_STATE_CACHE', 'announcements_shared')]
+
+
+def _sequence_key(user_id):
+    return f'announcements:pending-reads:{user_id}:seq'
+
+
+def _slot_key(user_id, sequence):
+    return f'announcements:pending-reads:{user_id}:{sequence}'
+
+
+def _append_pending(user_id, operation, announcement_ids):
+    """
+    覆盖层是按用户的操作日志：用 add/incr 原子地分配序号，每个操作写入自己的键，
+    并发请求不会互相覆盖（不做“读取-合并-写回”）。
+    序号键与操作使用相同的有效期，并在每次写入操作后延长：序号键过期时所有操作都已过期，
+    没有待写入操作的用户读取覆盖层只需一次缓存查询
+    """
+    store = _pending_cache()
+    key = _sequence_key(user_id)
+    store.add(key, 0, PENDING_READS_TIMEOUT)
+    try:
+        sequence = store.incr(key)
+    except ValueError: # 序号键刚好过期
+        store.add(key, 0, PENDING_READS_TIMEOUT)
+        sequence = store.incr(key)
+    store.set(_slot_key(user_id, sequence), (operation, list(announcement_ids)), PENDING_READS_TIMEOUT)
+    store.touch(key, PENDING_READS_TIMEOUT) # incr 在部分后端会重置有效期
+    bump_read_versions([user_id])
+
+
+def remember_pending_reads(user_id, announcement_ids):
+    """
+    记录尚未落库的已读标记
+    """
+    _append_pending(user_id, 'read', announcement_ids)
+
+
+def forget_pending_reads(user_id, announcement_ids):
+    """
+    移除尚未落库的已读标记（用户标记未读时）
+    """
+    if _pending_cache().get(_sequence_key(user_id)):
+        _append_pending(user_id, 'unread', announcement_ids)
+
+
+def pending_read_ids(user_id):
+    """
+    取尚未落库的已读公告ID：按序号回放仍未过期的操作（已过期的操作对应的回执已经落库）。
+    操作按序号先后写入、有效期相同，因此从最新的操作往前分块读取，
+    遇到比已找到的操作更早且已过期的操作时停止，只读取仍存活的操作所在的块
+    """
+    store = _pending_cache()
+    sequence = store.get(_sequence_key(user_id))
+    if not sequence:
+        return set()
+    operations = []
+    oldest = max(sequence - PENDING_READS_WINDOW, 0)
+    end = sequence
+    while end > oldest:
+        start = max(end - PENDING_READS_CHUNK, oldest)
+        keys = [_slot_key(user_id, n) for n in range(end, start, -1)]
+        found = store.get_many(keys)
+        expired = False
+        for key in keys:
+            if key in found:
+                operations.append(found[key])
+            elif operations:
+                expired = True
+                break
+        if expired or not found:
+            break
+        end = start
+    pending = set()
+    for operation, announcement_ids in reversed(operations):
+        if operation == 'read':
+            pending.update(announcement_ids)
+        else:
+            pending.difference_update(announcement_ids)
+    return pending
+
+
+def with_read_state(queryset, user):
+    """
+    为公告查询集添加 is_read 注解（EXISTS 子查询），随主查询一起取回；
+    回执缓冲区中尚未落库的已读标记一并视为已读
+    """
+    is_read = Exists(ReadStatus.objects.filter(user=user, announcement=OuterRef('pk')))
+    pending = pending_read_ids(user.pk)
+    if pending:
+        is_read = Case(When(pk__in=pending, then=True), default=is_read, output_field=BooleanField())
+    return queryset.annotate(is_read=is_read)
+
+
+def _insert_reads_sql():
+    """
+    INSERT ... (user, announcement, read_at) 语句的前缀和“已存在则跳过”的后缀
+    """
+    table = connection.ops.quote_name(ReadStatus._meta.db_table)
+    columns = [ReadStatus._meta.get_field(name).column for name in ('user', 'announcement', 'read_at')]
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    suffix = connection.ops.on_conflict_suffix_sql(
+        [ReadStatus._meta.get_field('user'), ReadStatus._meta.get_field('announcement')],
+        OnConflict.IGNORE, None, None,
+    )
+    return f"{insert} {table} ({', '.join(connection.ops.quote_name(c) for c in columns)})", suffix
+
+
+def record_reads(pairs):
+    """
+    批量写入阅读记录 [(user_id, announcement_id)]，已存在的记录跳过
+    返回本次新写入的 (user_id, announcement_id) 列表
+
+    多个进程可能同时写入同一对记录（各进程的“已标记”缓存互不共享），因此不在插入前查询“哪些已存在”，
+    而是为本批记录指定同一个 read_at，插入后按 read_at 取回实际插入的行，计数和统计只按这些行调整
+    """
+    by_user = defaultdict(set)
+    for user_id, announcement_id in pairs:
+        by_user[user_id].add(announcement_id)
+    if not by_user:
+        return []
+
+    read_at = timezone.now() # read_at 为 auto_now_add，bulk_create 会逐行覆盖，因此直接执行 INSERT
+    rows = [
+        (user_id, announcement_id)
+        for user_id, announcement_ids in by_user.items()
+        for announcement_id in announcement_ids
+    ]
+    insert, suffix = _insert_reads_sql()
+    value = connection.ops.adapt_datetimefield_value(read_at)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[start:start + INSERT_BATCH_SIZE]
+            cursor.execute(
+                f"{insert} VALUES {', '.join(['(%s, %s, %s)'] * len(batch))} {suffix}",
+                [param for user_id, announcement_id in batch for param in (user_id, announcement_id, value)],
+            )
+    condition = Q()
+    for user_id, announcement_ids in by_user.items():
+        condition |= Q(user_id=user_id, announcement_id__in=announcement_ids)
+    new_pairs = list(ReadStatus.objects.filter(condition, read_at=read_at).values_list('user_id', 'announcement_id'))
+    READ_RECEIPTS.inc(len(new_pairs), source='record_reads')
+    on_reads_recorded(new_pairs)
+    analytics.on_reads_recorded(new_pairs, read_at)
+    bump_read_versions(user_id for user_id, _ in new_pairs)
+    return new_pairs
+
+
+def mark_all_read(user, before=None):
+    """
+    把用户可见、在 before（默认当前时间）之前发布且未读的公告全部标记为已读。
+    使用一条 INSERT ... SELECT 完成，不把公告ID取回应用层。返回新写入的记录数
+    """
+    now = timezone.now()
+    before = min(before or now, now)
+    unread = (
+        InboxEntry.objects.filter(user=user, announcement__publish_at__lte=before)
+        .exclude(Exists(ReadStatus.objects.filter(user=user, announcement=OuterRef('announcement_id'))))
+        .values_list('announcement_id', flat=True)
+    )
+    select_sql, select_params = unread.query.sql_with_params()
+
+    insert, suffix = _insert_reads_sql()
+    sql = f"{insert} SELECT %s, unread.announcement_id, %s FROM ({select_sql}) unread {suffix}"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, connection.ops.adapt_datetimefield_value(now), *select_params])
+        inserted = cursor.rowcount
+    READ_RECEIPTS.inc(inserted, source='mark_all_read')
+    if inserted:
+        analytics.on_user_reads_recorded(user.pk, now) # 本次插入的记录 read_at 都等于 now
+        bump_read_versions([user.pk])
+    refresh_unread_counters([user.pk])
+    return inserted
+
+
+def mark_unread(user, announcement_ids):
+    """
+    把指定公告标记为未读（一条 DELETE），返回删除的记录数
+    """
+    from .receipts import forget_reads # 避免循环导入：receipts 依赖本模块
+
+    reads = ReadStatus.objects.filter(user=user, announcement_id__in=announcement_ids)
+    removed_ids = list(reads.values_list('announcement_id', flat=True))
+    deleted, _ = reads.delete()
+    analytics.on_reads_removed(removed_ids)
+    if deleted:
+        bump_read_versions([user.pk])
+    forget_reads(user, announcement_ids)
+    refresh_unread_counters([user.pk])
+    return deleted
@@ -0,0 +1,169 @@
+# -*- coding=utf-8 -*-
+
+# announcements/receipts.py
+
+"""
+阅读回执：查看公告详情时的“标记已读”不再在请求内执行 get_or_create，
+而是写入进程内缓冲区，由后台线程每 N 毫秒或每 M 条批量落库（bulk_create ignore_conflicts）。
+
+- 每个工作进程维护一个“已标记”缓存（有容量和有效期限制），重复查看同一公告不会再次写入
+- 尚未落库的已读标记记录在缓存中（见 read_state.remember_pending_reads），列表和序列化器会一并视为已读
+- settings.ANNOUNCEMENTS_READ_RECEIPT_MODE = 'sync' 时直接同步写入（测试或单进程调试时使用）
+- 每次刷新时一并累加阅读统计的增量（见 announcements/analytics.py），阅读统计不在请求内写入
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .analytics import RollupQueue
+from .read_state import record_reads, remember_pending_reads, forget_pending_reads
+
+logger = logging.getLogger(__name__)
+
+
+class ReadReceiptBuffer:
+    """
+    阅读回执缓冲区
+    """
+
+    def __init__(self, flush_interval_ms=200, max_batch=500, seen_cache_size=100000, seen_ttl=300, autostart=True):
+        self.autostart = autostart # 为 False 时不启动后台线程，只能手动 flush()
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.seen_cache_size = seen_cache_size
+        self.seen_ttl = seen_ttl # “已标记”缓存的有效期（秒），其他进程标记未读后最多在此时间后恢复写入
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # 保证同一时间只有一个线程在落库
+        self._pending = []
+        self._seen = OrderedDict() # (user_id, announcement_id) -> 登记时间，按登记时间排序的有界集合
+        self._wakeup = threading.Event()
+        self.rollups = RollupQueue() # 待累加的阅读统计增量，每次刷新时一并落库
+        self._thread = None
+
+    def _remember(self, key):
+        """
+        加入“已标记”缓存，返回此前是否已存在（且未过期）
+        """
+        now = time.monotonic()
+        marked_at = self._seen.get(key)
+        if marked_at is not None and now - marked_at < self.seen_ttl:
+            return True
+        self._seen.pop(key, None)
+        self._seen[key] = now
+        if len(self._seen) > self.seen_cache_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def mark(self, user_id, announcement_id):
+        """
+        登记一条阅读回执，返回是否新登记（已标记过的返回 False）
+        """
+        with self._lock:
+            if self._remember((user_id, announcement_id)):
+                return False
+            self._pending.append((user_id, announcement_id))
+            full = len(self._pending) >= self.max_batch
+        self.ensure_worker()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def forget(self, user_id, announcement_ids):
+        """
+        用户标记未读后，从“已标记”缓存和待落库队列中移除，下次查看时重新登记
+        """
+        keys = {(user_id, announcement_id) for announcement_id in announcement_ids}
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+            self._pending = [pair for pair in self._pending if pair not in keys]
+
+    def flush(self):
+        """
+        立即把缓冲区中的回执落库并累加阅读统计，返回新写入的记录数
+        """
+        with self._flush_lock:
+            written = self._write()
+            self.rollups.flush()
+            return written
+
+    def _write(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            return len(record_reads(batch))
+        except Exception:
+            logger.exception('阅读回执落库失败，%d 条回执将在下次刷新时重试', len(batch))
+            with self._lock:
+                self._pending[:0] = batch
+            return 0
+
+    def ensure_worker(self):
+        """
+        启动后台刷新线程（autostart 为 False 时不启动）
+        """
+        if not self.autostart:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='read-receipt-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_receipt_buffer():
+    """
+    返回当前进程的阅读回执缓冲区（按配置创建一次，进程退出时尽量落库）
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ReadReceiptBuffer(
+                    flush_interval_ms=getattr(settings, 'ANNOUNCEMENTS_READ_RECEIPT_FLUSH_INTERVAL_MS', 200),
+                    max_batch=getattr(settings, 'ANNOUNCEMENTS_READ_RECEIPT_MAX_BATCH', 500),
+                    seen_cache_size=getattr(settings, 'ANNOUNCEMENTS_READ_RECEIPT_SEEN_CACHE_SIZE', 100000),
+                    seen_ttl=getattr(settings, 'ANNOUNCEMENTS_READ_RECEIPT_SEEN_TTL', 300),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def mark_read(user, announcement):
+    """
+    标记用户已读公告（查看详情时调用）
+    """
+    if getattr(settings, 'ANNOUNCEMENTS_READ_RECEIPT_MODE', 'buffered') == 'sync':
+        record_reads([(user.pk, announcement.pk)])
+        return
+    if get_receipt_buffer().mark(user.pk, announcement.pk):
+        remember_pending_reads(user.pk, [announcement.pk])
+
+
+def forget_reads(user, announcement_ids):
+    """
+    标记未读时调用：清除本进程的“已标记”缓存和待写入覆盖层
+    """
+    if _buffer is not None:
+        _buffer.forget(user.pk, announcement_ids)
+    forget_pending_reads(user.pk, announcement_ids)
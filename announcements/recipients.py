@@ -0,0 +1,92 @@
+# -*- coding=utf-8 -*-
+
+# announcements/recipients.py
+
+"""
+接收者流式展开：按用户ID升序逐个产生公告的接收者，不把 User 对象或全部ID集合载入内存。
+
+- 指定用户和用户组成员两个来源各自按 user_id 做键集分页（values_list，每次 chunk_size 行），
+  再用 heapq.merge 做有序归并，相邻的重复ID直接跳过（同一用户被直接指定且属于多个组）
+- 没有指定接收者的公告（所有用户可见）直接按主键分页扫描用户表
+- 收件箱同步、一致性检查和通知分发都基于这里的有序流（见 sorted_diff）
+"""
+
+import heapq
+
+from django.contrib.auth.models import User
+
+CHUNK_SIZE = 1000
+
+
+def keyset_values(queryset, field, chunk_size=CHUNK_SIZE):
+    """
+    按 field 升序分块读取 queryset 中的 field 值（WHERE field > 上一块的最大值，不使用 OFFSET）
+    """
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(**{f'{field}__gt': last})
+        values = list(page.order_by(field).values_list(field, flat=True)[:chunk_size])
+        if not values:
+            return
+        yield from values
+        last = values[-1]
+
+
+def _unique(sorted_values):
+    previous = None
+    for value in sorted_values:
+        if value != previous:
+            yield value
+            previous = value
+
+
+def iter_recipient_ids(announcement, chunk_size=CHUNK_SIZE):
+    """
+    按用户ID升序产生公告接收者的ID（已去重）
+    """
+    users_through = announcement.target_users.through
+    groups_through = announcement.target_groups.through
+    group_ids = list(groups_through.objects.filter(announcement=announcement).values_list('group_id', flat=True))
+    direct = users_through.objects.filter(announcement=announcement)
+    if not group_ids and not direct.exists():
+        # 未指定接收者：对所有用户可见
+        yield from keyset_values(User.objects.all(), 'pk', chunk_size)
+        return
+
+    sources = [keyset_values(direct, 'user_id', chunk_size)]
+    if group_ids:
+        members = User.groups.through.objects.filter(group_id__in=group_ids)
+        sources.append(keyset_values(members, 'user_id', chunk_size))
+    yield from _unique(heapq.merge(*sources))
+
+
+def iter_recipient_id_chunks(announcement, chunk_size=CHUNK_SIZE):
+    """
+    按用户ID升序，每次产生最多 chunk_size 个接收者ID的列表
+    """
+    chunk = []
+    for user_id in iter_recipient_ids(announcement, chunk_size):
+        chunk.append(user_id)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def sorted_diff(expected, existing):
+    """
+    比较两个升序且无重复的ID流，产生 ('missing', id)（只在 expected 中）和 ('extra', id)（只在 existing 中）
+    """
+    sentinel = object()
+    expected, existing = iter(expected), iter(existing)
+    a, b = next(expected, sentinel), next(existing, sentinel)
+    while a is not sentinel or b is not sentinel:
+        if b is sentinel or (a is not sentinel and a < b):
+            yield 'missing', a
+            a = next(expected, sentinel)
+        elif a is sentinel or b < a:
+            yield 'extra', b
+            b = next(existing, sentinel)
+        else:
+            a, b = next(expected, sentinel), next(existing, sentinel)
@@ -0,0 +1,40 @@
+# -*- coding=utf-8 -*-
+
+# announcements/rendering.py
+
+"""
+Markdown 渲染：
+- 复用模块级的 Markdown 实例，避免每次调用都重新加载扩展
+- 渲染结果按内容摘要持久化到 Announcement.content_html，见 Announcement.save
+
+本模块不依赖 Django 模型，可以在进程池的子进程中直接使用。
+"""
+
+import hashlib
+import threading
+
+import markdown
+
+MARKDOWN_EXTENSIONS = ['extra', 'codehilite']
+
+# 渲染器版本：升级扩展或修改扩展配置时调整，已保存的 HTML 会因摘要变化而被视为过期
+RENDERER_VERSION = '1:' + ','.join(MARKDOWN_EXTENSIONS)
+
+_markdown = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+_lock = threading.Lock() # Markdown 实例不是线程安全的
+
+
+def render_markdown(text):
+    """
+    将Markdown内容渲染为HTML
+    """
+    with _lock:
+        _markdown.reset()
+        return _markdown.convert(text)
+
+
+def content_digest(text):
+    """
+    计算内容摘要（包含渲染器版本），用于判断已保存的 HTML 是否过期
+    """
+    return hashlib.sha256(f'{RENDERER_VERSION}\n{text}'.encode('utf-8')).hexdigest()
@@ -0,0 +1,210 @@
+# -*- coding=utf-8 -*-
+
+# announcements/scheduler.py
+
+"""
+定时发布调度器：在公告到达 publish_at 时精确地执行一次生效（见 announcements/publishing.py）。
+
+- 未生效的公告按 (publish_at, id) 放入最小堆，线程睡眠到堆顶的时间后依次生效
+- 启动时以及每隔 refresh_interval 秒从数据库重新加载未生效的公告（announcement_pending_idx 部分索引），
+  进程重启、其他进程新建或修改的公告都能恢复；同一进程内保存的定时公告通过 announcement_scheduled 信号立即入堆
+- 生效使用条件 UPDATE，多个调度器实例或 publish_due_announcements 命令同时运行时每条公告也只生效一次
+- 记录调度延迟（实际生效时间 - publish_at），见 SchedulerMetrics
+
+运行方式：
+- python manage.py run_scheduler（独立进程）
+- settings.ANNOUNCEMENTS_SCHEDULER_IN_PROCESS = True 时在 ASGI 进程内以后台线程运行
+  （使用进程内推送代理时，推送事件只能送达同一进程的连接）
+"""
+
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Announcement
+from .publishing import activate_announcement, announcement_scheduled
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerMetrics:
+    """
+    调度延迟统计（秒），保留最近 window 次生效的延迟用于计算分位数
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.activated = 0
+        self.max_lag = 0.0
+        self.last_lag = None
+        self.last_refresh_at = None
+        self.pending = 0
+
+    def record(self, lag):
+        with self._lock:
+            self.activated += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._recent.append(lag)
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+
+        def percentile(p):
+            if not recent:
+                return None
+            return recent[min(len(recent) - 1, int(len(recent) * p))]
+
+        return {
+            'activated': self.activated,
+            'pending': self.pending,
+            'last_refresh_at': self.last_refresh_at,
+            'lag_seconds': {
+                'last': self.last_lag,
+                'max': self.max_lag,
+                'p50': percentile(0.5),
+                'p99': percentile(0.99),
+            },
+        }
+
+
+class PublishScheduler:
+    """
+    基于最小堆的定时发布调度器
+    """
+
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self.metrics = SchedulerMetrics()
+        self._lock = threading.Lock()
+        self._heap = [] # (publish_at, announcement_id)
+        self._due_at = {} # announcement_id -> publish_at，用于识别堆中的过期条目
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+    def load(self):
+        """
+        从数据库重新加载全部未生效的公告，返回数量
+        """
+        pending = dict(
+            Announcement.objects.filter(activated_at__isnull=True).values_list('pk', 'publish_at')
+        )
+        with self._lock:
+            self._due_at = pending
+            self._heap = [(publish_at, pk) for pk, publish_at in pending.items()]
+            heapq.heapify(self._heap)
+        self.metrics.pending = len(pending)
+        self.metrics.last_refresh_at = timezone.now()
+        self._wakeup.set()
+        return len(pending)
+
+    def schedule(self, announcement_id, publish_at):
+        """
+        安排（或重新安排）公告的生效时间，可在任意线程调用
+        """
+        with self._lock:
+            self._due_at[announcement_id] = publish_at
+            heapq.heappush(self._heap, (publish_at, announcement_id))
+            self.metrics.pending = len(self._due_at)
+        self._wakeup.set()
+
+    def next_due(self):
+        """
+        最近一次需要生效的时间（没有待生效的公告时返回 None）
+        """
+        with self._lock:
+            while self._heap and self._due_at.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap) # 已被重新安排或已处理的条目
+            return self._heap[0][0] if self._heap else None
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                publish_at, announcement_id = heapq.heappop(self._heap)
+                if self._due_at.get(announcement_id) == publish_at:
+                    del self._due_at[announcement_id]
+                    due.append((publish_at, announcement_id))
+            self.metrics.pending = len(self._due_at)
+        return due
+
+    def run_pending(self, now=None):
+        """
+        使所有已到时间的公告生效，返回本次生效的公告ID
+        """
+        activated = []
+        for publish_at, announcement_id in self._pop_due(now or timezone.now()):
+            fired_at = now or timezone.now()
+            try:
+                if not activate_announcement(announcement_id, fired_at):
+                    continue # 已由其他进程生效，或发布时间已被改到未来（下次加载时重新入堆）
+            except Exception:
+                logger.exception('公告 %s 生效失败，将在下次加载时重试', announcement_id)
+                continue
+            lag = (fired_at - publish_at).total_seconds()
+            self.metrics.record(lag)
+            activated.append(announcement_id)
+            logger.info('公告 %s 已生效，调度延迟 %.3f 秒', announcement_id, lag)
+        return activated
+
+    def _on_scheduled(self, sender, announcement, **kwargs):
+        self.schedule(announcement.pk, announcement.publish_at)
+
+    def serve_forever(self):
+        """
+        运行调度循环，直到调用 stop()
+        """
+        announcement_scheduled.connect(self._on_scheduled, dispatch_uid=f'scheduler-{id(self)}')
+        try:
+            self.load()
+            next_refresh = time.monotonic() + self.refresh_interval
+            while not self._stop.is_set():
+                self._wakeup.clear()
+                self.run_pending()
+                if time.monotonic() >= next_refresh:
+                    self.load()
+                    self._wakeup.clear()
+                    next_refresh = time.monotonic() + self.refresh_interval
+
+                timeout = next_refresh - time.monotonic()
+                next_due = self.next_due()
+                if next_due is not None:
+                    timeout = min(timeout, (next_due - timezone.now()).total_seconds())
+                close_old_connections()
+                self._wakeup.wait(max(timeout, 0))
+        finally:
+            announcement_scheduled.disconnect(dispatch_uid=f'scheduler-{id(self)}')
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler_thread(refresh_interval=30):
+    """
+    在当前进程的后台线程中启动调度器（只启动一次），返回调度器
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PublishScheduler(refresh_interval=refresh_interval)
+            threading.Thread(target=_scheduler.serve_forever, name='publish-scheduler', daemon=True).start()
+    return _scheduler
+
+
+def get_scheduler():
+    """
+    返回当前进程中运行的调度器（未启动时返回 None）
+    """
+    return _scheduler
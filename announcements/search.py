@@ -0,0 +1,341 @@
+# -*- coding=utf-8 -*-
+
+# announcements/search.py
+
+"""
+公告全文搜索：
+- SQLiteFTSBackend: SQLite FTS5 虚拟表（本地开发默认）
+- PostgresSearchBackend: PostgreSQL tsvector + GIN 索引
+- InMemorySearchBackend: 纯Python倒排索引（其他数据库或 FTS5 不可用时的兜底方案，仅对当前进程内的写入实时生效）
+
+三种后端共用同一个分词器：中文按二元组（bigram）切分，其他文字按单词切分。
+指定用户时，后端在查询内连接收件箱表，只在该用户可见的公告中取前 limit 个结果
+（先取全局前 limit 个再按可见性过滤，常见词可能一个可见结果都不剩）。
+通过 settings.ANNOUNCEMENTS_SEARCH_BACKEND 选择后端（'auto'、'sqlite'、'postgres'、'memory'）。
+"""
+
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, When, IntegerField
+
+SQLITE_FTS_TABLE = 'announcements_search_fts'
+POSTGRES_SEARCH_TABLE = 'announcements_search_document'
+
+TITLE_WEIGHT = 10.0 # 标题命中的权重高于正文
+DEFAULT_SEARCH_LIMIT = 1000 # 单次搜索最多取回的候选公告数量
+
+_CJK = '㐀-䶿一-鿿豈-﫿'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|(?:(?![{_CJK}])[^\W_])+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+
+def tokenize(text):
+    """
+    文档分词：中文连续字符切分为二元组并保留末尾单字（便于单字前缀查询），其他文字按单词切分
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall((text or '').lower()):
+        if _CJK_RE.match(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def tokenize_query(query):
+    """
+    查询分词：返回 [(词, 是否前缀匹配)]
+    - 中文单字或最后一个非中文单词按前缀匹配（支持边输入边搜索）
+    - 多个词之间为“与”关系
+    """
+    terms = []
+    runs = _TOKEN_RE.findall((query or '').lower())
+    for index, run in enumerate(runs):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                terms.append((run, True))
+            else:
+                terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+        else:
+            terms.append((run, index == len(runs) - 1))
+    return terms
+
+
+class BaseSearchBackend:
+    """
+    搜索后端接口
+    """
+
+    def index(self, announcement):
+        raise NotImplementedError
+
+    def remove(self, announcement_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT, user_id=None):
+        """
+        返回 [(公告ID, 得分)]，按得分从高到低排列；指定 user_id 时只返回该用户收件箱中的公告
+        """
+        raise NotImplementedError
+
+    def rebuild(self, announcements):
+        self.clear()
+        count = 0
+        for announcement in announcements:
+            self.index(announcement)
+            count += 1
+        return count
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 后端：文档以预先分好的词（空格分隔）写入虚拟表，rowid 即公告ID
+    """
+
+    def index(self, announcement):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s', [announcement.pk])
+            cursor.execute(
+                f'INSERT INTO {SQLITE_FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)',
+                [announcement.pk, ' '.join(tokenize(announcement.title)), ' '.join(tokenize(announcement.content))],
+            )
+
+    def remove(self, announcement_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s', [announcement_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_FTS_TABLE}')
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT, user_id=None):
+        terms = tokenize_query(query)
+        if not terms:
+            return []
+        match = ' '.join(f'"{term}"*' if prefix else f'"{term}"' for term, prefix in terms)
+        join, params = '', [TITLE_WEIGHT, match]
+        if user_id is not None:
+            join = f' JOIN {_inbox_table()} inbox ON inbox.announcement_id = {SQLITE_FTS_TABLE}.rowid AND inbox.user_id = %s'
+            params = [TITLE_WEIGHT, user_id, match]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {SQLITE_FTS_TABLE}.rowid, bm25({SQLITE_FTS_TABLE}, %s, 1.0) AS score FROM {SQLITE_FTS_TABLE}{join} '
+                f'WHERE {SQLITE_FTS_TABLE} MATCH %s ORDER BY score LIMIT %s',
+                [*params, limit],
+            )
+            # bm25() 越小越相关，这里取反使得分越大越相关
+            return [(row[0], -row[1]) for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    PostgreSQL 后端：'simple' 配置的 tsvector（标题权重A、正文权重B）+ GIN 索引
+    """
+
+    def index(self, announcement):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {POSTGRES_SEARCH_TABLE} (announcement_id, document) VALUES '
+                f"(%s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+                'ON CONFLICT (announcement_id) DO UPDATE SET document = EXCLUDED.document',
+                [announcement.pk, ' '.join(tokenize(announcement.title)), ' '.join(tokenize(announcement.content))],
+            )
+
+    def remove(self, announcement_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {POSTGRES_SEARCH_TABLE} WHERE announcement_id = %s', [announcement_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {POSTGRES_SEARCH_TABLE}')
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT, user_id=None):
+        terms = tokenize_query(query)
+        if not terms:
+            return []
+        # 分词结果只包含字母、数字和中文，可以直接拼接为 tsquery
+        tsquery = ' & '.join(f'{term}:*' if prefix else term for term, prefix in terms)
+        join, params = '', [tsquery]
+        if user_id is not None:
+            join = f' JOIN {_inbox_table()} inbox ON inbox.announcement_id = doc.announcement_id AND inbox.user_id = %s'
+            params = [user_id, tsquery]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT doc.announcement_id, ts_rank(doc.document, q) AS score FROM {POSTGRES_SEARCH_TABLE} doc{join} "
+                f"CROSS JOIN to_tsquery('simple', %s) q WHERE doc.document @@ q ORDER BY score DESC LIMIT %s",
+                [*params, limit],
+            )
+            return cursor.fetchall()
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """
+    纯Python倒排索引：首次搜索时从数据库载入，之后由保存/删除信号增量维护
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict) # 词 -> {公告ID: 词频权重}
+        self._documents = {} # 公告ID -> 该公告包含的词
+        self._vocabulary = None # 排序后的词表，用于前缀查询，写入时置空
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        from .models import Announcement
+
+        with self._lock:
+            if not self._loaded:
+                for announcement in Announcement.objects.only('pk', 'title', 'content').iterator():
+                    self._index(announcement)
+                self._loaded = True
+
+    def _index(self, announcement):
+        self._remove(announcement.pk)
+        weights = defaultdict(float)
+        for token in tokenize(announcement.title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(announcement.content):
+            weights[token] += 1.0
+        for token, weight in weights.items():
+            self._postings[token][announcement.pk] = weight
+        self._documents[announcement.pk] = set(weights)
+        self._vocabulary = None
+
+    def _remove(self, announcement_id):
+        for token in self._documents.pop(announcement_id, ()):
+            postings = self._postings[token]
+            postings.pop(announcement_id, None)
+            if not postings:
+                del self._postings[token]
+        self._vocabulary = None
+
+    def index(self, announcement):
+        with self._lock:
+            if self._loaded:
+                self._index(announcement)
+
+    def remove(self, announcement_id):
+        with self._lock:
+            self._remove(announcement_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self._vocabulary = None
+            self._loaded = True
+
+    def _expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self._postings else []
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        start = bisect.bisect_left(self._vocabulary, term)
+        end = bisect.bisect_left(self._vocabulary, term + '\U0010ffff')
+        return self._vocabulary[start:end]
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT, user_id=None):
+        terms = tokenize_query(query)
+        if not terms:
+            return []
+        self._ensure_loaded()
+        allowed = None
+        if user_id is not None:
+            from .models import InboxEntry
+
+            allowed = set(InboxEntry.objects.filter(user_id=user_id).values_list('announcement_id', flat=True))
+
+        with self._lock:
+            total = max(len(self._documents), 1)
+            scores = None
+            for term, prefix in terms:
+                # 同一查询词（前缀展开后）的得分取最大值；不同查询词之间为“与”关系
+                term_scores = {}
+                for token in self._expand(term, prefix):
+                    postings = self._postings[token]
+                    idf = math.log(1 + total / len(postings))
+                    for announcement_id, weight in postings.items():
+                        score = weight * idf
+                        if score > term_scores.get(announcement_id, 0):
+                            term_scores[announcement_id] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pk: scores[pk] + s for pk, s in term_scores.items() if pk in scores}
+                if not scores:
+                    return []
+
+        if allowed is not None:
+            scores = {pk: score for pk, score in scores.items() if pk in allowed}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:limit]
+
+
+def _inbox_table():
+    from .models import InboxEntry
+
+    return connection.ops.quote_name(InboxEntry._meta.db_table)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _sqlite_fts_available():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SQLITE_FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_search_backend():
+    """
+    返回当前进程使用的搜索后端（按配置和数据库类型选择，进程内只创建一次）
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'ANNOUNCEMENTS_SEARCH_BACKEND', 'auto')
+                if name == 'auto':
+                    if connection.vendor == 'sqlite' and _sqlite_fts_available():
+                        name = 'sqlite'
+                    elif connection.vendor == 'postgresql':
+                        name = 'postgres'
+                    else:
+                        name = 'memory'
+                _backend = {
+                    'sqlite': SQLiteFTSBackend,
+                    'postgres': PostgresSearchBackend,
+                    'memory': InMemorySearchBackend,
+                }[name]()
+    return _backend
+
+
+def search_announcements(queryset, query, limit=None, user=None):
+    """
+    在给定的（已按可见性过滤的）公告查询集中搜索，结果按相关度排序。
+    查询集按用户可见性过滤时应同时传入 user，由后端在索引查询内按收件箱过滤
+    """
+    if limit is None:
+        limit = getattr(settings, 'ANNOUNCEMENTS_SEARCH_LIMIT', DEFAULT_SEARCH_LIMIT)
+    user_id = user.pk if user is not None else None
+    ranked_ids = [announcement_id for announcement_id, _ in get_search_backend().search(query, limit, user_id)]
+    if not ranked_ids:
+        return queryset.none()
+    rank = Case(
+        *[When(pk=announcement_id, then=position) for position, announcement_id in enumerate(ranked_ids)],
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=ranked_ids).annotate(search_rank=rank).order_by('search_rank')
@@ -0,0 +1,167 @@
+# -*- coding=utf-8 -*-
+
+# announcements/signals.py
+
+"""
+信号处理：在数据变更时维护收件箱（可见性物化表）、全文搜索索引、序列化缓存和公告生效状态，
+公告生效/更新时实时推送和分发外部通知
+"""
+
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .api.cache import bump_generation, invalidate_announcements
+from .conditional import bump_announcements_version
+from .models import Announcement, Category
+from .inbox import schedule_announcement_sync, schedule_user_sync
+from .dispatch import dispatch_announcement
+from .publishing import announcement_published, announcement_updated, schedule_activation_sync
+from .push import push_announcement
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Announcement)
+def announcement_saved(sender, instance, **kwargs):
+    """
+    公告保存后同步收件箱和搜索索引，然后处理生效状态（依赖同步后的收件箱更新未读计数）
+    """
+    schedule_announcement_sync(instance.pk)
+    transaction.on_commit(lambda: get_search_backend().index(instance))
+    transaction.on_commit(lambda: invalidate_announcements([instance.pk]))
+    transaction.on_commit(bump_announcements_version) # 在收件箱同步之后
+    schedule_activation_sync(instance.pk)
+
+
+@receiver(announcement_published)
+def announcement_published_push(sender, announcement, **kwargs):
+    """
+    公告生效后推送给在线用户，并通过外部渠道（邮件、Webhook、微信等）通知接收者
+    """
+    push_announcement(announcement, 'published')
+    dispatch_announcement(announcement)
+
+
+@receiver(announcement_updated)
+def announcement_updated_push(sender, announcement, **kwargs):
+    """
+    已生效的公告被修改后推送给在线用户
+    """
+    push_announcement(announcement, 'updated')
+
+
+@receiver(post_delete, sender=Announcement)
+def announcement_deleted(sender, instance, **kwargs):
+    """
+    公告删除后移除搜索索引和序列化缓存，并更新条件请求的公告版本
+    """
+    announcement_id = instance.pk
+    transaction.on_commit(lambda: get_search_backend().remove(announcement_id))
+    transaction.on_commit(lambda: invalidate_announcements([announcement_id]))
+    transaction.on_commit(bump_announcements_version)
+
+
+def _related_ids_before_clear(sender, instance, target_field):
+    """
+    clear() 时 pk_set 为 None，需要在 pre_clear 阶段从中间表取出受影响的ID
+    """
+    source_field = f'{instance._meta.model_name}_id'
+    return list(sender.objects.filter(**{source_field: instance.pk}).values_list(target_field, flat=True))
+
+
+@receiver(m2m_changed, sender=Announcement.target_users.through)
+@receiver(m2m_changed, sender=Announcement.target_groups.through)
+def announcement_targets_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    公告的接收用户/用户组变更后同步收件箱，并删除序列化缓存
+    - 正向 (announcement.target_users.add(...))：instance 为公告
+    - 反向 (user.received_announcements.add(...))：pk_set 为公告ID
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            schedule_announcement_sync(instance.pk)
+            transaction.on_commit(lambda: invalidate_announcements([instance.pk]))
+            transaction.on_commit(bump_announcements_version)
+        return
+
+    if action == 'pre_clear':
+        instance._inbox_cleared_announcement_ids = _related_ids_before_clear(sender, instance, 'announcement_id')
+        return
+    if action in ('post_add', 'post_remove'):
+        announcement_ids = list(pk_set)
+    elif action == 'post_clear':
+        announcement_ids = getattr(instance, '_inbox_cleared_announcement_ids', [])
+    else:
+        return
+    for announcement_id in announcement_ids:
+        schedule_announcement_sync(announcement_id)
+    transaction.on_commit(lambda: invalidate_announcements(announcement_ids))
+    transaction.on_commit(bump_announcements_version)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    用户组成员变更后同步受影响用户的收件箱
+    - 正向 (user.groups.add(...))：instance 为用户
+    - 反向 (group.user_set.add(...))：pk_set 为用户ID
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            schedule_user_sync(instance.pk)
+        return
+
+    if action == 'pre_clear':
+        instance._inbox_cleared_user_ids = _related_ids_before_clear(sender, instance, 'user_id')
+    elif action in ('post_add', 'post_remove'):
+        for user_id in pk_set:
+            schedule_user_sync(user_id)
+    elif action == 'post_clear':
+        for user_id in getattr(instance, '_inbox_cleared_user_ids', []):
+            schedule_user_sync(user_id)
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    """
+    新用户注册后投递“所有用户可见”的公告
+    """
+    if created:
+        schedule_user_sync(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Group)
+def target_deleted(sender, instance, **kwargs):
+    """
+    删除用户或用户组会连带删除中间表记录（不触发 m2m_changed），
+    原本只指定了该用户/用户组的公告会变为对所有用户可见，因此需要重新同步这些公告
+    """
+    if isinstance(instance, User):
+        announcement_ids = instance.received_announcements.values_list('id', flat=True)
+    else:
+        announcement_ids = instance.received_announcements_by_group.values_list('id', flat=True)
+    for announcement_id in list(announcement_ids):
+        schedule_announcement_sync(announcement_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=User)
+def serialized_relation_changed(sender, **kwargs):
+    """
+    公告主体中包含分类、用户名和用户组名，这些对象变化时使所有缓存的主体失效
+    """
+    transaction.on_commit(bump_generation)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    """
+    用户信息变化时使缓存的主体失效（新建用户和登录时只更新 last_login 的情况除外）
+    """
+    if not created and update_fields != frozenset(['last_login']):
+        transaction.on_commit(bump_generation)
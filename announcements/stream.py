@@ -0,0 +1,180 @@
+# -*- coding=utf-8 -*-
+
+# announcements/stream.py
+
+"""
+实时推送端点（需要在 ASGI 服务器下运行，例如 uvicorn notification_system.asgi:application）：
+
+- Server-Sent Events：GET /announcements/stream/，断线重连时浏览器自动携带 Last-Event-ID
+- WebSocket：/ws/announcements/?last_event_id=<id>（在 notification_system/asgi.py 中路由），
+  每条消息为 {"id", "event", "data"} 格式的 JSON
+
+每个连接只是一个协程加一个有界队列，空闲连接不占用线程和数据库连接，单进程可以保持上万个连接。
+"""
+
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.http.request import split_domain_port, validate_host
+
+from .push import PushEvent, get_push_broker, visible_announcement_ids
+
+RETRY_MS = 3000 # 建议客户端的重连间隔
+
+
+def _heartbeat_interval():
+    return getattr(settings, 'ANNOUNCEMENTS_PUSH_HEARTBEAT', 15)
+
+
+def _parse_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def event_stream(user_id, last_event_id=None, heartbeat=None):
+    """
+    用户的事件流：先补发 last_event_id 之后错过的事件，再持续输出新事件；
+    超过 heartbeat 秒没有事件时输出 None（心跳）
+    """
+    broker = get_push_broker()
+    heartbeat = heartbeat or _heartbeat_interval()
+    # 先订阅再读取缓冲区，补发期间发布的事件会留在队列中，按ID去重
+    subscription = broker.subscribe(user_id)
+    try:
+        if last_event_id is not None:
+            missed = broker.events_since(last_event_id)
+            if missed is None:
+                last_event_id = broker.last_event_id
+                yield PushEvent(last_event_id, 'reset', None, {})
+            elif missed:
+                visible = await sync_to_async(visible_announcement_ids)(
+                    user_id, [event.announcement_id for event in missed]
+                )
+                for event in missed:
+                    if event.announcement_id in visible:
+                        yield event
+                last_event_id = missed[-1].id
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if last_event_id is not None and event.id <= last_event_id:
+                continue
+            last_event_id = event.id
+            yield event
+    finally:
+        subscription.close()
+
+
+def format_sse(event):
+    if event is None:
+        return ': heartbeat\n\n'
+    data = json.dumps(event.data, ensure_ascii=False)
+    return f'id: {event.id}\nevent: {event.event}\ndata: {data}\n\n'
+
+
+def format_json(event):
+    if event is None:
+        return json.dumps({'event': 'heartbeat'})
+    return json.dumps({'id': event.id, 'event': event.event, 'data': event.data}, ensure_ascii=False)
+
+
+async def announcement_stream(request):
+    """
+    Server-Sent Events 推送端点
+    """
+    if isinstance(request, WSGIRequest):
+        return HttpResponse('实时推送需要在 ASGI 服务器下运行。', status=501)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    last_event_id = _parse_event_id(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+
+    async def body():
+        yield f'retry: {RETRY_MS}\n\n'
+        async for event in event_stream(user.pk, last_event_id):
+            yield format_sse(event)
+
+    response = StreamingHttpResponse(body(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # 关闭 nginx 的响应缓冲
+    return response
+
+
+def _origin_allowed(headers):
+    """
+    校验 WebSocket 的 Origin，防止跨站劫持（规则与 ALLOWED_HOSTS 一致）
+    """
+    origin = headers.get(b'origin')
+    if origin is None:
+        return True # 非浏览器客户端
+    host = urlsplit(origin.decode('latin-1')).netloc
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+async def _websocket_user(headers):
+    """
+    按会话 Cookie 取得 WebSocket 连接的用户
+    """
+    cookie = SimpleCookie()
+    cookie.load(headers.get(b'cookie', b'').decode('latin-1'))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(morsel.value if morsel else None)
+    return await aget_user(SimpleNamespace(session=session))
+
+
+async def websocket_application(scope, receive, send):
+    """
+    WebSocket 推送端点（原生 ASGI 应用）
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    headers = dict(scope.get('headers', []))
+    if not _origin_allowed(headers):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    user = await _websocket_user(headers)
+    if not user.is_authenticated:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    stream = event_stream(user.pk, _parse_event_id(query.get('last_event_id', [None])[0]))
+
+    async def pump():
+        async for event in stream:
+            await send({'type': 'websocket.send', 'text': format_json(event)})
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass # 客户端消息忽略
+
+    tasks = {asyncio.ensure_future(pump()), asyncio.ensure_future(wait_for_disconnect())}
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await stream.aclose()
@@ -0,0 +1,151 @@
+# -*- coding=utf-8 -*-
+
+# announcements/tests/budgets.py
+
+"""
+性能预算：在 seed_announcements 生成的几种规模的数据集上测量各接口的查询数和耗时（多次执行取最短），
+与 benchmarks/budgets.json 中记录的基线比较，超出容差即视为性能回归（见 test_budgets.PerformanceBudgetTests）。
+
+基线文件格式：
+
+    {
+      "tolerance": {"queries": 0, "time": 1.0, "time_slack_ms": 10},
+      "datasets": {"small": {"list": {"queries": 6, "ms": 8.1}, ...}, ...}
+    }
+
+- 查询数超过 基线 + tolerance.queries 即失败（查询数与机器无关，默认不允许增加，随默认测试一起运行）
+- 耗时受机器和负载影响，默认只测量不比较；设置环境变量 ANNOUNCEMENTS_TIMING_BUDGETS=1 时
+  耗时超过 max(基线 × (1 + tolerance.time), 基线 + tolerance.time_slack_ms) 即失败
+- 设置环境变量 ANNOUNCEMENTS_RECORD_BUDGETS=1 运行测试时改为把测量结果写入基线
+"""
+
+import json
+import time
+from pathlib import Path
+
+from django.db import connection
+from django.db.models import prefetch_related_objects
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from ..api.serializers import AnnouncementSerializer
+from ..models import Announcement, InboxEntry, ReadStatus
+from ..read_state import with_read_state
+
+BASELINE_PATH = Path(__file__).resolve().parents[2] / 'benchmarks' / 'budgets.json'
+DEFAULT_TOLERANCE = {'queries': 0, 'time': 1.0, 'time_slack_ms': 10}
+
+# 数据集名称 -> seed_announcements 参数
+DATASETS = {
+    'small': {'users': 20, 'groups': 4, 'announcements': 100},
+    'large': {'users': 60, 'groups': 6, 'announcements': 1000},
+}
+SEARCH_TERM = '系统维护'
+ENCODE_LIMIT = 1000 # 序列化基准最多编码的公告数量
+
+
+def measure(func, repeat=5):
+    """
+    先执行一次预热（填充缓存、完成首次标记已读），再执行 repeat 次，
+    返回 {'queries': 最大查询数, 'ms': 最短耗时}（最短耗时受机器负载的影响最小）
+    """
+    func()
+    queries, timings = [], []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        queries.append(len(captured))
+    return {'queries': max(queries), 'ms': round(min(timings) * 1000, 2)}
+
+
+def _request(method, path, expected=200, data=None):
+    def run():
+        response = method(path) if data is None else method(path, data())
+        if response.status_code != expected:
+            raise RuntimeError(f'{path} 返回 {response.status_code}，预期 {expected}')
+    return run
+
+
+def scenarios(user):
+    """
+    以 user 的身份访问的各个场景：场景名 -> 无参函数
+    """
+    client = Client()
+    client.force_login(user)
+    inbox = InboxEntry.objects.filter(user=user, announcement__activated_at__isnull=False)
+    detail_id = inbox.order_by('-announcement_id').values_list('announcement_id', flat=True).first()
+    # 创建阅读记录每次都需要一条新的未读公告
+    unread = iter(
+        inbox.exclude(announcement_id__in=ReadStatus.objects.filter(user=user).values('announcement_id'))
+        .order_by('announcement_id').values_list('announcement_id', flat=True)
+    )
+
+    instances = list(with_read_state(Announcement.objects.select_related('category', 'author'), user)[:ENCODE_LIMIT])
+    prefetch_related_objects(instances, *AnnouncementSerializer.prefetch_for(AnnouncementSerializer.default_fields))
+
+    def encode():
+        serializer = AnnouncementSerializer(instances, many=True, selected_fields=AnnouncementSerializer.default_fields)
+        JSONRenderer().render(serializer.data)
+
+    return {
+        'list': _request(client.get, '/announcements/'),
+        'search': _request(client.get, f'/announcements/?q={SEARCH_TERM}'),
+        'detail': _request(client.get, f'/announcements/{detail_id}/'),
+        'api_list': _request(client.get, '/api/announcements/'),
+        'api_search': _request(client.get, f'/api/announcements/?q={SEARCH_TERM}'),
+        'api_detail': _request(client.get, f'/api/announcements/{detail_id}/'),
+        'my_announcements': _request(client.get, '/api/announcements/my_announcements/'),
+        'read_status_create': _request(
+            client.post, '/api/read-status/', expected=201, data=lambda: {'announcement': next(unread)},
+        ),
+        'serialize': encode,
+    }
+
+
+def run_budgets(user, repeat=5):
+    return {name: measure(func, repeat) for name, func in scenarios(user).items()}
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    baseline.setdefault('tolerance', dict(DEFAULT_TOLERANCE))
+    baseline.setdefault('datasets', {})
+    return baseline
+
+
+def record_baseline(dataset, results, path=BASELINE_PATH):
+    baseline = load_baseline(path)
+    baseline['datasets'][dataset] = results
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def over_budget(dataset, results, baseline, timing=False):
+    """
+    返回超出预算的描述列表（为空表示全部在预算内）；基线中没有记录的场景同样列出。
+    timing 为 False 时只比较查询数
+    """
+    tolerance = {**DEFAULT_TOLERANCE, **baseline['tolerance']}
+    budgets = baseline['datasets'].get(dataset, {})
+    problems = []
+    for name, result in results.items():
+        budget = budgets.get(name)
+        if budget is None:
+            problems.append(f'{dataset}/{name}: 基线中没有记录预算')
+            continue
+        if result['queries'] > budget['queries'] + tolerance['queries']:
+            problems.append(f"{dataset}/{name}: {result['queries']} 条查询，预算 {budget['queries']}")
+        if not timing:
+            continue
+        limit = max(budget['ms'] * (1 + tolerance['time']), budget['ms'] + tolerance['time_slack_ms'])
+        if result['ms'] > limit:
+            problems.append(f"{dataset}/{name}: {result['ms']}ms，预算 {budget['ms']}ms（上限 {limit:.2f}ms）")
+    return problems
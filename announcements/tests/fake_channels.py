@@ -0,0 +1,98 @@
+# -*- coding=utf-8 -*-
+
+# announcements/tests/fake_channels.py
+
+"""
+本地模拟的通知服务（Webhook 和微信模板消息接口），用于测试通知分发，不访问外部网络：
+
+    with FakeChannelServer() as server:
+        server.fail_next(2, status=503)   # 接下来的两次请求返回 503
+        ...  # 渠道的 url / api_base 指向 server.url
+        server.requests                   # [(路径, JSON 请求体)]
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/cgi-bin/token':
+            self.server.fake.token_requests += 1
+            self._respond(200, {'access_token': 'fake-token', 'expires_in': 7200})
+        else:
+            self._respond(404, {})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length) or b'{}')
+        path = urlsplit(self.path).path
+        status = self.server.fake.record(path, data)
+        if status != 200:
+            self._respond(status, {})
+        elif path == '/cgi-bin/message/template/send':
+            errcode = self.server.fake.wechat_errors.get(data.get('touser'), 0)
+            self._respond(200, {'errcode': errcode, 'errmsg': 'ok' if not errcode else 'error'})
+        else:
+            self._respond(200, {'ok': True})
+
+
+class FakeChannelServer:
+    """
+    在后台线程中运行的模拟 HTTP 服务
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.token_requests = 0
+        self.wechat_errors = {} # openid -> errcode
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def fail_next(self, count, status=503):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def record(self, path, data):
+        with self._lock:
+            if self._failures:
+                return self._failures.pop(0)
+            self.requests.append((path, data))
+            return 200
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
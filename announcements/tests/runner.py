@@ -0,0 +1,37 @@
+# -*- coding=utf-8 -*-
+
+# announcements/tests/runner.py
+
+"""
+测试运行器（settings.TEST_RUNNER）：测试期间把文件缓存指向临时目录，不读写项目中的 .cache 目录
+"""
+
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    测试期间文件缓存使用临时目录（结束后删除）
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp(prefix='announcements-test-cache-')
+        caches = {}
+        for alias, config in settings.CACHES.items():
+            config = dict(config)
+            if config['BACKEND'].endswith('FileBasedCache'):
+                config['LOCATION'] = f'{self._cache_dir}/{alias}'
+            caches[alias] = config
+        self._cache_override = override_settings(CACHES=caches)
+        self._cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_override.disable()
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,1391 @@
+from datetime import timedelta
+from io import StringIO
+import asyncio
+import base64
+import gc
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .. import metrics, profiling
+from ..inbox import check_inbox_consistency
+from ..loadtest import run_load_test
+from ..api.cache import (
+    body_generation, bump_generation, metrics as serializer_cache_metrics, reset_local_generation, serialize_announcements,
+)
+from ..api.serializers import AnnouncementSerializer
+from ..channels import WebhookChannel, WeChatTemplateChannel
+from ..counters import get_unread_count
+from ..directory import prefix_page, prefix_successor
+from ..dispatch import NotificationDispatcher
+from ..models import (
+    Announcement, AnnouncementReadHourly, AnnouncementReadStats, Category, DeadLetter, InboxEntry, ReadStatus, UnreadCounter,
+)
+from ..push import InMemoryBroker
+from ..read_state import forget_pending_reads, pending_read_ids, remember_pending_reads
+from ..receipts import ReadReceiptBuffer
+from ..recipients import sorted_diff
+from ..rendering import content_digest
+from ..scheduler import PublishScheduler
+from ..search import (
+    InMemorySearchBackend, SQLiteFTSBackend, search_announcements, tokenize, tokenize_query,
+)
+from ..stream import event_stream
+from .fake_channels import FakeChannelServer
+
+
+class InboxTests(TestCase):
+    """
+    收件箱（可见性物化表）维护测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = User.objects.create_user('author')
+            self.alice = User.objects.create_user('alice')
+            self.bob = User.objects.create_user('bob')
+            self.group = Group.objects.create(name='研发')
+            self.bob.groups.add(self.group)
+
+    def create_announcement(self, users=(), groups=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            announcement = Announcement.objects.create(title='标题', content='内容', author=self.author)
+            announcement.target_users.set(users)
+            announcement.target_groups.set(groups)
+        return announcement
+
+    def recipients(self, announcement):
+        return set(InboxEntry.objects.filter(announcement=announcement).values_list('user__username', flat=True))
+
+    def test_broadcast_announcement_reaches_all_users(self):
+        announcement = self.create_announcement()
+        self.assertEqual(self.recipients(announcement), {'author', 'alice', 'bob'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user('carol')
+        self.assertIn('carol', self.recipients(announcement))
+
+    def test_targeted_announcement(self):
+        announcement = self.create_announcement(users=[self.alice], groups=[self.group])
+        self.assertEqual(self.recipients(announcement), {'alice', 'bob'})
+        self.assertEqual(list(Announcement.objects.visible_to(self.author)), [])
+
+    def test_group_membership_changes(self):
+        announcement = self.create_announcement(groups=[self.group])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.add(self.alice)
+        self.assertEqual(self.recipients(announcement), {'alice', 'bob'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.groups.clear()
+        self.assertEqual(self.recipients(announcement), {'alice'})
+
+    def test_consistency_check_and_rebuild(self):
+        announcement = self.create_announcement(users=[self.alice])
+        self.assertEqual(check_inbox_consistency(), [])
+
+        InboxEntry.objects.filter(announcement=announcement).delete()
+        discrepancies = check_inbox_consistency()
+        self.assertEqual(len(discrepancies), 1)
+        self.assertEqual(discrepancies[0].missing_user_ids, [self.alice.pk])
+
+        call_command('rebuild_inbox', stdout=StringIO())
+        self.assertEqual(check_inbox_consistency(), [])
+
+
+class ReadStateQueryCountTests(TestCase):
+    """
+    列表接口的查询数量回归测试：查询数量不随每页公告数量增长
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_superuser('admin')
+            self.group = Group.objects.create(name='研发')
+            self.user.groups.add(self.group)
+        self.client.force_login(self.user)
+
+    def create_announcements(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                announcement = Announcement.objects.create(title=f'公告{i}', content='内容', author=self.user)
+                announcement.target_users.set([self.user])
+                announcement.target_groups.set([self.group])
+                if i % 2:
+                    ReadStatus.objects.create(user=self.user, announcement=announcement)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def assert_constant_queries(self, url):
+        self.create_announcements(2)
+        small, _ = self.count_queries(url)
+        self.create_announcements(8)
+        large, response = self.count_queries(url)
+        self.assertEqual(small, large)
+        return response
+
+    def test_api_list(self):
+        response = self.assert_constant_queries('/api/announcements/')
+        flags = [item['is_read'] for item in response.json()]
+        self.assertEqual(flags.count(True), 5)
+
+    def test_my_announcements(self):
+        self.assert_constant_queries('/api/announcements/my_announcements/')
+        response = self.client.get('/api/announcements/my_announcements/?read_status=unread')
+        self.assertEqual(len(response.json()), 5)
+        self.assertFalse(any(item['is_read'] for item in response.json()))
+
+    def test_html_list(self):
+        response = self.assert_constant_queries('/announcements/?page_size=50')
+        self.assertEqual(sum(a.is_read for a in response.context['announcements']), 5)
+
+
+class MarkdownRenderingTests(TestCase):
+    """
+    Markdown 渲染结果持久化测试
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+
+    def test_html_rendered_only_when_content_changes(self):
+        announcement = Announcement.objects.create(title='标题', content='# 你好', author=self.author)
+        self.assertIn('<h1>你好</h1>', announcement.content_html)
+
+        with mock.patch('announcements.models.render_markdown') as render:
+            announcement.title = '新标题'
+            announcement.save()
+            render.assert_not_called()
+            self.assertIn('<h1>你好</h1>', announcement.get_markdown_content())
+
+        announcement.content = '**加粗**'
+        announcement.save()
+        announcement.refresh_from_db()
+        self.assertIn('<strong>加粗</strong>', announcement.content_html)
+
+    def test_backfill_command(self):
+        announcement = Announcement.objects.create(title='标题', content='*斜体*', author=self.author)
+        Announcement.objects.filter(pk=announcement.pk).update(content_html='', content_hash='')
+
+        generation = body_generation()
+        call_command('render_markdown', workers=1, stdout=StringIO())
+        announcement.refresh_from_db()
+        self.assertIn('<em>斜体</em>', announcement.content_html)
+        self.assertEqual(announcement.content_hash, content_digest(announcement.content))
+        self.assertGreater(body_generation(), generation)
+
+
+class SearchTests(TestCase):
+    """
+    全文搜索测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_superuser('admin')
+            self.other = User.objects.create_user('other')
+            self.notice = Announcement.objects.create(
+                title='系统维护通知', content='周六晚上进行数据库升级', author=self.user)
+            self.drill = Announcement.objects.create(
+                title='消防演习', content='请关注维护通知中的时间安排 maintenance', author=self.user)
+            self.private = Announcement.objects.create(
+                title='维护通知（内部）', content='仅限管理员', author=self.user)
+            self.private.target_users.set([self.user])
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('维护通知 Django5'), ['维护', '护通', '通知', '知', 'django5'])
+        self.assertEqual(tokenize_query('维护 dj'), [('维护', False), ('dj', True)])
+
+    def assert_backend_ranks(self, backend):
+        backend.rebuild(Announcement.objects.all())
+        ids = [pk for pk, _ in backend.search('维护通知')]
+        self.assertEqual(set(ids), {self.notice.pk, self.drill.pk, self.private.pk})
+        self.assertEqual(ids[-1], self.drill.pk) # 只在正文中命中的排在最后
+        self.assertEqual([pk for pk, _ in backend.search('maint')], [self.drill.pk])
+        self.assertEqual([pk for pk, _ in backend.search('升')], [self.notice.pk])
+
+        backend.remove(self.notice.pk)
+        self.assertNotIn(self.notice.pk, [pk for pk, _ in backend.search('维护')])
+
+    def test_sqlite_backend(self):
+        self.assert_backend_ranks(SQLiteFTSBackend())
+
+    def test_memory_backend(self):
+        self.assert_backend_ranks(InMemorySearchBackend())
+
+    def test_search_respects_visibility(self):
+        results = search_announcements(Announcement.objects.visible_to(self.other), '维护通知')
+        self.assertEqual(list(results), [self.notice, self.drill])
+
+        self.client.force_login(self.user)
+        response = self.client.get('/api/announcements/', {'q': '维护'})
+        self.assertEqual(len(response.json()), 3)
+
+    def test_limit_applies_to_visible_matches(self):
+        # 全局排名最高的是 other 不可见的公告，按收件箱过滤后仍应取到可见结果
+        for backend in (SQLiteFTSBackend(), InMemorySearchBackend()):
+            backend.rebuild(Announcement.objects.all())
+            self.assertEqual(backend.search('维护通知', 1)[0][0], self.private.pk)
+            self.assertEqual([pk for pk, _ in backend.search('维护通知', 1, self.other.pk)], [self.notice.pk])
+        results = search_announcements(Announcement.objects.visible_to(self.other), '维护通知', 1, self.other)
+        self.assertEqual(list(results), [self.notice])
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    键集（游标）分页测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_superuser('admin')
+            publish_at = timezone.now() - timedelta(days=1)
+            for i in range(7):
+                # 故意制造相同的紧急程度和发布时间，验证 id 作为最后的排序键
+                Announcement.objects.create(
+                    title=f'公告{i}', content='内容', author=self.user,
+                    emergency_level='urgent' if i % 3 == 0 else 'low', publish_at=publish_at,
+                )
+        self.client.force_login(self.user)
+        self.expected = list(
+            Announcement.objects.order_by('-emergency_level_numeric', '-publish_at', '-id').values_list('id', flat=True)
+        )
+
+    def test_api_walks_all_pages(self):
+        url = '/api/announcements/?pagination=cursor&page_size=3&with_count=1'
+        seen = []
+        while url:
+            body = self.client.get(url).json()
+            self.assertEqual(body['count'], 7)
+            seen.extend(item['id'] for item in body['results'])
+            url = body['next']
+        self.assertEqual(seen, self.expected)
+
+    def test_default_list_is_unpaginated(self):
+        self.assertEqual(len(self.client.get('/api/announcements/').json()), 7)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/announcements/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_values(self):
+        def encode(values):
+            return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+        for values in ([4, {'a': 1}, 3], [4, 5, 3], ['x', '2025-01-01T00:00:00', 3], [4, None, 3], [[1], [2], [3]]):
+            with self.subTest(values=values):
+                self.assertEqual(self.client.get('/announcements/', {'cursor': encode(values)}).status_code, 404)
+                response = self.client.get('/api/announcements/', {'pagination': 'cursor', 'cursor': encode(values)})
+                self.assertEqual(response.status_code, 404)
+        # 注解字段（搜索排名）同样校验类型
+        params = {'pagination': 'cursor', 'q': '公告'}
+        self.assertEqual(self.client.get('/api/announcements/', {**params, 'cursor': encode([0, 1])}).status_code, 200)
+        for values in ([{'a': 1}, 3], ['x', 3], [None, 3]):
+            with self.subTest(values=values):
+                response = self.client.get('/api/announcements/', {**params, 'cursor': encode(values)})
+                self.assertEqual(response.status_code, 404)
+
+    def test_html_load_more(self):
+        response = self.client.get('/announcements/', {'cursor': '', 'page_size': 4})
+        self.assertEqual([a.pk for a in response.context['announcements']], self.expected[:4])
+        response = self.client.get('/announcements/', {'cursor': response.context['next_cursor'], 'page_size': 4})
+        self.assertEqual([a.pk for a in response.context['announcements']], self.expected[4:])
+        self.assertIsNone(response.context['next_cursor'])
+
+
+class ReadReceiptTests(TestCase):
+    """
+    阅读回执缓冲区测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_superuser('admin')
+            self.announcement = Announcement.objects.create(title='标题', content='内容', author=self.user)
+        self.client.force_login(self.user)
+        self.buffer = ReadReceiptBuffer(autostart=False)
+        patcher = mock.patch('announcements.receipts._buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+        self.addCleanup(caches['announcements_shared'].clear)
+
+    def test_repeat_marks_are_skipped(self):
+        self.assertTrue(self.buffer.mark(self.user.pk, self.announcement.pk))
+        self.assertFalse(self.buffer.mark(self.user.pk, self.announcement.pk))
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_detail_view_is_buffered_and_read_after_write_consistent(self):
+        self.client.get(f'/announcements/{self.announcement.pk}/')
+        self.client.get(f'/api/announcements/{self.announcement.pk}/')
+        self.assertFalse(ReadStatus.objects.exists())
+
+        # 尚未落库时，同一用户的列表已显示为已读
+        self.assertTrue(self.client.get('/api/announcements/').json()[0]['is_read'])
+        response = self.client.get('/api/announcements/my_announcements/', {'read_status': 'unread'})
+        self.assertEqual(response.json(), [])
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertTrue(ReadStatus.objects.filter(user=self.user, announcement=self.announcement).exists())
+
+    def test_pending_overlay_is_shared_and_append_only(self):
+        remember_pending_reads(self.user.pk, [1, 2])
+        remember_pending_reads(self.user.pk, [3]) # 不会覆盖前一次写入
+        forget_pending_reads(self.user.pk, [2])
+        cache.clear() # 覆盖层不在进程内的 default 缓存中
+        self.assertEqual(pending_read_ids(self.user.pk), {1, 3})
+
+    def test_pending_overlay_reads_only_live_operations(self):
+        from ..read_state import _sequence_key, _slot_key
+
+        store = caches['announcements_shared']
+        for announcement_id in range(1, 26):
+            remember_pending_reads(self.user.pk, [announcement_id])
+        store.delete_many([_slot_key(self.user.pk, n) for n in range(1, 21)]) # 模拟较早的操作已过期
+        with mock.patch.object(store, 'get_many', wraps=store.get_many) as get_many:
+            self.assertEqual(pending_read_ids(self.user.pk), set(range(21, 26)))
+        self.assertEqual(get_many.call_count, 1)
+
+        # 序号键随操作一起过期：没有待写入操作的用户只查询一次缓存
+        store.delete(_sequence_key(self.user.pk))
+        with mock.patch.object(store, 'get_many') as get_many:
+            self.assertEqual(pending_read_ids(self.user.pk), set())
+        get_many.assert_not_called()
+
+    @override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='sync')
+    def test_sync_mode(self):
+        self.client.get(f'/announcements/{self.announcement.pk}/')
+        self.assertTrue(ReadStatus.objects.filter(user=self.user, announcement=self.announcement).exists())
+
+    def test_mark_unread_allows_marking_again(self):
+        self.client.get(f'/announcements/{self.announcement.pk}/')
+        self.buffer.flush()
+        read_status = ReadStatus.objects.get(user=self.user, announcement=self.announcement)
+
+        self.client.delete(f'/api/read-status/{read_status.pk}/')
+        self.assertFalse(self.client.get('/api/announcements/').json()[0]['is_read'])
+
+        self.client.get(f'/announcements/{self.announcement.pk}/')
+        self.assertEqual(self.buffer.flush(), 1)
+
+
+class BulkReadStatusTests(TestCase):
+    """
+    批量阅读状态接口和未读数量测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('alice')
+            self.author = User.objects.create_superuser('admin')
+            now = timezone.now()
+            self.announcements = [
+                Announcement.objects.create(
+                    title=f'公告{i}', content='内容', author=self.author, publish_at=now - timedelta(hours=i + 1))
+                for i in range(4)
+            ]
+            self.hidden = Announcement.objects.create(title='内部', content='内容', author=self.author)
+            self.hidden.target_users.set([self.author])
+            self.scheduled = Announcement.objects.create(
+                title='定时', content='内容', author=self.author, publish_at=now + timedelta(days=1))
+        self.client.force_login(self.user)
+        self.addCleanup(cache.clear)
+
+    def unread_count(self):
+        return self.client.get('/api/read-status/unread_count/').json()['unread_count']
+
+    def test_mark_read_and_unread(self):
+        self.assertEqual(self.unread_count(), 4)
+        ids = [a.pk for a in self.announcements[:2]] + [self.hidden.pk]
+        response = self.client.post('/api/read-status/mark_read/', {'ids': ids}, content_type='application/json')
+        self.assertEqual(response.json(), {'marked': 2}) # 不可见的公告被忽略
+        self.assertEqual(self.unread_count(), 2)
+
+        response = self.client.post('/api/read-status/mark_unread/', {'ids': ids}, content_type='application/json')
+        self.assertEqual(response.json(), {'unmarked': 2})
+        self.assertEqual(self.unread_count(), 4)
+
+    def test_create_rejects_scheduled_announcement(self):
+        response = self.client.post('/api/read-status/', {'announcement': self.scheduled.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReadStatus.objects.filter(announcement=self.scheduled).exists())
+
+        response = self.client.post('/api/read-status/', {'announcement': self.announcements[0].pk})
+        self.assertEqual(response.status_code, 201)
+
+    def test_mark_all_read_before(self):
+        before = self.announcements[1].publish_at
+        response = self.client.post(
+            '/api/read-status/mark_all_read/', {'before': before.isoformat()}, content_type='application/json')
+        self.assertEqual(response.json(), {'marked': 3})
+        self.assertEqual(self.unread_count(), 1)
+
+        response = self.client.post('/api/read-status/mark_all_read/', {}, content_type='application/json')
+        self.assertEqual(response.json(), {'marked': 1}) # 未发布和不可见的公告不受影响
+        self.assertEqual(ReadStatus.objects.filter(user=self.user).count(), 4)
+
+    def test_create_read_status(self):
+        response = self.client.post('/api/read-status/', {'announcement': self.announcements[0].pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['announcement'], self.announcements[0].pk)
+        response = self.client.post('/api/read-status/', {'announcement': self.hidden.pk})
+        self.assertEqual(response.status_code, 400)
+
+    def test_read_history_query_budget(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(name='通知')
+            extra = [
+                Announcement.objects.create(title=f'历史{i}', content='内容', author=self.author, category=category)
+                for i in range(20)
+            ]
+        ReadStatus.objects.bulk_create(
+            ReadStatus(user=self.user, announcement=announcement) for announcement in self.announcements + extra
+        )
+        with self.assertNumQueries(3): # 会话、用户、一页阅读记录（连接公告、分类、发布者）
+            response = self.client.get('/api/read-status/?page_size=10')
+        body = response.json()
+        self.assertEqual(len(body['results']), 10)
+        self.assertEqual(body['results'][0]['author_name'], 'admin')
+        self.assertIn(body['results'][0]['category_name'], ('通知', None))
+
+        seen = {item['id'] for item in body['results']}
+        while body['next']:
+            with self.assertNumQueries(3):
+                body = self.client.get(body['next']).json()
+            seen |= {item['id'] for item in body['results']}
+        self.assertEqual(len(seen), 24)
+
+
+class UnreadCounterTests(TestCase):
+    """
+    未读计数增量维护测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('alice')
+            self.author = User.objects.create_user('author')
+            self.announcement = Announcement.objects.create(title='公告', content='内容', author=self.author)
+            self.scheduled = Announcement.objects.create(
+                title='定时', content='内容', author=self.author, publish_at=timezone.now() + timedelta(hours=1))
+        self.addCleanup(cache.clear)
+        self.addCleanup(caches['announcements_shared'].clear)
+
+    def stored_count(self):
+        return UnreadCounter.objects.get(user=self.user).count
+
+    def test_activation_and_reads_adjust_counter(self):
+        self.assertIsNotNone(Announcement.objects.get(pk=self.announcement.pk).activated_at)
+        self.assertIsNone(Announcement.objects.get(pk=self.scheduled.pk).activated_at)
+        self.assertEqual(get_unread_count(self.user), 1)
+
+        # 定时公告到期后由命令生效，计数行直接加一
+        Announcement.objects.filter(pk=self.scheduled.pk).update(publish_at=timezone.now() - timedelta(seconds=1))
+        call_command('publish_due_announcements', stdout=StringIO())
+        self.assertEqual(self.stored_count(), 2)
+        self.assertEqual(get_unread_count(self.user), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            late = User.objects.create_user('bob')
+            self.announcement.target_users.set([late])
+        self.assertEqual(self.stored_count(), 1) # 接收者变化：alice 不再可见
+
+        ReadStatus.objects.create(user=late, announcement=self.scheduled)
+        self.client.force_login(self.user)
+        self.client.post('/api/read-status/mark_read/', {'ids': [self.scheduled.pk]}, content_type='application/json')
+        self.assertEqual(self.stored_count(), 0)
+        self.assertEqual(get_unread_count(self.user), 0)
+
+    @override_settings(ANNOUNCEMENTS_READ_ANALYTICS_MODE='sync')
+    def test_duplicate_receipts_adjust_once(self):
+        from ..read_state import record_reads
+
+        self.assertEqual(get_unread_count(self.user), 1)
+        # 两个进程先后落库同一条回执：只有实际插入的一次计入
+        self.assertEqual(record_reads([(self.user.pk, self.announcement.pk)]), [(self.user.pk, self.announcement.pk)])
+        self.assertEqual(record_reads([(self.user.pk, self.announcement.pk)]), [])
+        self.assertEqual(self.stored_count(), 0)
+        self.assertEqual(AnnouncementReadStats.objects.get(announcement=self.announcement).reads, 1)
+
+    @override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='buffered')
+    def test_pending_reads_are_not_counted(self):
+        from ..receipts import ReadReceiptBuffer
+
+        self.assertEqual(get_unread_count(self.user), 1)
+        buffer = ReadReceiptBuffer(autostart=False)
+        with mock.patch('announcements.receipts._buffer', buffer):
+            self.user.user_permissions.add(Permission.objects.get(codename='view_announcement'))
+            self.client.force_login(self.user)
+            self.assertEqual(self.client.get(f'/api/announcements/{self.announcement.pk}/').status_code, 200)
+            self.assertEqual(self.client.get('/api/read-status/unread_count/').json(), {'unread_count': 0})
+            self.assertEqual(self.stored_count(), 1)
+            buffer.flush()
+        self.assertEqual(self.stored_count(), 0)
+        self.assertEqual(get_unread_count(self.user), 0)
+
+    def test_reconcile_fixes_drift(self):
+        get_unread_count(self.user)
+        UnreadCounter.objects.filter(user=self.user).update(count=7)
+        out = StringIO()
+        call_command('reconcile_unread_counters', stdout=out)
+        self.assertIn('1 个存在漂移', out.getvalue())
+        self.assertEqual(self.stored_count(), 1)
+        self.assertEqual(get_unread_count(self.user), 1)
+
+
+class PushTests(TestCase):
+    """
+    实时推送（代理、补发、背压）测试
+    """
+
+    def setUp(self):
+        self.broker = InMemoryBroker(buffer_size=3, queue_size=2)
+        patcher = mock.patch('announcements.push._broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice = User.objects.create_user('alice')
+            self.bob = User.objects.create_user('bob')
+
+    def subscribe(self, user):
+        async def subscribe():
+            return self.broker.subscribe(user.pk)
+        return self.loop.run_until_complete(subscribe())
+
+    def receive(self, subscription):
+        return self.loop.run_until_complete(asyncio.wait_for(subscription.get(), 1))
+
+    def test_publish_pushes_to_recipients(self):
+        alice, bob = self.subscribe(self.alice), self.subscribe(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            announcement = Announcement.objects.create(
+                title='停电通知', content='内容', author=self.alice, emergency_level='urgent')
+            announcement.target_users.set([self.alice])
+        event = self.receive(alice)
+        self.assertEqual((event.event, event.data['id'], event.data['emergency_level']), ('published', announcement.pk, 'urgent'))
+        self.assertTrue(bob.queue.empty())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            announcement.title = '停电通知（更新）'
+            announcement.save()
+        self.assertEqual(self.receive(alice).event, 'updated')
+
+    def test_backpressure_and_replay(self):
+        subscription = self.subscribe(self.alice)
+        events = [self.broker.publish('published', i, {}, [self.alice.pk]) for i in range(4)]
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.receive(subscription).event, 'resync') # 队列已满，积压被丢弃
+        self.assertEqual(self.receive(subscription).id, events[3].id)
+
+        self.assertEqual([e.id for e in self.broker.events_since(events[1].id)], [events[2].id, events[3].id])
+        self.assertIsNone(self.broker.events_since(events[0].id - 1)) # 已超出缓冲区
+
+    def test_event_stream_replays_visible_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            visible = Announcement.objects.create(title='全员', content='内容', author=self.bob)
+            hidden = Announcement.objects.create(title='仅 bob', content='内容', author=self.bob)
+            hidden.target_users.set([self.bob])
+        published = list(self.broker._history)
+        self.assertEqual([e.announcement_id for e in published], [visible.pk, hidden.pk])
+
+        async def collect(last_event_id):
+            stream = event_stream(self.alice.pk, last_event_id, heartbeat=0.01)
+            try:
+                return await stream.__anext__()
+            finally:
+                await stream.aclose()
+
+        self.assertEqual(async_to_sync(collect)(published[0].id - 1).announcement_id, visible.pk)
+        self.assertEqual(async_to_sync(collect)(published[0].id - 100).event, 'reset')
+        self.assertEqual(self.broker.connection_count(), 0)
+
+
+class SchedulerTests(TestCase):
+    """
+    定时发布调度器测试
+    """
+
+    def setUp(self):
+        self.publish_at = timezone.now() + timedelta(minutes=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('alice')
+            self.announcement = Announcement.objects.create(
+                title='定时', content='内容', author=self.user, publish_at=self.publish_at)
+        self.addCleanup(cache.clear)
+
+    def test_activates_once_when_due(self):
+        scheduler = PublishScheduler()
+        self.assertEqual(scheduler.load(), 1) # 重启后从数据库恢复
+        self.assertEqual(scheduler.next_due(), self.publish_at)
+        self.assertEqual(scheduler.run_pending(self.publish_at - timedelta(seconds=1)), [])
+
+        self.assertEqual(scheduler.run_pending(self.publish_at + timedelta(seconds=2)), [self.announcement.pk])
+        self.assertEqual(scheduler.run_pending(self.publish_at + timedelta(seconds=3)), [])
+        self.assertIsNotNone(Announcement.objects.get(pk=self.announcement.pk).activated_at)
+        self.assertEqual(scheduler.metrics.snapshot()['lag_seconds']['max'], 2)
+        self.assertEqual(scheduler.metrics.activated, 1)
+
+    def test_rescheduled_entry_is_skipped(self):
+        scheduler = PublishScheduler()
+        scheduler.load()
+        later = self.publish_at + timedelta(hours=1)
+        scheduler.schedule(self.announcement.pk, later)
+        self.assertEqual(scheduler.run_pending(self.publish_at + timedelta(seconds=1)), [])
+        self.assertEqual(scheduler.next_due(), later)
+
+        Announcement.objects.filter(pk=self.announcement.pk).update(publish_at=later)
+        self.assertEqual(scheduler.run_pending(later), [self.announcement.pk])
+        self.assertIsNone(scheduler.next_due())
+
+
+def openid_for(user):
+    return f'openid-{user.username}'
+
+
+class DispatchTests(TestCase):
+    """
+    外部通知分发测试（使用本地模拟服务）
+    """
+
+    def setUp(self):
+        self.server = FakeChannelServer().start()
+        self.addCleanup(self.server.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users = [User.objects.create_user(f'user{i}') for i in range(5)]
+            self.announcement = Announcement.objects.create(
+                title='停水通知', content='内容', author=self.users[0], publish_at=timezone.now() + timedelta(hours=1))
+
+    def dispatcher(self, *channels):
+        dispatcher = NotificationDispatcher({c.name: c for c in channels}, max_workers=2, chunk_size=2, backoff_base=0)
+        self.addCleanup(dispatcher.shutdown)
+        return dispatcher
+
+    def test_webhook_batches_and_retries(self):
+        webhook = WebhookChannel('webhook', url=f'{self.server.url}/hook', batch_size=2)
+        self.server.fail_next(2, status=503)
+        result = self.dispatcher(webhook).dispatch(self.announcement)
+        self.assertEqual(result.sent['webhook'], 5)
+        delivered = sorted(r['user_id'] for _, body in self.server.requests for r in body['recipients'])
+        self.assertEqual(delivered, sorted(u.pk for u in self.users))
+        self.assertEqual(self.server.requests[0][1]['announcement']['title'], '停水通知')
+        self.assertFalse(DeadLetter.objects.exists())
+
+    def test_permanent_failures_go_to_dead_letters(self):
+        webhook = WebhookChannel('webhook', url=f'{self.server.url}/hook', batch_size=5)
+        self.server.fail_next(3, status=400) # 每块 2 人，共 3 批
+        with self.assertLogs('announcements.dispatch', 'WARNING'):
+            result = self.dispatcher(webhook).dispatch(self.announcement)
+        self.assertEqual((result.sent['webhook'], result.failed['webhook']), (0, 5))
+        self.assertEqual(DeadLetter.objects.filter(channel='webhook', attempts=1).count(), 5)
+
+    def test_wechat_template_messages(self):
+        wechat = WeChatTemplateChannel(
+            'wechat', api_base=self.server.url, app_id='app', app_secret='secret', template_id='tpl',
+            openid_resolver='announcements.tests.test_announcements.openid_for', max_attempts=2,
+        )
+        self.server.wechat_errors = {'openid-user1': 43004, 'openid-user2': -1}
+        with self.assertLogs('announcements.dispatch', 'WARNING'):
+            result = self.dispatcher(wechat).dispatch(self.announcement)
+        self.assertEqual((result.sent['wechat'], result.failed['wechat']), (3, 2))
+        self.assertEqual(self.server.token_requests, 1)
+        self.assertEqual(
+            dict(DeadLetter.objects.values_list('address', 'attempts')), {'openid-user1': 1, 'openid-user2': 2}
+        )
+
+    @override_settings(ANNOUNCEMENTS_NOTIFICATION_MODE='sync')
+    def test_dispatched_when_published(self):
+        webhook = WebhookChannel('webhook', url=f'{self.server.url}/hook', batch_size=10)
+        with mock.patch('announcements.dispatch._dispatcher', self.dispatcher(webhook)):
+            Announcement.objects.filter(pk=self.announcement.pk).update(publish_at=timezone.now())
+            call_command('publish_due_announcements', stdout=StringIO())
+        self.assertEqual(sum(len(body['recipients']) for _, body in self.server.requests), 5)
+
+
+class RecipientTests(TestCase):
+    """
+    接收者流式展开测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users = [User.objects.create_user(f'user{i}') for i in range(7)]
+            self.group_a = Group.objects.create(name='A')
+            self.group_b = Group.objects.create(name='B')
+            self.group_a.user_set.set(self.users[1:4])
+            self.group_b.user_set.set(self.users[3:6])
+            self.announcement = Announcement.objects.create(title='公告', content='内容', author=self.users[0])
+
+    def test_everyone(self):
+        ids = list(self.announcement.iter_recipient_ids(chunk_size=2))
+        self.assertEqual(ids, sorted(u.pk for u in self.users))
+
+    def test_merges_users_and_groups_without_duplicates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.announcement.target_users.set([self.users[0], self.users[2], self.users[5]])
+            self.announcement.target_groups.set([self.group_a, self.group_b])
+        with self.assertNumQueries(8): # 读取目标用户组 + 两个来源各自按 2 条分页
+            ids = list(self.announcement.iter_recipient_ids(chunk_size=2))
+        self.assertEqual(ids, [u.pk for u in self.users[:6]])
+        self.assertEqual(
+            set(InboxEntry.objects.filter(announcement=self.announcement).values_list('user_id', flat=True)), set(ids)
+        )
+
+    def test_sorted_diff(self):
+        self.assertEqual(
+            list(sorted_diff([1, 3, 4, 7], [2, 3, 7, 9])),
+            [('missing', 1), ('extra', 2), ('missing', 4), ('extra', 9)],
+        )
+
+
+class VisibilityTests(TestCase):
+    """
+    单条公告可见性判断测试（HTML详情页和API详情共用 Announcement.is_visible_to）
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = User.objects.create_user('author')
+            self.alice = User.objects.create_user('alice')
+            self.bob = User.objects.create_user('bob')
+            self.staff = Group.objects.create(name='员工')
+            self.alice.groups.add(self.staff)
+            self.everyone = Announcement.objects.create(title='全员', content='内容', author=self.author)
+            self.direct = Announcement.objects.create(title='指定用户', content='内容', author=self.author)
+            self.direct.target_users.set([self.bob])
+            self.by_group = Announcement.objects.create(title='指定组', content='内容', author=self.author)
+            self.by_group.target_groups.set([self.staff])
+
+    def test_rules(self):
+        self.assertTrue(self.everyone.is_visible_to(self.alice))
+        self.assertTrue(self.direct.is_visible_to(self.bob))
+        self.assertFalse(self.direct.is_visible_to(self.alice))
+        self.assertTrue(self.by_group.is_visible_to(self.alice))
+        self.assertFalse(self.by_group.is_visible_to(self.bob))
+
+    def test_single_query_with_cached_groups(self):
+        with self.assertNumQueries(2): # 首次读取用户组
+            self.assertTrue(self.by_group.is_visible_to(self.alice))
+        with self.assertNumQueries(1):
+            self.assertFalse(self.direct.is_visible_to(self.alice))
+
+    @override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='sync')
+    def test_detail_views(self):
+        self.alice.user_permissions.add(Permission.objects.get(codename='view_announcement'))
+        self.client.force_login(self.alice)
+        response = self.client.get(f'/announcements/{self.direct.pk}/')
+        self.assertRedirects(response, '/announcements/', fetch_redirect_response=False)
+        self.assertEqual(self.client.get(f'/api/announcements/{self.direct.pk}/').status_code, 404)
+
+        self.assertEqual(self.client.get(f'/announcements/{self.by_group.pk}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/announcements/{self.everyone.pk}/').status_code, 200)
+        self.assertEqual(ReadStatus.objects.filter(user=self.alice).count(), 2)
+
+
+class SerializerCacheTests(TestCase):
+    """
+    公告序列化结果缓存测试
+    """
+
+    def setUp(self):
+        for alias in ('announcements', 'announcements_shared'):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+        serializer_cache_metrics.reset()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice = User.objects.create_user('alice')
+            self.bob = User.objects.create_user('bob')
+            self.category = Category.objects.create(name='通知')
+            self.announcements = [
+                Announcement.objects.create(title=f'公告{i}', content='内容', author=self.alice, category=self.category)
+                for i in range(3)
+            ]
+        ReadStatus.objects.create(user=self.alice, announcement=self.announcements[0])
+        permission = Permission.objects.get(codename='view_announcement')
+        self.alice.user_permissions.add(permission)
+        self.bob.user_permissions.add(permission)
+
+    def titles(self, user):
+        self.client.force_login(user)
+        return {item['title']: (item['is_read'], item['category_name']) for item in self.client.get('/api/announcements/').json()}
+
+    def test_bodies_shared_and_read_flags_per_user(self):
+        self.assertEqual(self.titles(self.alice)['公告0'], (True, '通知'))
+        self.assertEqual(self.titles(self.bob)['公告0'], (False, '通知'))
+        stats = serializer_cache_metrics.snapshot()
+        self.assertEqual((stats['misses'], stats['hits']), (3, {'announcements': 3}))
+
+        # 进程内缓存被清空后从共享的文件缓存读取并回填
+        caches['announcements'].clear()
+        self.titles(self.bob)
+        self.assertEqual(serializer_cache_metrics.snapshot()['hits'], {'announcements': 3, 'announcements_shared': 3})
+
+    def test_generation_cached_in_process_and_cull_sampled(self):
+        shared = caches['announcements_shared']
+        generation = body_generation()
+        with mock.patch.object(type(shared), 'get') as get:
+            self.assertEqual(body_generation(), generation)
+            get.assert_not_called()
+        bump_generation()
+        self.assertEqual(body_generation(), generation + 1) # 本进程递增后立即生效
+
+        with mock.patch('django.core.cache.backends.filebased.FileBasedCache._cull') as cull, \
+                mock.patch('announcements.cache_backends.random.random', return_value=0.5):
+            shared.set('key', 1)
+            cull.assert_not_called() # 0.5 * 1000 >= 1：本次不扫描目录
+
+    def test_cache_hit_skips_prefetch(self):
+        def serialize():
+            instances = list(Announcement.objects.select_related('category', 'author'))
+            with CaptureQueriesContext(connection) as queries:
+                serialize_announcements(instances, AnnouncementSerializer, {})
+            return len(queries)
+        self.assertEqual(serialize() - serialize(), 2) # 未命中时才预取 target_users / target_groups
+
+    def test_sparse_fields(self):
+        self.client.force_login(self.bob)
+        item = self.client.get('/api/announcements/').json()[0]
+        self.assertEqual(
+            set(item), {'id', 'title', 'excerpt', 'category_name', 'emergency_level', 'publish_at', 'is_read'},
+        )
+        self.assertEqual(item['excerpt'], '内容')
+
+        response = self.client.get('/api/announcements/?fields=id,is_read')
+        self.assertEqual(response.json()[0], {'id': item['id'], 'is_read': False})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/announcements/?expand=target_users,author')
+        self.assertEqual(response.json()[0]['target_users'], [])
+        self.assertEqual(response.json()[0]['author']['username'], 'alice')
+        self.assertEqual(sum('announcement_target_groups' in query['sql'] for query in queries), 0)
+        self.assertEqual(self.client.get('/api/announcements/?fields=password').status_code, 400)
+
+    def test_invalidation(self):
+        self.titles(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.announcements[1].title = '公告1（修改）'
+            self.announcements[1].save()
+            self.category.name = '新闻'
+            self.category.save()
+        titles = self.titles(self.bob)
+        self.assertIn('公告1（修改）', titles)
+        self.assertEqual({name for _, name in titles.values()}, {'新闻'})
+
+
+@override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='sync')
+class ConditionalRequestTests(TestCase):
+    """
+    ETag 条件请求测试
+    """
+
+    def setUp(self):
+        for alias in ('announcements', 'announcements_shared'):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+        reset_local_generation() # 否则上一个测试的代数最多再保留 GENERATION_TTL 秒，ETag 在测试中途变化
+        # 变更在 captureOnCommitCallbacks 中执行，阅读统计增量登记到不启动后台线程的缓冲区
+        patcher = mock.patch('announcements.receipts._buffer', ReadReceiptBuffer(autostart=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice = User.objects.create_user('alice')
+            self.announcements = [
+                Announcement.objects.create(title=f'公告{i}', content='内容', author=self.alice) for i in range(3)
+            ]
+        self.alice.user_permissions.add(Permission.objects.get(codename='view_announcement'))
+        self.client.force_login(self.alice)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_list_not_modified(self):
+        # 会话、用户 + 最新发布时间（按索引取一行）；列表接口和 HTML 页面另需读取用户权限（两条）
+        for url, queries in (
+            ('/api/announcements/', 5), ('/api/announcements/my_announcements/?read_status=unread', 3), ('/announcements/', 5),
+        ):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            self.assertNotIn('Last-Modified', first)
+            with self.assertNumQueries(queries):
+                second = self.revalidate(url, first)
+            self.assertEqual(second.status_code, 304)
+            self.assertEqual(second.content, b'')
+
+    def test_changes_invalidate(self):
+        url = '/api/announcements/'
+        response = self.client.get(url)
+        changes = [
+            lambda: self.client.post('/api/read-status/mark_read/', {'ids': [self.announcements[0].pk]}),
+            lambda: self.client.post('/api/read-status/mark_unread/', {'ids': [self.announcements[0].pk]}),
+            lambda: Announcement.objects.get(pk=self.announcements[1].pk).save(),
+            lambda: self.announcements[2].target_users.set([User.objects.create_user('bob')]),
+        ]
+        for change in changes:
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(self.client.get(f'{url}?q=公告', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_detail_not_modified(self):
+        url = f'/api/announcements/{self.announcements[0].pk}/'
+        first = self.client.get(url)
+        self.assertTrue(first.json()['is_read'])
+        self.assertEqual(self.revalidate(url, first).status_code, 304)
+        self.assertEqual(ReadStatus.objects.filter(user=self.alice).count(), 1)
+
+    def test_visibility_changes_invalidate(self):
+        group = Group.objects.create(name='研发')
+        with self.captureOnCommitCallbacks(execute=True):
+            bob = User.objects.create_user('bob')
+            Announcement.objects.create(title='研发通知', content='内容', author=self.alice).target_groups.set([group])
+        bob.user_permissions.add(Permission.objects.get(codename='view_announcement'))
+        self.client.force_login(bob)
+        url = '/api/announcements/'
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        # 加入用户组不会改变任何公告的 updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            bob.groups.add(group)
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+        # 接收者变更不会改变 updated_at，详情（包含接收者）不能返回过期的 304
+        detail = f'/api/announcements/{self.announcements[0].pk}/'
+        response = self.client.get(detail)
+        self.assertEqual(self.revalidate(detail, response).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.announcements[0].target_users.set([self.alice, bob])
+        self.assertEqual(self.revalidate(detail, response).status_code, 200)
+
+        # 删除公告
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.announcements[1].delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class RecipientPickerTests(TestCase):
+    """
+    接收者选择器（前缀搜索接口和表单字段）测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin = User.objects.create_superuser('admin')
+            self.users = [User.objects.create_user(f'zhang{i:02d}') for i in range(25)]
+            User.objects.create_user('li')
+            self.group = Group.objects.create(name='研发')
+        self.client.force_login(self.admin)
+
+    def test_prefix_search_pages(self):
+        response = self.client.get('/announcements/recipients/users/?q=zhang&limit=10')
+        body = response.json()
+        self.assertEqual([item['text'] for item in body['results']], [f'zhang{i:02d}' for i in range(10)])
+        names = [item['text'] for item in body['results']]
+        while body['next']:
+            body = self.client.get(f"/announcements/recipients/users/?q=zhang&limit=10&after={body['next']}").json()
+            names += [item['text'] for item in body['results']]
+        self.assertEqual(len(names), 25)
+        self.assertEqual(self.client.get('/announcements/recipients/groups/?q=研').json()['results'][0]['text'], '研发')
+        self.assertEqual(self.client.get('/announcements/recipients/other/').status_code, 404)
+
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get('/announcements/recipients/users/?q=z').status_code, 403)
+
+    def test_form_renders_only_selected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            announcement = Announcement.objects.create(title='公告', content='内容', author=self.admin)
+            announcement.target_users.set(self.users[:2])
+        html = self.client.get(f'/announcements/{announcement.pk}/edit/').content.decode()
+        self.assertIn('zhang00', html)
+        self.assertIn('zhang01', html)
+        self.assertNotIn('zhang02', html)
+        self.assertNotIn('type="checkbox"', html)
+
+    def test_form_validates_ids_in_one_query(self):
+        from ..forms import AnnouncementForm
+
+        data = {
+            'title': '公告', 'content': '内容', 'publish_at': '2026-01-01T08:00', 'emergency_level': 'low',
+            'target_users': [str(user.pk) for user in self.users], 'target_groups': [],
+        }
+        form = AnnouncementForm(data)
+        with self.assertNumQueries(1):
+            form.fields['target_users'].clean(data['target_users'])
+        self.assertTrue(form.is_valid(), form.errors)
+        form.instance.author = self.admin
+        self.assertEqual(form.save().target_users.count(), 25)
+
+        form = AnnouncementForm({**data, 'target_users': [str(self.users[0].pk), '999999']})
+        self.assertFalse(form.is_valid())
+        self.assertIn('target_users', form.errors)
+
+
+class DirectoryApiTests(TestCase):
+    """
+    /api/users/、/api/groups/ 前缀搜索、游标分页和流式输出测试
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin = User.objects.create_superuser('admin')
+            for i in range(12):
+                User.objects.create_user(f'wang{i:02d}')
+            Group.objects.create(name='研发')
+            Group.objects.create(name='市场')
+        self.client.force_login(self.admin)
+
+    def test_prefix_and_cursor(self):
+        body = self.client.get('/api/users/?prefix=wang&page_size=5').json()
+        self.assertEqual([item['username'] for item in body['results']], [f'wang{i:02d}' for i in range(5)])
+        names = []
+        while True:
+            names += [item['username'] for item in body['results']]
+            if not body['next']:
+                break
+            body = self.client.get(body['next']).json()
+        self.assertEqual(len(names), 12)
+
+        compact = self.client.get('/api/groups/?compact=1&prefix=研').json()
+        self.assertEqual([name for _, name in compact['results']], ['研发'])
+
+    def test_prefix_is_an_index_range(self):
+        User.objects.create_user('Wang99')
+        rows, _ = prefix_page(User.objects.all(), 'username', 'wang0', limit=50)
+        self.assertEqual([name for _, name in rows], [f'wang{i:02d}' for i in range(10)]) # 区分大小写
+        self.assertEqual(prefix_successor('wang'), 'wanh')
+
+        sql, params = User.objects.filter(username__gte='wang', username__lt='wanh').values_list('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('SEARCH', plan)
+
+    def test_paginated_and_stream_prefix_agree(self):
+        User.objects.create_user('Wang99')
+        User.objects.create_user('WANGX')
+        paged = self.client.get('/api/users/?prefix=wang&compact=1&page_size=50').json()['results']
+        streamed = json.loads(b''.join(self.client.get('/api/users/?prefix=wang&compact=1&stream=1').streaming_content))
+        self.assertEqual(paged, streamed)
+        self.assertEqual([name for _, name in paged], [f'wang{i:02d}' for i in range(12)])
+
+    def test_stream(self):
+        response = self.client.get('/api/users/?stream=1&compact=1&prefix=wang')
+        self.assertTrue(response.streaming)
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[0][1], 'wang00')
+        rows = json.loads(b''.join(self.client.get('/api/groups/?stream=1').streaming_content))
+        self.assertEqual({row['name'] for row in rows}, {'研发', '市场'})
+
+
+@override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='sync')
+class SeedAndLoadTestTests(TransactionTestCase):
+    """
+    测试数据生成命令和进程内压测（压测在工作线程中使用独立的数据库连接，需要已提交的数据）
+    """
+
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        # 事务真正提交，阅读统计增量会登记到缓冲区；使用不启动后台线程的缓冲区
+        patcher = mock.patch('announcements.receipts._buffer', ReadReceiptBuffer(autostart=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        call_command(
+            'seed_announcements', users=30, groups=4, announcements=40, batch_size=16, seed=7, stdout=StringIO(),
+        )
+
+    def test_seed(self):
+        self.assertEqual(User.objects.filter(username__startswith='load_').count(), 30)
+        self.assertEqual(Announcement.objects.count(), 40)
+        self.assertEqual(check_inbox_consistency(), [])
+        self.assertTrue(ReadStatus.objects.exists())
+        output = StringIO()
+        call_command('reconcile_unread_counters', stdout=output)
+        self.assertIn('其中 0 个存在漂移', output.getvalue())
+
+    def test_load_test(self):
+        users = list(User.objects.filter(username__startswith='load_')[:5])
+        # 测试数据库是共享缓存的内存 SQLite，并发写入会直接报表锁定，这里只用一个工作线程
+        report = run_load_test(users, requests=40, threads=1, seed=1).report()
+        self.assertEqual(report['total']['count'], 40)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertIn('p99_ms', report['list'])
+
+
+@override_settings(ANNOUNCEMENTS_PROFILING_SAMPLE_RATE=1.0, ANNOUNCEMENTS_READ_RECEIPT_MODE='sync')
+class ProfilingTests(TestCase):
+    """
+    请求剖析中间件、SQL 指纹和 hot_queries 汇总测试
+    """
+
+    def setUp(self):
+        for alias in ('announcements', 'announcements_shared'):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+        profiling.set_config()
+        self.addCleanup(profiling.set_config)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice = User.objects.create_user('alice')
+            self.announcement = Announcement.objects.create(title='公告', content='# 标题', author=self.alice)
+        self.alice.user_permissions.add(Permission.objects.get(codename='view_announcement'))
+        self.client.force_login(self.alice)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            profiling.fingerprint('SELECT * FROM t WHERE id IN (%s, %s,  %s) AND name = \'x\' LIMIT 21'),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+
+    def test_request_profile(self):
+        with self.assertLogs('announcements.profiling', 'INFO') as logs:
+            response = self.client.get('/api/announcements/')
+            self.client.get(f'/announcements/{self.announcement.pk}/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", .*serializer;dur=[\d.]+, total;dur=')
+        records = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(records[0]['status'], 200)
+        self.assertGreater(records[0]['queries'], 0)
+        self.assertLessEqual(len(records[0]['slow_queries']), 5)
+        self.assertIn('markdown', records[1]['timings'])
+        self.assertEqual(records[1]['view'], 'announcement_detail')
+
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+            f.writelines(record.getMessage() + '\n' for record in logs.records)
+        self.addCleanup(os.remove, f.name)
+        output = StringIO()
+        call_command('hot_queries', f.name, top=3, stdout=output)
+        self.assertIn('announcement_detail', output.getvalue())
+        self.assertIn('SELECT', output.getvalue())
+
+    async def test_async_request_profile(self):
+        # ASGI 下视图经 sync_to_async 在其他线程中查询数据库，剖析对象经 contextvar 传递
+        await self.async_client.aforce_login(self.alice)
+        with self.assertLogs('announcements.profiling', 'INFO') as logs:
+            response = await self.async_client.get('/api/announcements/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(json.loads(logs.records[0].getMessage())['queries'], 0)
+
+    def test_runtime_toggle(self):
+        call_command('profiling', 'off', stdout=StringIO())
+        self.assertNotIn('Server-Timing', self.client.get('/api/announcements/'))
+        call_command('profiling', 'on', sample_rate=1.0, top=1, stdout=StringIO())
+        with self.assertLogs('announcements.profiling', 'INFO') as logs:
+            self.assertIn('Server-Timing', self.client.get('/api/announcements/'))
+        self.assertEqual(len(json.loads(logs.records[0].getMessage())['slow_queries']), 1)
+
+
+@override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='sync')
+class MetricsTests(TestCase):
+    """
+    /metrics 指标输出、线程分片聚合和多进程快照汇总测试
+    """
+
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice = User.objects.create_user('alice')
+            self.announcement = Announcement.objects.create(title='公告', content='# 标题', author=self.alice)
+        self.client.force_login(self.alice)
+
+    def scrape(self, **extra):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret', **extra).content.decode()
+
+    @override_settings(ANNOUNCEMENTS_METRICS_TOKEN='secret')
+    def test_endpoint(self):
+        self.client.get('/announcements/')
+        self.client.get(f'/announcements/{self.announcement.pk}/')
+        body = self.scrape()
+        for line in (
+            '# TYPE announcements_request_duration_seconds histogram',
+            'announcements_request_duration_seconds_count{view="announcement_detail"}',
+            'announcements_request_duration_seconds_bucket{view="announcement_list",le="+Inf"}',
+            'announcements_visibility_query_seconds_count{query="is_visible_to"}',
+            'announcements_read_receipts_written_total{source="record_reads"}',
+            'announcements_markdown_render_seconds_count',
+            'announcements_publish_lag_seconds_count',
+        ):
+            self.assertIn(line, body)
+        # 经本机反向代理的请求不再默认放行
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        with override_settings(ANNOUNCEMENTS_METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+        User.objects.filter(pk=self.alice.pk).update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_async_middleware(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from notification_system.middleware import MetricsMiddleware
+
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = MetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware)) # ASGI 下不经过 sync_to_async
+        self.assertFalse(iscoroutinefunction(MetricsMiddleware(lambda request: HttpResponse())))
+        self.assertEqual(async_to_sync(middleware)(RequestFactory().get('/')).status_code, 200)
+        self.assertIn('announcements_request_duration_seconds_count{view="unresolved"}', metrics.registry.render())
+
+    def test_thread_shards(self):
+        registry = metrics.Registry()
+        counter = registry.counter('hits_total', '命中次数', ['kind'])
+        histogram = registry.histogram('latency_seconds', '耗时', buckets=(0.1, 1))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(kind='a')
+            histogram.observe(0.5)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        del threads, thread
+        gc.collect()
+        self.assertEqual(registry._shards, [])  # 线程退出后分片并入累计值
+        body = registry.render()
+        self.assertIn('hits_total{kind="a"} 4000', body)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 0', body)
+        self.assertIn('latency_seconds_bucket{le="1"} 4', body)
+        self.assertIn('latency_seconds_count 4', body)
+        with self.assertRaises(ValueError):
+            counter.inc(other='x')
+
+    def test_multiprocess(self):
+        registry = metrics.Registry()
+        counter = registry.counter('hits_total', '命中次数')
+        counter.inc(2)
+        with tempfile.TemporaryDirectory() as directory, override_settings(ANNOUNCEMENTS_METRICS_DIR=directory):
+            # 已退出的进程，pid 与当前进程相同（pid 被复用）
+            other = metrics._Shard()
+            other.counters['hits_total', ()] = 3
+            with open(os.path.join(directory, f'{os.getpid()}-1.json'), 'w', encoding='utf-8') as f:
+                json.dump(metrics._dump(other), f)
+            self.assertIn('hits_total 5', registry.render())
+            self.assertIn('hits_total 5', registry.render()) # 没有覆盖旧进程的快照
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+
+@override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='sync')
+class ReadAnalyticsTests(TestCase):
+    """
+    阅读统计汇总的增量维护、重建、API 和管理后台测试
+    """
+
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin = User.objects.create_superuser('admin')
+            self.group = Group.objects.create(name='研发')
+            self.users = [User.objects.create_user(name) for name in ('alice', 'bob', 'carol')]
+            self.group.user_set.add(*self.users)
+            self.announcement = Announcement.objects.create(title='公告', content='内容', author=self.admin)
+            self.announcement.target_groups.set([self.group])
+        # 生效后接收者再变化不影响受众快照
+        with self.captureOnCommitCallbacks(execute=True):
+            self.announcement.target_users.set([User.objects.create_user('dave')])
+
+    def stats(self):
+        return AnnouncementReadStats.objects.get(announcement=self.announcement)
+
+    @override_settings(ANNOUNCEMENTS_READ_ANALYTICS_MODE='sync')
+    def test_incremental_rollups(self):
+        self.assertEqual(self.stats().audience, 3)
+        alice, bob, carol = self.users
+        self.client.force_login(alice)
+        self.client.post('/api/read-status/mark_read/', {'ids': [self.announcement.pk]}, content_type='application/json')
+        from ..read_state import mark_all_read, mark_unread, record_reads
+        record_reads([(bob.pk, self.announcement.pk), (bob.pk, self.announcement.pk)])
+        mark_all_read(carol)
+        stats = self.stats()
+        self.assertEqual((stats.reads, stats.read_rate), (3, 1.0))
+        self.assertIsNotNone(stats.first_read_at)
+        self.assertEqual(sum(AnnouncementReadHourly.objects.values_list('reads', flat=True)), 3)
+
+        mark_unread(bob, [self.announcement.pk])
+        self.assertEqual(self.stats().reads, 2)
+        call_command('rebuild_read_analytics', stdout=StringIO())
+        stats = self.stats()
+        self.assertEqual((stats.audience, stats.reads), (4, 2))
+        self.assertEqual(sum(AnnouncementReadHourly.objects.values_list('reads', flat=True)), 2)
+
+    def test_deferred_rollups_run_on_buffer_flush(self):
+        # 默认配置：增量在事务提交后登记，由阅读回执缓冲区刷新时累加
+        from ..read_state import mark_all_read, mark_unread, record_reads
+
+        buffer = ReadReceiptBuffer(autostart=False)
+        alice, bob, carol = self.users
+        with mock.patch('announcements.receipts._buffer', buffer):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.force_login(alice)
+                self.client.post('/api/read-status/mark_read/', {'ids': [self.announcement.pk]}, content_type='application/json')
+                mark_all_read(bob)
+            # 回滚的写入不登记增量
+            with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    record_reads([(carol.pk, self.announcement.pk)])
+                    raise RuntimeError
+            self.assertEqual(self.stats().reads, 0)
+            # 汇总行缺失（生效快照之前的公告）时按收件箱人数创建
+            AnnouncementReadStats.objects.all().delete()
+            buffer.flush()
+            stats = self.stats()
+            self.assertEqual((stats.audience, stats.reads), (4, 2))
+            self.assertEqual(sum(AnnouncementReadHourly.objects.values_list('reads', flat=True)), 2)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                mark_unread(bob, [self.announcement.pk])
+            self.assertEqual(self.stats().reads, 2)
+            buffer.flush()
+            self.assertEqual(self.stats().reads, 1)
+
+    @override_settings(ANNOUNCEMENTS_READ_ANALYTICS_MODE='sync')
+    def test_api_and_admin_use_rollups_only(self):
+        from ..read_state import record_reads
+        record_reads([(user.pk, self.announcement.pk) for user in self.users[:2]])
+        self.client.force_login(self.admin)
+        urls = [
+            '/api/read-analytics/', f'/api/read-analytics/{self.announcement.pk}/',
+            '/admin/announcements/announcementreadstats/',
+            f'/admin/announcements/announcementreadstats/{self.announcement.pk}/change/',
+        ]
+        with CaptureQueriesContext(connection) as captured:
+            responses = [self.client.get(url) for url in urls]
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        self.assertFalse([query['sql'] for query in captured if 'announcements_readstatus' in query['sql']])
+
+        detail = responses[1].json()
+        self.assertEqual((detail['audience'], detail['reads']), (3, 2))
+        self.assertAlmostEqual(detail['curve'][-1]['read_rate'], 2 / 3)
+        self.assertEqual(responses[0].json()['results'][0]['announcement'], self.announcement.pk)
+
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get('/api/read-analytics/').status_code, 403)
+
+    def test_read_status_admin_without_fk_filters(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/announcements/readstatus/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'carol')
@@ -0,0 +1,53 @@
+import os
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import TestCase, override_settings
+
+from ..receipts import ReadReceiptBuffer
+from . import budgets
+
+
+# 阅读统计按生产配置延后累加（由回执缓冲区刷新时执行，不计入请求的查询数）
+@override_settings(ANNOUNCEMENTS_READ_RECEIPT_MODE='sync', ANNOUNCEMENTS_READ_ANALYTICS_MODE='deferred')
+class PerformanceBudgetTests(TestCase):
+    """
+    各接口的查询数预算（耗时预算需设置 ANNOUNCEMENTS_TIMING_BUDGETS=1；基线见 benchmarks/budgets.json，
+    说明见 announcements/tests/budgets.py）
+    """
+    dataset = 'small'
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_announcements', prefix='budget', seed=1, stdout=StringIO(), **budgets.DATASETS[cls.dataset],
+        )
+        # 收件箱条目最多的用户
+        cls.user = User.objects.filter(username__startswith='budget_').annotate(
+            inbox=Count('inbox_entries'),
+        ).order_by('-inbox', 'pk').first()
+        cls.user.user_permissions.add(Permission.objects.get(codename='view_announcement'))
+
+    def setUp(self):
+        for alias in ('announcements', 'announcements_shared'):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+        patcher = mock.patch('announcements.receipts._buffer', ReadReceiptBuffer(autostart=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_budgets(self):
+        results = budgets.run_budgets(self.user)
+        if os.environ.get('ANNOUNCEMENTS_RECORD_BUDGETS'):
+            budgets.record_baseline(self.dataset, results)
+            return
+        timing = bool(os.environ.get('ANNOUNCEMENTS_TIMING_BUDGETS'))
+        self.assertEqual(budgets.over_budget(self.dataset, results, budgets.load_baseline(), timing), [])
+
+
+class LargePerformanceBudgetTests(PerformanceBudgetTests):
+    dataset = 'large'
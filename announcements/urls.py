@@ -7,7 +7,9 @@ from .views import (
     AnnouncementCreateView,
     AnnouncementUpdateView,
     AnnouncementDeleteView,
+    RecipientSearchView,
 )
+from .stream import announcement_stream
 from django.contrib.auth import views as auth_views # 导入Django内置的认证视图
 
 urlpatterns = [
@@ -21,6 +23,10 @@ urlpatterns = [
     path('<int:pk>/edit/', AnnouncementUpdateView.as_view(), name='announcement_edit'),
     # 删除公告
     path('<int:pk>/delete/', AnnouncementDeleteView.as_view(), name='announcement_delete'),
+    # 接收者选择器的前缀搜索 (users / groups)
+    path('recipients/<slug:kind>/', RecipientSearchView.as_view(), name='recipient_search'),
+    # 实时推送 (Server-Sent Events)
+    path('stream/', announcement_stream, name='announcement_stream'),
 
     # 登录和登出视图 (如果您没有自定义认证系统，可以使用Django内置的)
     path('login/', auth_views.LoginView.as_view(template_name='announcements/login.html'), name='login'),
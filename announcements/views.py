@@ -1,17 +1,30 @@
 # -*- coding=utf-8 -*-
 
+import hmac
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.urls import reverse_lazy
 from django.db.models import Q
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404, JsonResponse
+from django.views import View
 from django.utils import timezone
 from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.conf import settings
 from django.contrib.auth.models import User, Group
+from django.db import transaction
 
+from .conditional import list_validators, not_modified, set_validators
+from .directory import DIRECTORIES, PAGE_SIZE, search_directory
+from .metrics import registry
 from .models import Announcement, ReadStatus, Category
 from .forms import AnnouncementForm
+from .pagination import KeysetPaginator, InvalidCursor
+from .read_state import with_read_state
+from .receipts import mark_read
+from .search import search_announcements
 
 # 定义公告发布者组的权限
 # 这些权限会在管理命令中创建并分配给相应的组
@@ -27,34 +40,44 @@ class AnnouncementListView(LoginRequiredMixin, ListView):
     公告列表视图：
     - 显示用户可见的公告
     - 支持搜索（标题、内容）
-    - 支持分页，并保存用户偏好
+    - 支持分页，并保存用户偏好；携带 cursor 参数时使用键集分页（无限滚动）
     - 紧急程度优先排序
     - 标记已读/未读状态
+    - 内容未变化时返回 304（见 announcements/conditional.py）
     """
     model = Announcement
     template_name = 'announcements/announcement_list.html'
     context_object_name = 'announcements'
     paginate_by = 10 # 默认每页显示10条
 
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        # 页面还取决于分页偏好和操作按钮对应的权限
+        etag = list_validators(request, user, extra=(
+            request.session.get('announcement_page_size'),
+            *(user.has_perm(permission) for permission in ANNOUNCER_PERMISSIONS),
+        ))
+        # 有待显示的提示消息时必须重新渲染页面
+        storage = messages.get_messages(request)
+        if not len(storage):
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+        return set_validators(super().get(request, *args, **kwargs), etag)
+
     def get_queryset(self):
         user = self.request.user
-        # 获取所有已发布的公告
-        queryset = Announcement.objects.filter(publish_at__lte=timezone.now()).distinct()
-
-        # 过滤用户可见的公告：
-        # 1. 发布给所有用户 (target_users为空且target_groups为空)
-        # 2. 发布给当前用户 (target_users包含当前用户)
-        # 3. 发布给当前用户所属的用户组 (target_groups包含当前用户所属的任何组)
-        queryset = queryset.filter(
-            Q(target_users__isnull=True, target_groups__isnull=True) | # 发布给所有用户
-            Q(target_users=user) | # 发布给当前用户
-            Q(target_groups__in=user.groups.all()) # 发布给当前用户所属的组
-        ).distinct() # 使用distinct防止重复
-
-        # 搜索功能
+        # 获取用户可见且已发布的公告（可见性由收件箱物化表维护，见 announcements/inbox.py）
+        queryset = Announcement.objects.published().visible_to(user).select_related('category', 'author')
+        # 已读标记随主查询一起取回
+        queryset = with_read_state(queryset, user)
+
+        # 搜索功能：有关键词时按相关度排序，否则按紧急程度和发布时间排序
         query = self.request.GET.get('q')
         if query:
-            queryset = queryset.filter(Q(title__icontains=query) | Q(content__icontains=query))
+            queryset = search_announcements(queryset, query, user=user)
+        else:
+            queryset = queryset.order_by('-emergency_level_numeric', '-publish_at', '-id')
 
         # 根据用户偏好设置分页大小
         page_size = self.request.GET.get('page_size')
@@ -64,18 +87,25 @@ class AnnouncementListView(LoginRequiredMixin, ListView):
         elif 'announcement_page_size' in self.request.session:
             self.paginate_by = self.request.session['announcement_page_size']
 
-        return queryset.order_by('-emergency_level_order', '-publish_at') # 按照紧急程度和发布时间排序
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        携带 cursor 参数时使用键集分页，不执行 COUNT(*) 和 OFFSET
+        """
+        if 'cursor' not in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        try:
+            self.keyset_page = KeysetPaginator(queryset, page_size).page(self.request.GET['cursor'])
+        except InvalidCursor:
+            raise Http404("无效的游标。")
+        return (None, None, self.keyset_page.items, self.keyset_page.has_next)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-        # 获取当前用户已读的公告ID列表
-        read_announcement_ids = ReadStatus.objects.filter(user=user).values_list('announcement__id', flat=True)
-
-        # 为每条公告添加 'is_read' 属性
-        for announcement in context['announcements']:
-            announcement.is_read = announcement.id in read_announcement_ids
-
+        if hasattr(self, 'keyset_page'):
+            context['next_cursor'] = self.keyset_page.next_cursor
+        # 每条公告的 'is_read' 属性已由 with_read_state 注解提供
         context['current_page_size'] = self.paginate_by
         context['query'] = self.request.GET.get('q', '')
         context['page_sizes'] = [5, 10, 20, 50] # 可选的分页大小
@@ -91,27 +121,18 @@ class AnnouncementDetailView(LoginRequiredMixin, DetailView):
     template_name = 'announcements/announcement_detail.html'
     context_object_name = 'announcement'
 
-    def get_object(self, queryset=None):
-        obj = super().get_object(queryset)
-        user = self.request.user
-
-        # 检查用户是否有权限查看此公告
-        # 1. 发布给所有用户 (target_users为空且target_groups为空)
-        # 2. 发布给当前用户 (target_users包含当前用户)
-        # 3. 发布给当前用户所属的用户组 (target_groups包含当前用户所属的任何组)
-        is_visible_to_user = (
-            (obj.target_users.count() == 0 and obj.target_groups.count() == 0) or
-            (user in obj.target_users.all()) or
-            (user.groups.filter(id__in=obj.target_groups.all().values_list('id', flat=True)).exists())
-        )
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
 
-        if not is_visible_to_user:
-            messages.error(self.request, "您无权查看此公告。")
+        # 检查用户是否有权限查看此公告（get_object 只能返回对象，无权查看时在这里重定向）
+        if not self.object.is_visible_to(request.user):
+            messages.error(request, "您无权查看此公告。")
             return redirect('announcement_list') # 或者抛出403错误
 
-        # 标记为已读
-        ReadStatus.objects.get_or_create(user=user, announcement=obj)
-        return obj
+        # 标记为已读（写入阅读回执缓冲区，由后台线程批量落库）
+        mark_read(request.user, self.object)
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -134,7 +155,9 @@ class AnnouncementCreateView(LoginRequiredMixin, PermissionRequiredMixin, Create
     def form_valid(self, form):
         form.instance.author = self.request.user # 自动设置发布者为当前用户
         messages.success(self.request, "公告发布成功！")
-        return super().form_valid(form)
+        # 公告与多对多字段在同一事务中保存，提交后只同步一次收件箱
+        with transaction.atomic():
+            return super().form_valid(form)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -162,7 +185,8 @@ class AnnouncementUpdateView(LoginRequiredMixin, PermissionRequiredMixin, Update
 
     def form_valid(self, form):
         messages.success(self.request, "公告更新成功！")
-        return super().form_valid(form)
+        with transaction.atomic():
+            return super().form_valid(form)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -189,3 +213,44 @@ class AnnouncementDeleteView(LoginRequiredMixin, PermissionRequiredMixin, Delete
         # if not self.request.user.is_superuser:
         #     return super().get_queryset().filter(author=self.request.user)
         return super().get_queryset()
+
+class RecipientSearchView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """
+    接收者选择器的搜索接口：
+    - GET /announcements/recipients/users/?q=前缀&after=游标
+    - 返回 {"results": [{"id": ..., "text": ...}], "next": 下一页游标或 null}
+    - 有发布或编辑公告权限的用户可用
+    """
+    def has_permission(self):
+        user = self.request.user
+        return user.has_perm('announcements.add_announcement') or user.has_perm('announcements.change_announcement')
+
+    def get(self, request, kind):
+        if kind not in DIRECTORIES:
+            raise Http404("未知的目录。")
+        limit = request.GET.get('limit', '')
+        rows, next_after = search_directory(
+            kind, request.GET.get('q', ''), request.GET.get('after') or None,
+            int(limit) if limit.isdigit() else PAGE_SIZE,
+        )
+        return JsonResponse({'results': [{'id': pk, 'text': label} for pk, label in rows], 'next': next_after})
+
+
+def _metrics_allowed(request):
+    if request.user.is_staff:
+        return True
+    token = getattr(settings, 'ANNOUNCEMENTS_METRICS_TOKEN', None)
+    if token and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return True
+    # 地址白名单默认为空：反向代理部署时所有请求的 REMOTE_ADDR 都是代理地址
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'ANNOUNCEMENTS_METRICS_ALLOWED_IPS', [])
+
+
+def metrics_view(request):
+    """
+    内部指标（Prometheus 文本格式）：管理员，或携带 Authorization: Bearer <ANNOUNCEMENTS_METRICS_TOKEN> 的请求可以访问；
+    ANNOUNCEMENTS_METRICS_ALLOWED_IPS 为显式开启的地址白名单
+    """
+    if not _metrics_allowed(request):
+        raise PermissionDenied
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
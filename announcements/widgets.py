@@ -0,0 +1,69 @@
+# -*- coding=utf-8 -*-
+
+# announcements/widgets.py
+
+"""
+接收者选择器：表单字段和控件
+- 控件只渲染已选中的选项，候选项由页面脚本按输入的前缀从搜索接口分页加载（见 announcements/directory.py）
+- 字段用一条查询校验提交的ID，只取回主键，不加载模型对象
+"""
+
+from django import forms
+from django.core.exceptions import ValidationError
+
+
+class RecipientPicker(forms.SelectMultiple):
+    """
+    自动补全多选控件
+    """
+    template_name = 'announcements/widgets/recipient_picker.html'
+
+    def __init__(self, search_url, label_field, attrs=None):
+        super().__init__(attrs)
+        self.search_url = search_url
+        self.label_field = label_field
+
+    def optgroups(self, name, value, attrs=None):
+        """
+        只为已选中的值生成选项（一条查询取回名称），而不是遍历全部候选项
+        """
+        ids = [v for v in value if str(v).isdigit()]
+        if not ids:
+            return []
+        rows = self.choices.queryset.filter(pk__in=ids).order_by(self.label_field).values_list('pk', self.label_field)
+        options = [
+            self.create_option(name, pk, label, True, index, attrs=attrs)
+            for index, (pk, label) in enumerate(rows)
+        ]
+        return [(None, options, 0)]
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['search_url'] = str(self.search_url)
+        return context
+
+
+class RecipientChoiceField(forms.ModelMultipleChoiceField):
+    """
+    接收者多选字段：cleaned_data 为主键列表
+    """
+
+    def _check_values(self, value):
+        pk_field = self.queryset.model._meta.pk
+        try:
+            value = frozenset(value)
+        except TypeError:
+            raise ValidationError(self.error_messages['invalid_list'], code='invalid_list')
+        ids = set()
+        for pk in value:
+            self.validate_no_null_characters(pk)
+            try:
+                ids.add(pk_field.to_python(pk))
+            except ValidationError:
+                raise ValidationError(self.error_messages['invalid_pk_value'], code='invalid_pk_value', params={'pk': pk})
+        found = list(self.queryset.filter(pk__in=ids).values_list('pk', flat=True))
+        missing = ids - set(found)
+        if missing:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': min(missing)})
+        return found
+
@@ -0,0 +1,190 @@
+# -*- coding=utf-8 -*-
+
+"""
+列表/可见性热点查询的基准测试（SQLite）：
+
+1. 在独立的 SQLite 数据库中执行迁移，并批量写入公告、收件箱和阅读记录
+   （默认 100 万条公告、5000 万条阅读记录，可通过参数调整规模）
+2. 删除 0005_list_indexes 中新增的索引，输出查询计划和 p50/p99 延迟（before）
+3. 重新创建索引，再次输出查询计划和延迟（after）
+
+用法：
+    python benchmarks/list_queries.py --db /tmp/bench.sqlite3
+    python benchmarks/list_queries.py --announcements 100000 --reads 5000000 --users 5000
+    python benchmarks/list_queries.py --db /tmp/bench.sqlite3 --skip-seed   # 复用已写入的数据
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=str(BASE_DIR / 'bench.sqlite3'), help='基准测试使用的 SQLite 文件')
+    parser.add_argument('--announcements', type=int, default=1_000_000)
+    parser.add_argument('--reads', type=int, default=50_000_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--recipients', type=int, default=60, help='每条公告的接收用户数')
+    parser.add_argument('--iterations', type=int, default=200, help='每个查询的执行次数')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-seed', action='store_true', help='不写入数据，直接使用 --db 中已有的数据')
+    return parser.parse_args()
+
+
+def setup_django(db_path):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notification_system.settings')
+    from django.conf import settings
+
+    # 必须在 django.setup() 之前替换数据库，避免写入开发数据库
+    settings.DATABASES['default']['NAME'] = db_path
+    import django
+
+    django.setup()
+
+
+def seed(args):
+    from django.core.management import call_command
+    from django.db import connection, transaction
+
+    call_command('migrate', verbosity=0)
+    rng = random.Random(args.seed)
+    now = datetime.now(dt_timezone.utc)
+    batch = 50_000
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode = OFF')
+        cursor.execute('PRAGMA synchronous = OFF')
+
+    def insert_many(sql, rows):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    print(f'写入 {args.users} 个用户...')
+    insert_many(
+        'INSERT INTO auth_user (id, password, is_superuser, username, first_name, last_name, email, '
+        'is_staff, is_active, date_joined) VALUES (%s, \'!\', 0, %s, \'\', \'\', \'\', 0, 1, %s)',
+        [(i, f'user{i:06d}', now) for i in range(1, args.users + 1)],
+    )
+
+    levels = [(1, 'low'), (2, 'medium'), (3, 'high'), (4, 'urgent')]
+    reads_per_announcement = min(args.recipients, max(1, args.reads // max(args.announcements, 1)))
+    print(f'写入 {args.announcements} 条公告、收件箱（每条 {args.recipients} 人）和阅读记录（每条 {reads_per_announcement} 人）...')
+    for start in range(1, args.announcements + 1, batch):
+        ids = range(start, min(start + batch, args.announcements + 1))
+        announcements, inbox, reads = [], [], []
+        for announcement_id in ids:
+            numeric, level = rng.choices(levels, weights=[70, 20, 8, 2])[0]
+            # 约 1% 为定时发布（未来时间）
+            publish_at = now + timedelta(minutes=rng.randint(-525_600, 1_440 if rng.random() < 0.01 else -1))
+            announcements.append((announcement_id, f'公告 {announcement_id}', '内容', level, numeric, publish_at, now, now))
+            recipients = rng.sample(range(1, args.users + 1), args.recipients)
+            inbox.extend((user_id, announcement_id, now) for user_id in recipients)
+            reads.extend(
+                (user_id, announcement_id, publish_at + timedelta(minutes=rng.randint(1, 10_000)))
+                for user_id in recipients[:reads_per_announcement]
+            )
+        insert_many(
+            'INSERT INTO announcements_announcement (id, title, content, content_html, content_hash, author_id, '
+            'emergency_level, emergency_level_numeric, publish_at, created_at, updated_at) '
+            'VALUES (%s, %s, %s, \'\', \'\', 1, %s, %s, %s, %s, %s)',
+            announcements,
+        )
+        insert_many('INSERT INTO announcements_inboxentry (user_id, announcement_id, created_at) VALUES (%s, %s, %s)', inbox)
+        insert_many('INSERT INTO announcements_readstatus (user_id, announcement_id, read_at) VALUES (%s, %s, %s)', reads)
+        print(f'  {ids[-1]} / {args.announcements}')
+
+
+def hot_queries(user_ids):
+    """
+    返回 [(名称, 生成查询集的函数)]，与视图中的查询保持一致
+    """
+    from django.contrib.auth.models import User
+
+    from announcements.models import Announcement, ReadStatus
+    from announcements.read_state import with_read_state
+
+    users = list(User.objects.filter(pk__in=user_ids))
+
+    def visible_list(user):
+        queryset = Announcement.objects.published().visible_to(user).select_related('category', 'author')
+        return with_read_state(queryset, user).order_by('-emergency_level_numeric', '-publish_at', '-id')[:20]
+
+    def read_history(user):
+        return ReadStatus.objects.filter(user=user).order_by('-read_at')[:20]
+
+    def due_scan(user):
+        return Announcement.objects.filter(publish_at__gt=datetime.now(dt_timezone.utc)).order_by('publish_at')[:100]
+
+    return users, [('visible_list', visible_list), ('read_history', read_history), ('scheduled_scan', due_scan)]
+
+
+def measure(label, iterations, user_ids):
+    from django.db import connection
+
+    users, queries = hot_queries(user_ids)
+    print(f'\n===== {label} =====')
+    for name, build in queries:
+        sql, params = build(users[0]).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        timings = []
+        for i in range(iterations):
+            queryset = build(users[i % len(users)])
+            started = time.perf_counter()
+            list(queryset)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(f'[{name}] p50={statistics.median(timings):.2f}ms p99={p99:.2f}ms')
+        for line in plan:
+            print(f'    {line}')
+
+
+def set_indexes(enabled):
+    from django.db import connection
+
+    from announcements.models import Announcement, ReadStatus
+
+    with connection.schema_editor() as editor:
+        for model in (Announcement, ReadStatus):
+            for index in model._meta.indexes:
+                editor.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+                if enabled:
+                    editor.add_index(model, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def main():
+    args = parse_args()
+    if not args.skip_seed and os.path.exists(args.db):
+        sys.exit(f'{args.db} 已存在：请删除后重试，或使用 --skip-seed 复用其中的数据')
+    setup_django(args.db)
+    if not args.skip_seed:
+        seed(args)
+
+    rng = random.Random(args.seed)
+    from django.contrib.auth.models import User
+
+    max_user_id = User.objects.order_by('-pk').values_list('pk', flat=True).first()
+    user_ids = [rng.randint(1, max_user_id) for _ in range(50)]
+
+    set_indexes(False)
+    measure('before（无新增索引）', args.iterations, user_ids)
+    set_indexes(True)
+    measure('after（0005_list_indexes）', args.iterations, user_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,4 +13,32 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "notification_system.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 需要在 Django 初始化之后导入
+from django.conf import settings  # noqa: E402
+
+from announcements.scheduler import start_scheduler_thread  # noqa: E402
+from announcements.stream import websocket_application  # noqa: E402
+
+if getattr(settings, 'ANNOUNCEMENTS_SCHEDULER_IN_PROCESS', False):
+    # 在推送连接所在的进程内运行定时发布调度器，使定时公告生效时能直接推送
+    start_scheduler_thread(getattr(settings, 'ANNOUNCEMENTS_SCHEDULER_REFRESH_INTERVAL', 30))
+
+WEBSOCKET_ROUTES = {
+    '/ws/announcements/': websocket_application, # 公告实时推送
+}
+
+
+async def application(scope, receive, send):
+    """
+    HTTP 请求交给 Django 处理，WebSocket 连接按路径分发
+    """
+    if scope['type'] == 'websocket':
+        handler = WEBSOCKET_ROUTES.get(scope['path'])
+        if handler is None:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        return await handler(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,96 @@
+# -*- coding=utf-8 -*-
+
+# notification_system/middleware.py
+
+"""
+同时支持同步和异步（ASGI）调用的中间件：ASGI 部署下请求（包括 SSE / WebSocket 长连接）
+直接在事件循环中经过中间件，不会被 sync_to_async 切换到线程中执行
+"""
+
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from announcements import profiling
+from announcements.metrics import REQUEST_LATENCY
+
+
+class HybridMiddleware:
+    """
+    与 django.utils.decorators.sync_and_async_middleware 相同：按 get_response 的类型选择同步或异步调用
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process(request)
+
+    def process(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+
+class RequestProfilingMiddleware(HybridMiddleware):
+    """
+    按采样率剖析请求：SQL 条数和耗时、最慢的语句指纹、序列化和 Markdown 渲染耗时，
+    写入 announcements.profiling 日志和 Server-Timing 响应头（见 announcements/profiling.py）。
+    采样率为 0 时只读取一次进程内缓存的配置。
+    """
+
+    def _sampled(self):
+        config = profiling.current_config()
+        if random.random() >= config['sample_rate']:
+            return None
+        return profiling.RequestProfile(config['top'])
+
+    def process(self, request):
+        profile = self._sampled()
+        if profile is None:
+            return self.get_response(request)
+        with profile.activate():
+            response = self.get_response(request)
+        profile.report(request, response)
+        return response
+
+    async def __acall__(self, request):
+        profile = self._sampled()
+        if profile is None:
+            return await self.get_response(request)
+        with profile.activate():
+            response = await self.get_response(request)
+        profile.report(request, response)
+        return response
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    按视图（URL 名称）记录请求耗时直方图，由 /metrics 输出（见 announcements/metrics.py）
+    """
+
+    def _observe(self, request, started):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else 'unresolved'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, view=view)
+
+    def process(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, started)
+        return response
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 # notification_system/settings.py
 
 import os
+import tempfile
 from pathlib import Path  # 导入 Path 模块
 
 # 修改 BASE_DIR 使用 pathlib
@@ -39,6 +40,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'notification_system.middleware.MetricsMiddleware', # 按视图记录请求耗时（见 announcements/metrics.py）
+    'notification_system.middleware.RequestProfilingMiddleware', # 按采样率剖析请求（见 announcements/profiling.py）
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -126,3 +129,106 @@ DATABASES = {
         "NAME": BASE_DIR / "db.sqlite3",
     }
 }
+
+# 缓存：default 和 announcements 为进程内的 LRU 缓存，announcements_shared 为多进程共享的文件缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'announcements': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'announcements',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'announcements_shared': {
+        # 平均每 CULL_EVERY 次写入才扫描一次目录判断是否淘汰（见 announcements/cache_backends.py）
+        'BACKEND': 'announcements.cache_backends.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'announcements',
+        'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_EVERY': 1000},
+    },
+}
+
+# 测试期间文件缓存改用临时目录（见 announcements/tests/runner.py）
+TEST_RUNNER = 'announcements.tests.runner.TestRunner'
+
+# 公告系统配置
+
+# 全文搜索后端：'auto'（SQLite 使用 FTS5，PostgreSQL 使用 tsvector，其他数据库使用内存倒排索引）、
+# 'sqlite'、'postgres' 或 'memory'
+ANNOUNCEMENTS_SEARCH_BACKEND = 'auto'
+ANNOUNCEMENTS_SEARCH_LIMIT = 1000 # 单次搜索最多取回的候选公告数量
+
+# 公告序列化结果缓存：按顺序分级查找的缓存别名（见 announcements/api/cache.py）
+ANNOUNCEMENTS_SERIALIZER_CACHES = ['announcements', 'announcements_shared']
+
+# 阅读回执：'buffered' 写入进程内缓冲区后批量落库，'sync' 在请求内同步写入
+ANNOUNCEMENTS_READ_RECEIPT_MODE = 'buffered'
+ANNOUNCEMENTS_READ_RECEIPT_FLUSH_INTERVAL_MS = 200 # 缓冲区刷新间隔（毫秒）
+ANNOUNCEMENTS_READ_RECEIPT_MAX_BATCH = 500 # 缓冲区达到该条数时立即刷新
+ANNOUNCEMENTS_READ_RECEIPT_SEEN_CACHE_SIZE = 100000 # 每个进程“已标记”缓存的容量
+ANNOUNCEMENTS_READ_RECEIPT_SEEN_TTL = 300 # “已标记”缓存的有效期（秒）
+# 阅读统计：'deferred' 由阅读回执缓冲区的后台线程在刷新时批量累加，'sync' 在写入阅读记录的请求内累加
+ANNOUNCEMENTS_READ_ANALYTICS_MODE = 'deferred'
+# 保存尚未落库的已读标记（写后读覆盖层）的缓存：须多进程共享，生产环境应使用 incr 为原子操作的 Redis / Memcached
+ANNOUNCEMENTS_READ_STATE_CACHE = 'announcements_shared'
+# 未读数量计数的缓存：须多进程共享，否则其他进程落库后仍返回旧值（见 announcements/counters.py）
+ANNOUNCEMENTS_COUNTER_CACHE = 'announcements_shared'
+# 条件请求（ETag）验证器使用的版本令牌所在的缓存（需多进程共享，见 announcements/conditional.py）
+ANNOUNCEMENTS_VERSION_CACHE = 'announcements_shared'
+
+# 实时推送（SSE / WebSocket）：代理默认为进程内实现，多进程部署时可替换为基于 Redis 等的实现
+ANNOUNCEMENTS_PUSH_BROKER = 'announcements.push.InMemoryBroker'
+ANNOUNCEMENTS_PUSH_BUFFER_SIZE = 1000 # 保留最近的事件数量，用于按 Last-Event-ID 补发
+ANNOUNCEMENTS_PUSH_QUEUE_SIZE = 100 # 每个连接最多积压的事件数量，超过后通知客户端重新同步
+ANNOUNCEMENTS_PUSH_HEARTBEAT = 15 # 心跳间隔（秒）
+
+# 定时发布调度器：为 True 时在 ASGI 进程内以后台线程运行（否则使用 run_scheduler 命令单独运行）
+ANNOUNCEMENTS_SCHEDULER_IN_PROCESS = False
+ANNOUNCEMENTS_SCHEDULER_REFRESH_INTERVAL = 30 # 从数据库重新加载未生效公告的间隔（秒）
+
+# 外部通知渠道（见 announcements/channels.py），为空时不发送，例如：
+# ANNOUNCEMENTS_NOTIFICATION_CHANNELS = {
+#     'email': {'BACKEND': 'announcements.channels.EmailChannel'},
+#     'webhook': {'BACKEND': 'announcements.channels.WebhookChannel', 'OPTIONS': {'url': 'https://example.com/hook'}},
+#     'wechat': {'BACKEND': 'announcements.channels.WeChatTemplateChannel', 'OPTIONS': {
+#         'app_id': '...', 'app_secret': '...', 'template_id': '...', 'openid_resolver': 'myapp.wechat.openid_for',
+#     }},
+# }
+ANNOUNCEMENTS_NOTIFICATION_CHANNELS = {}
+ANNOUNCEMENTS_NOTIFICATION_MODE = 'background' # 'background' 在后台线程分发，'sync' 在当前线程分发
+ANNOUNCEMENTS_NOTIFICATION_WORKERS = 8 # 并发发送的线程数
+ANNOUNCEMENTS_NOTIFICATION_CHUNK_SIZE = 1000 # 每次从数据库展开的接收者数量
+ANNOUNCEMENTS_SITE_URL = 'http://127.0.0.1:8000' # 生成通知中公告链接使用的站点地址
+
+# 请求剖析（见 announcements/profiling.py）：运行时可用 profiling 命令修改采样率，无需重启
+ANNOUNCEMENTS_PROFILING_SAMPLE_RATE = 0.0 # 被剖析的请求比例，0 表示关闭
+ANNOUNCEMENTS_PROFILING_TOP_QUERIES = 5 # 每个请求记录总耗时最高的前 N 个 SQL 指纹
+ANNOUNCEMENTS_PROFILING_REFRESH_INTERVAL = 5 # 各进程重新读取运行时配置的间隔（秒）
+ANNOUNCEMENTS_PROFILING_CACHE = 'announcements_shared' # 保存运行时配置的缓存（需多进程共享）
+# 剖析日志（每行一个 JSON），hot_queries 命令默认读取；默认写到系统临时目录，不写入源码目录
+ANNOUNCEMENTS_PROFILING_LOG = Path(tempfile.gettempdir()) / 'notification_system-profiling.log'
+
+# 内部指标（/metrics，见 announcements/metrics.py）
+ANNOUNCEMENTS_METRICS_DIR = None # 多进程部署（gunicorn 等）时设为各进程共享的目录，启动前清空；None 为单进程模式
+ANNOUNCEMENTS_METRICS_SYNC_INTERVAL = 5 # 多进程模式下各进程写出快照的间隔（秒）
+ANNOUNCEMENTS_METRICS_TOKEN = None # 抓取 /metrics 使用的令牌（Authorization: Bearer <令牌>），管理员始终可以访问
+ANNOUNCEMENTS_METRICS_ALLOWED_IPS = [] # 无需登录即可访问 /metrics 的地址；反向代理部署时不要加入代理地址（如 127.0.0.1）
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'profiling': {
+            'class': 'logging.FileHandler',
+            'filename': ANNOUNCEMENTS_PROFILING_LOG,
+            'formatter': 'message',
+            'delay': True, # 第一次写入时才创建文件
+        },
+    },
+    'loggers': {
+        'announcements.profiling': {'handlers': ['profiling'], 'level': 'INFO', 'propagate': False},
+    },
+}
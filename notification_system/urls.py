@@ -19,6 +19,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from announcements.views import metrics_view
+
 urlpatterns=[
 path('admin/', admin.site.urls),
 
@@ -26,4 +28,6 @@ path('announcements/',include('announcements.urls')),# 包含公告应用的URL
 
 path('api/',include('announcements.api.urls')),# 包含API应用的URL
 
+path('metrics', metrics_view, name='metrics'),# 内部指标（Prometheus 文本格式）
+
 ]